@@ -0,0 +1,121 @@
+"""
+Named LoRA adapters on the shared Gemma base
+
+Adapters are PEFT LoRA checkpoints loaded onto the one base model already in
+memory. Each request names its adapter (or none for the base model) and a
+batch may mix adapters: PEFT's `adapter_names` routes every row through its
+own LoRA weights in the same forward pass.
+
+Loading and unloading change the model's modules, so the scheduler runs them
+on its worker thread between batches.
+"""
+
+import threading
+import time
+from contextlib import nullcontext
+
+BASE_ADAPTER = "__base__"  # PEFT's name for "no adapter" in a mixed batch
+
+class UnknownAdapterError(KeyError):
+    def __init__(self, name, available):
+        super().__init__(name)
+        self.name = name
+        self.available = available
+
+    def __str__(self):
+        return f"Unknown adapter '{self.name}' (loaded: {', '.join(self.available) or 'none'})"
+
+def parse_adapter_specs(spec):
+    """`name=path,name2=path2` -> {name: path}"""
+    adapters = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, path = item.partition("=")
+        if not sep or not name.strip() or not path.strip():
+            raise ValueError(f"Bad adapter spec '{item}' (expected name=path)")
+        adapters[name.strip()] = path.strip()
+    return adapters
+
+class AdapterRegistry:
+    def __init__(self, model, max_adapters=4):
+        self.base_model = model
+        self.model = model  # becomes a PeftModel once the first adapter is loaded
+        self.max_adapters = max_adapters
+        self.adapters = {}  # name -> {"path", "loaded_at", "load_seconds"}
+        self._lock = threading.Lock()
+
+    @property
+    def peft_loaded(self):
+        return self.model is not self.base_model
+
+    def names(self):
+        with self._lock:
+            return list(self.adapters)
+
+    def version(self, name):
+        """(path, load time) of a loaded adapter, None for the base model or an unknown name"""
+        info = self.adapters.get(name) if name is not None else None
+        return (info["path"], info["loaded_at"]) if info else None
+
+    def check(self, name):
+        """Raise UnknownAdapterError unless `name` is None (base) or loaded"""
+        if name is not None and name not in self.adapters:
+            raise UnknownAdapterError(name, self.names())
+
+    # ---------------- worker thread only ----------------
+
+    def load(self, name, path):
+        if name == BASE_ADAPTER:
+            raise ValueError(f"'{BASE_ADAPTER}' is reserved for the base model")
+        if name in self.adapters:
+            raise ValueError(f"Adapter '{name}' is already loaded")
+        if len(self.adapters) >= self.max_adapters:
+            raise ValueError(f"At most {self.max_adapters} adapters can be loaded (GEMMA_MAX_ADAPTERS)")
+
+        started = time.perf_counter()
+        if self.peft_loaded:
+            self.model.load_adapter(path, adapter_name=name)
+        else:
+            from peft import PeftModel
+            self.model = PeftModel.from_pretrained(self.base_model, path, adapter_name=name)
+        self.model.eval()
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.adapters[name] = {
+                "path": path,
+                "loaded_at": time.time(),
+                "load_seconds": round(elapsed, 2),
+            }
+        print(f"🧩 Adapter '{name}' loaded from {path} in {elapsed:.2f}s")
+        return self.adapters[name]
+
+    def unload(self, name):
+        self.check(name)
+        if len(self.adapters) == 1:
+            # PEFT keeps the deleted name active once none are left; strip the LoRA layers instead
+            self.model.unload()
+            self.model = self.base_model
+        else:
+            self.model.delete_adapter(name)
+        with self._lock:
+            del self.adapters[name]
+        print(f"🧩 Adapter '{name}' unloaded")
+
+    def adapter_names(self, adapters):
+        """PEFT `adapter_names` for a batch's per-row adapters (None before any adapter is loaded)"""
+        if not self.peft_loaded:
+            return None
+        for name in adapters:
+            self.check(name)
+        return [name or BASE_ADAPTER for name in adapters]
+
+    def base_only(self):
+        """Context for forward passes that must see the plain base weights"""
+        return self.model.disable_adapter() if self.peft_loaded else nullcontext()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_adapters": self.max_adapters,
+                "adapters": {name: dict(info) for name, info in self.adapters.items()},
+            }
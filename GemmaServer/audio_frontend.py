@@ -0,0 +1,152 @@
+"""
+Audio front-end - trims what the audio encoder has to look at
+
+Runs on every decoded clip (already mono at the processor's rate, see media_io.py):
+
+• leading/trailing silence is cut, found by a frame-energy detector
+• pauses longer than GEMMA_AUDIO_MAX_PAUSE_MS inside the clip are shortened
+• what is left is capped at GEMMA_AUDIO_MAX_SECONDS, keeping either the start
+  or the window with the most speech
+
+Gemma 3n's audio encoder runs over 10 ms mel frames, so every second removed
+saves 100 encoder frames. Clips in one batch are padded to the longest, so a
+single clip full of silence slows down every row. The feature extractor drops
+audio past 30 s anyway; trimming first means that window holds speech.
+"""
+
+import threading
+
+import numpy as np
+
+FRAME_MS = 25  # energy detector resolution
+LONG_AUDIO_MODES = ("head", "densest")
+
+def frame_db(audio, frame):
+    """RMS level of each `frame`-sample frame in dBFS (the last frame zero-padded)"""
+    count = -(-len(audio) // frame)
+    frames = np.zeros(count * frame, dtype=np.float32)
+    frames[:len(audio)] = audio
+    rms = np.sqrt(np.mean(frames.reshape(count, frame) ** 2, axis=1))
+    return 20 * np.log10(rms + 1e-10)
+
+def _runs(mask):
+    """(start, end) of every run of False in a boolean array"""
+    padded = np.concatenate(([True], mask, [True])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return zip(edges[::2], edges[1::2])
+
+class AudioFrontEnd:
+    """Energy-based silence trimming and a length cap, with running totals of what it saved"""
+
+    def __init__(self, sampling_rate=16000, trim=True, top_db=35.0, floor_db=-60.0, pad_ms=150,
+                 max_pause_ms=1000, max_seconds=30.0, long_audio="head", encoder_frames_per_s=100,
+                 metrics=None):
+        if long_audio not in LONG_AUDIO_MODES:
+            raise ValueError(f"Unknown long-audio mode '{long_audio}' (use {' or '.join(LONG_AUDIO_MODES)})")
+        self.sampling_rate = sampling_rate
+        self.trim = trim
+        self.top_db = top_db  # frames this far below the loudest one count as silence
+        self.floor_db = floor_db  # ... and so does anything quieter than this
+        self.frame = int(sampling_rate * FRAME_MS / 1000)
+        self.pad_frames = -(-pad_ms // FRAME_MS)  # margin kept around speech
+        self.max_pause_frames = max_pause_ms // FRAME_MS  # 0 = keep pauses as they are
+        self.max_samples = int(max_seconds * sampling_rate) if max_seconds else None
+        self.long_audio = long_audio
+        self.encoder_frames_per_s = encoder_frames_per_s
+        self.metrics = metrics
+
+        self._lock = threading.Lock()  # clips are processed on the preprocessing pool
+        self._clips = 0
+        self._trimmed_clips = 0
+        self._capped_clips = 0
+        self._seconds_in = 0.0
+        self._removed = {"silence": 0.0, "pause": 0.0, "length": 0.0}
+
+    def process(self, audio, cap=True):
+        """Mono float32 clip -> the part worth encoding
+
+        `cap=False` skips the length cap (long-audio mode splits the clip into windows instead).
+        """
+        removed = {"silence": 0, "pause": 0, "length": 0}  # samples
+        kept = self._trim(audio, removed) if self.trim else audio
+        if cap:
+            kept = self._cap(kept, removed)
+        self._record(len(audio), removed)
+        return np.ascontiguousarray(kept, dtype=np.float32)
+
+    def _voiced(self, audio):
+        levels = frame_db(audio, self.frame)
+        return levels >= max(levels.max() - self.top_db, self.floor_db)
+
+    def _trim(self, audio, removed):
+        if len(audio) == 0:
+            return audio
+        voiced = self._voiced(audio)
+        if not voiced.any():
+            return audio  # nothing but silence: let the model say so
+
+        # Widen speech by the margin, then drop the edges and shorten long pauses
+        keep = np.convolve(voiced, np.ones(2 * self.pad_frames + 1), mode="same") > 0
+        first, last = np.flatnonzero(keep)[[0, -1]]
+        if not self.max_pause_frames:
+            keep[first:last + 1] = True
+        else:
+            half = self.max_pause_frames // 2
+            for start, end in _runs(keep[first:last + 1]):
+                if end - start > self.max_pause_frames:
+                    keep[first + start:first + start + half] = True
+                    keep[first + end - (self.max_pause_frames - half):first + end] = True
+                else:
+                    keep[first + start:first + end] = True
+
+        mask = np.repeat(keep, self.frame)[:len(audio)]
+        edge_samples = min(first * self.frame, len(audio)) + max(len(audio) - (last + 1) * self.frame, 0)
+        removed["silence"] = int(edge_samples)
+        removed["pause"] = len(audio) - int(mask.sum()) - int(edge_samples)
+        return audio[mask]
+
+    def _cap(self, audio, removed):
+        if self.max_samples is None or len(audio) <= self.max_samples:
+            return audio
+        start = 0
+        if self.long_audio == "densest":
+            window = self.max_samples // self.frame
+            speech = np.convolve(self._voiced(audio), np.ones(window), mode="valid")
+            start = min(int(np.argmax(speech)) * self.frame, len(audio) - self.max_samples)
+        removed["length"] = len(audio) - self.max_samples
+        return audio[start:start + self.max_samples]
+
+    def _record(self, samples_in, removed):
+        seconds = {reason: count / self.sampling_rate for reason, count in removed.items()}
+        seconds_in = samples_in / self.sampling_rate
+        with self._lock:
+            self._clips += 1
+            self._trimmed_clips += bool(removed["silence"] or removed["pause"])
+            self._capped_clips += bool(removed["length"])
+            self._seconds_in += seconds_in
+            for reason, value in seconds.items():
+                self._removed[reason] += value
+        if self.metrics is not None:
+            self.metrics.observe_audio(seconds_in, seconds)
+
+        total = sum(seconds.values())
+        if total:
+            print(f"🎚️ Audio front-end: {seconds_in:.1f}s → {seconds_in - total:.1f}s "
+                  f"(−{total:.1f}s, {round(total * self.encoder_frames_per_s)} encoder frames saved)")
+
+    def stats(self):
+        with self._lock:
+            removed = dict(self._removed)
+            seconds_in = self._seconds_in
+            clips, trimmed, capped = self._clips, self._trimmed_clips, self._capped_clips
+        total = sum(removed.values())
+        return {
+            "clips": clips,
+            "trimmed_clips": trimmed,
+            "capped_clips": capped,
+            "seconds_in": round(seconds_in, 2),
+            "seconds_out": round(seconds_in - total, 2),
+            "seconds_removed": {reason: round(value, 2) for reason, value in removed.items()},
+            "kept_ratio": round((seconds_in - total) / seconds_in, 3) if seconds_in else None,
+            "encoder_frames_saved": round(total * self.encoder_frames_per_s),
+        }
@@ -0,0 +1,80 @@
+"""
+Inference backend selection
+
+GEMMA_DEVICE picks where the model runs:
+
+• cuda – Unsloth 4-bit weights on the GPU (the original setup)
+• cpu  – plain transformers weights in bf16, fp32 or dynamic int8, with
+         tuned intra/inter-op thread pools and no CUDA calls anywhere
+• auto – cuda when a GPU is visible, otherwise cpu
+
+Everything downstream (scheduler, prefix cache, scoring) only sees
+`BACKEND.device`, so no other module hard-codes a device.
+"""
+
+import os
+
+import torch
+
+import config
+
+CPU_DTYPES = ("bf16", "fp32", "int8")
+
+class Backend:
+    def __init__(self, device, cpu_dtype="bf16", threads=0, interop_threads=0):
+        self.device = device
+        self.cpu_dtype = cpu_dtype
+        self.threads = threads
+        self.interop_threads = interop_threads
+
+    @property
+    def is_cuda(self):
+        return self.device == "cuda"
+
+    @property
+    def precision(self):
+        return "4-bit (bitsandbytes)" if self.is_cuda else self.cpu_dtype
+
+    def torch_dtype(self):
+        """Dtype to load CPU weights in (int8 is quantized from fp32 after loading)"""
+        return torch.bfloat16 if self.cpu_dtype == "bf16" else torch.float32
+
+    def configure(self):
+        """Process-wide settings; call before the model is loaded"""
+        if self.is_cuda:
+            return
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:  # only settable before the first parallel op
+                pass
+        print(f"🧮 CPU backend: {self.cpu_dtype} weights, {torch.get_num_threads()} threads")
+
+    def quantize(self, model):
+        """Dynamic int8 for every nn.Linear - CPU only, activations stay float"""
+        if self.is_cuda or self.cpu_dtype != "int8":
+            return model
+        from torch.ao.quantization import quantize_dynamic
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    def describe(self):
+        info = {"device": self.device, "precision": self.precision}
+        if not self.is_cuda:
+            info["threads"] = torch.get_num_threads()
+        return info
+
+def select_backend():
+    device = config.DEVICE
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device not in ("cuda", "cpu"):
+        raise ValueError(f"GEMMA_DEVICE must be auto, cuda or cpu (got '{config.DEVICE}')")
+    if config.CPU_DTYPE not in CPU_DTYPES:
+        raise ValueError(f"GEMMA_CPU_DTYPE must be one of {', '.join(CPU_DTYPES)}")
+
+    threads = config.CPU_THREADS or os.cpu_count() or 1
+    return Backend(device, config.CPU_DTYPE, threads, config.CPU_INTEROP_THREADS)
+
+BACKEND = select_backend()
@@ -0,0 +1,287 @@
+"""
+Offline batch jobs - large JSONL workloads run on idle GPU time
+
+A job is a JSONL file with one request per line:
+
+    {"request_id": "clip-0001", "endpoint": "/ask", "json": {"data": "<base64>", "prompt": "..."}}
+
+Jobs run one at a time, in submission order. Their requests go to the
+scheduler's background queue (see batch_scheduler.py). That queue is only
+served while no live request waits, in batches of GEMMA_JOB_BATCH_SIZE.
+
+Each finished line is appended to results.jsonl straight away. That file is
+the checkpoint: a restarted server resumes an unfinished job from the lines
+that are not in it yet.
+
+    <GEMMA_JOBS_DIR>/<id>/input.jsonl    the submitted lines
+    <GEMMA_JOBS_DIR>/<id>/results.jsonl  request_id, index, status, then response or error
+    <GEMMA_JOBS_DIR>/<id>/state.json     status and counters
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextvars import ContextVar
+
+from cancellation import CancelToken, current_cancel
+from metrics import current_endpoint
+
+# True while a batch-job line is being served; the scheduler queues its requests as background work
+in_batch_job = ContextVar("in_batch_job", default=False)
+
+# How often state.json is rewritten while a job runs (results.jsonl is written per line)
+STATE_SAVE_INTERVAL_S = 1.0
+
+class JobError(ValueError):
+    """A job file that can't be run: bad JSON, unknown endpoint, no requests"""
+
+def parse_job(content, endpoints):
+    """Validate a submitted JSONL file up front, so a job never fails halfway on line syntax"""
+    lines = []
+    for number, raw in enumerate(content.splitlines(), 1):
+        if not raw.strip():
+            continue
+        try:
+            line = json.loads(raw)
+        except ValueError as exc:
+            raise JobError(f"Line {number}: not valid JSON ({exc})") from exc
+        if not isinstance(line, dict) or line.get("endpoint") not in endpoints:
+            raise JobError(f"Line {number}: `endpoint` must be one of {', '.join(sorted(endpoints))}")
+        if not isinstance(line.get("json", {}), dict):
+            raise JobError(f"Line {number}: `json` must be an object")
+        lines.append(line)
+    if not lines:
+        raise JobError("Job file has no requests")
+    return lines
+
+def read_results(path):
+    """Records already written to results.jsonl, dropping a line cut short by a crash"""
+    if not os.path.exists(path):
+        return []
+    records, good_bytes = [], 0
+    with open(path, "rb") as f:
+        for raw in f:
+            try:
+                records.append(json.loads(raw))
+            except ValueError:
+                break
+            good_bytes += len(raw)
+    if good_bytes != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good_bytes)
+    return records
+
+class Job:
+    def __init__(self, directory, state):
+        self.directory = directory
+        self.state = state  # persisted as state.json
+        self.token = CancelToken()  # DELETE /jobs/{id} trips it
+        self.run_started = None  # when this process started working on the job
+        self.run_finished = 0  # lines finished since then, for throughput
+
+    @property
+    def id(self):
+        return self.state["id"]
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self):
+        tmp = self.path("state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path("state.json"))
+
+    def progress(self):
+        state = self.state
+        finished = state["succeeded"] + state["failed"]
+        elapsed = time.perf_counter() - self.run_started if self.run_started else 0.0
+        rate = self.run_finished / elapsed if elapsed > 0 else 0.0
+        running = state["status"] == "running"
+        return {
+            **state,
+            "finished": finished,
+            "progress": round(finished / state["total"], 4),
+            "lines_per_s": round(rate, 2) if running else None,
+            "eta_s": round((state["total"] - finished) / rate, 1) if running and rate else None,
+        }
+
+class JobManager:
+    """Stores submitted jobs on disk and feeds their lines to the scheduler at low priority
+
+    `handlers` maps an endpoint path to a coroutine taking the line's `json` and
+    returning the response body. `describe_error(exc)` turns a failed line into
+    `{"error", "status"}`.
+    """
+
+    def __init__(self, handlers, describe_error, directory="jobs", concurrency=32):
+        self.handlers = handlers
+        self.describe_error = describe_error
+        self.directory = directory
+        self.concurrency = concurrency  # lines in flight: enough to fill two background batches
+        self.jobs = {}
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        """Reload jobs from disk, requeue unfinished ones, start the runner"""
+        os.makedirs(self.directory, exist_ok=True)
+        unfinished = []
+        for job_id in os.listdir(self.directory):
+            state_path = os.path.join(self.directory, job_id, "state.json")
+            if not os.path.exists(state_path):
+                continue
+            with open(state_path) as f:
+                job = Job(os.path.join(self.directory, job_id), json.load(f))
+            self.jobs[job.id] = job
+            if job.state["status"] in ("queued", "running"):
+                unfinished.append(job)
+        for job in sorted(unfinished, key=lambda j: j.state["created_at"]):
+            self._queue.put_nowait(job.id)
+        if unfinished:
+            print(f"🗂️ Resuming {len(unfinished)} unfinished batch jobs")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the runner; a job cut off here stays `running` and resumes on the next start"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    # ---------------- public API ----------------
+
+    async def submit(self, content, name=None):
+        lines = await asyncio.to_thread(parse_job, content, self.handlers)
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(os.path.join(self.directory, job_id), {
+            "id": job_id,
+            "name": name,
+            "status": "queued",
+            "total": len(lines),
+            "succeeded": 0,
+            "failed": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        })
+
+        def write():
+            os.makedirs(job.directory)
+            with open(job.path("input.jsonl"), "wb") as f:
+                f.write(content)
+            job.save()
+
+        await asyncio.to_thread(write)
+        self.jobs[job_id] = job
+        self._queue.put_nowait(job_id)
+        print(f"🗂️ Batch job {job_id} queued: {len(lines)} requests")
+        return job
+
+    def cancel(self, job):
+        if job.state["status"] in ("queued", "running"):
+            job.token.cancel("cancelled")
+            if job.state["status"] == "queued":
+                self._finish(job, "cancelled")
+
+    def stats(self):
+        statuses = [job.state["status"] for job in self.jobs.values()]
+        return {
+            "by_status": {status: statuses.count(status)
+                          for status in ("queued", "running", "completed", "cancelled", "failed")},
+            "jobs": [job.progress() for job in sorted(self.jobs.values(),
+                                                       key=lambda j: j.state["created_at"], reverse=True)],
+        }
+
+    # ---------------- runner ----------------
+
+    def _finish(self, job, status, error=None):
+        job.state.update(status=status, finished_at=time.time(), error=error)
+        job.save()
+
+    async def _run(self):
+        # Every request made from this task (and the tasks it spawns) is background work
+        in_batch_job.set(True)
+        current_endpoint.set("batch_job")
+        while True:
+            job = self.jobs[await self._queue.get()]
+            if job.state["status"] not in ("queued", "running"):
+                continue  # cancelled while queued
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                print(f"❌ Batch job {job.id} failed: {exc!r}")
+                self._finish(job, "failed", repr(exc))
+
+    def _load_lines(self, job):
+        with open(job.path("input.jsonl"), "rb") as f:
+            return parse_job(f.read(), self.handlers)
+
+    async def _run_job(self, job):
+        lines = await asyncio.to_thread(self._load_lines, job)
+        done = await asyncio.to_thread(read_results, job.path("results.jsonl"))
+        finished = {record["index"] for record in done}
+        job.state.update(
+            status="running",
+            started_at=job.state["started_at"] or time.time(),
+            succeeded=sum(record["status"] < 400 for record in done),
+            failed=sum(record["status"] >= 400 for record in done),
+        )
+        job.run_started, job.run_finished = time.perf_counter(), 0
+        job.save()
+        print(f"🗂️ Batch job {job.id} running: {len(lines) - len(finished)} of {len(lines)} requests left")
+
+        current_cancel.set(job.token)
+        window = asyncio.Semaphore(self.concurrency)
+        saved_at = time.perf_counter()
+
+        with open(job.path("results.jsonl"), "a") as results:
+            async def run(index, line):
+                nonlocal saved_at
+                async with window:
+                    if job.token.check() is not None:
+                        return
+                    record = {"request_id": line.get("request_id", str(index)), "index": index}
+                    handler = self.handlers[line["endpoint"]]
+                    try:
+                        record.update(status=200, response=await handler(line.get("json", {})))
+                    except Exception as exc:
+                        if job.token.check() is not None:
+                            return  # cancelled lines are not results
+                        record.update(self.describe_error(exc))
+                results.write(json.dumps(record) + "\n")
+                results.flush()
+                job.state["succeeded" if record["status"] < 400 else "failed"] += 1
+                job.run_finished += 1
+                if time.perf_counter() - saved_at >= STATE_SAVE_INTERVAL_S:
+                    saved_at = time.perf_counter()
+                    job.save()
+
+            await asyncio.gather(*(run(i, line) for i, line in enumerate(lines) if i not in finished))
+
+        if job.token.check() is not None:
+            self._finish(job, "cancelled")
+            print(f"🗂️ Batch job {job.id} cancelled")
+            return
+
+        def sort_results():
+            # Lines finish out of order; hand back results in input order
+            records = sorted(read_results(job.path("results.jsonl")), key=lambda r: r["index"])
+            tmp = job.path("results.jsonl.tmp")
+            with open(tmp, "w") as f:
+                f.writelines(json.dumps(record) + "\n" for record in records)
+            os.replace(tmp, job.path("results.jsonl"))
+
+        await asyncio.to_thread(sort_results)
+        self._finish(job, "completed")
+        print(f"✅ Batch job {job.id} completed: {job.state['succeeded']} succeeded, "
+              f"{job.state['failed']} failed")
@@ -0,0 +1,759 @@
+"""
+Dynamic batching scheduler for Gemma-3n generation
+
+Concurrent /generate, /ask_image and /ask calls are queued here, packed into
+left-padded batches and decoded together by a single worker thread. Every
+handler awaits its own asyncio future and only ever sees its own reply.
+
+Batch-job requests wait in a separate background queue. It is served only
+when no live request is queued and live traffic has paused for a moment.
+"""
+
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import torch
+from transformers import BatchEncoding, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+from adapters import UnknownAdapterError
+from batch_jobs import in_batch_job
+from cancellation import CancellationCriteria, CancelToken, RequestCancelled, current_cancel, watching
+from choices import ChoiceConstraint, ChoiceLogitsProcessor
+from media_io import decode_messages, processor_sampling_rate
+from scoring import candidate_token_ids, score_candidates
+from streaming import AsyncTextStreamer
+
+# Token-aligned tensors that get left-padded when requests share a batch
+SEQUENCE_KEYS = ("input_ids", "attention_mask", "token_type_ids")
+
+# --------------------------------------------------------------------
+# Batch assembly helpers
+# --------------------------------------------------------------------
+
+def generation_params(max_tokens, use_sampling, eos_token_id):
+    """model.generate kwargs shared by every request in a batch"""
+    params = {
+        "max_new_tokens": max_tokens,
+        "pad_token_id": eos_token_id,
+        "eos_token_id": eos_token_id,
+    }
+
+    if use_sampling:
+        # Tutorial settings for more natural responses
+        params.update({
+            "temperature": 1.0,
+            "top_p": 0.95,
+            "top_k": 64,
+        })
+    else:
+        # Greedy decoding for consistent text responses
+        params["do_sample"] = False
+
+    return params
+
+def _left_pad(tensor, length, value):
+    padded = tensor.new_full((tensor.shape[0], length), value)
+    padded[:, length - tensor.shape[-1]:] = tensor
+    return padded
+
+def _zero_pad(tensor, shape):
+    """Right-pad every non-batch dim of a media tensor (e.g. audio frames)"""
+    if list(tensor.shape[1:]) == shape:
+        return tensor
+    padded = tensor.new_zeros([tensor.shape[0]] + shape)
+    padded[tuple(slice(0, n) for n in tensor.shape)] = tensor
+    return padded
+
+def pad_batch(encodings, pad_token_id, media_index=None):
+    """Merge single-request encodings into one left-padded batch
+
+    With `media_index` (row -> unique upload), media tensors are only included
+    once per unique upload and the encoder hook fans the features back out.
+    """
+    if len(encodings) == 1:
+        return encodings[0]
+
+    unique_media = encodings
+    if media_index is not None:
+        first_rows = {}
+        for row, slot in enumerate(media_index):
+            first_rows.setdefault(slot, row)
+        unique_media = [encodings[row] for row in first_rows.values()]
+
+    seq_len = max(e["input_ids"].shape[-1] for e in encodings)
+    batch = {}
+    for key in encodings[0].keys():
+        if key in SEQUENCE_KEYS:
+            value = pad_token_id if key == "input_ids" else 0
+            tensors = [_left_pad(e[key], seq_len, value) for e in encodings]
+        else:
+            tensors = [e[key] for e in unique_media]
+            shape = [max(dims) for dims in zip(*(t.shape[1:] for t in tensors))]
+            tensors = [_zero_pad(t, shape) for t in tensors]
+        batch[key] = torch.cat(tensors, dim=0)
+
+    return BatchEncoding(batch)
+
+class TokenBudgetCriteria(StoppingCriteria):
+    """Finishes each row once it has generated its own `max_tokens`
+
+    generate() only takes one max_new_tokens (the largest in the batch), so without
+    this a short-budget row that never emits EOS keeps the whole batch decoding
+    tokens that are thrown away.
+    """
+
+    def __init__(self, budgets, prompt_len):
+        self.budgets = torch.tensor(budgets)
+        self.prompt_len = prompt_len
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.budgets.device != input_ids.device:
+            self.budgets = self.budgets.to(input_ids.device)  # once; later steps stay on device
+        return self.budgets <= input_ids.shape[-1] - self.prompt_len
+
+# --------------------------------------------------------------------
+# Requests
+# --------------------------------------------------------------------
+
+class QueueFullError(Exception):
+    """Raised when the pending queue is at capacity"""
+
+    def __init__(self, depth, retry_after):
+        super().__init__(f"Inference queue full ({depth} pending)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+class GenerationRequest:
+    """One queued generation plus the future its handler is awaiting"""
+
+    def __init__(self, inputs, max_tokens, use_sampling, loop, streamer=None):
+        self.inputs = inputs
+        self.max_tokens = max_tokens
+        self.use_sampling = use_sampling
+        self.loop = loop
+        self.streamer = streamer
+        self.prefix = None  # PrefixEntry when a cached prefix KV can be reused (only if it runs alone)
+        self.media_key = None  # digest of the upload, shared by multi-prompt requests
+        self.future = loop.create_future()
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.endpoint = None  # metrics label of the HTTP endpoint that queued it
+        self.choices = None  # ChoiceConstraint when the reply must be one of a fixed set
+        self.candidates = None  # token ids per candidate for a /score request (no generation)
+        self.adapter = None  # LoRA adapter name, None = base model
+        self.task = None  # maintenance callable run on the worker (e.g. adapter load)
+        self.speculative = None  # stats dict when decoding with the draft model
+        self.cancel = None  # CancelToken; maintenance tasks have none and always run
+        self.background = False  # batch-job request: runs only while live traffic is idle
+
+    @property
+    def solo(self):
+        # Streamers and scoring passes only handle batch size 1. A cached prefix
+        # doesn't make a request solo: it is dropped when others join its batch.
+        return (self.streamer is not None or self.candidates is not None
+                or self.task is not None or self.speculative is not None)
+
+    @property
+    def batch_key(self):
+        # Solo requests get a key of their own
+        if self.solo:
+            return ("solo", id(self))
+        # Only requests with the same sampling mode and the same kind of
+        # media tensors can share one generate() call
+        return (self.use_sampling, tuple(sorted(self.inputs.keys())))
+
+    def _settle(self, result, error):
+        if self.future.done():  # handler went away
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+    def resolve(self, result):
+        self.loop.call_soon_threadsafe(self._settle, result, None)
+
+    def fail(self, error):
+        self.loop.call_soon_threadsafe(self._settle, None, error)
+
+# --------------------------------------------------------------------
+# Scheduler
+# --------------------------------------------------------------------
+
+class BatchScheduler:
+    """Collects pending requests and decodes them in padded batches"""
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_wait_ms=15,
+                 max_queue_size=64, device="cuda", prefix_cache=None, media_encoder=None,
+                 metrics=None, adapters=None, speculative=None, disconnect_poll_ms=250,
+                 preprocess_threads=0, background_batch_size=None, background_idle_ms=100,
+                 audio_frontend=None, image_prestage=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.device = device
+        self.prefix_cache = prefix_cache
+        self.media_encoder = media_encoder
+        self.metrics = metrics
+        self.adapters = adapters  # AdapterRegistry; owns the (possibly PEFT-wrapped) model
+        self.speculative = speculative  # SpeculativeDecoder, None when no draft model is loaded
+        self.disconnect_poll_s = disconnect_poll_ms / 1000
+        # Upload decoding + chat template, in parallel off the event loop (None = asyncio's default pool)
+        self._preprocess_pool = ThreadPoolExecutor(
+            preprocess_threads, thread_name_prefix="gemma-preprocess"
+        ) if preprocess_threads else None
+        self.background_batch_size = background_batch_size or max_batch_size
+        self.background_idle_s = background_idle_ms / 1000
+        self.sampling_rate = processor_sampling_rate(tokenizer)
+        self.audio_frontend = audio_frontend  # AudioFrontEnd run on every decoded clip, or None
+        self.image_prestage = image_prestage  # ImagePreStage decoding every image, or None
+
+        self._pending = deque()
+        self._background = deque()  # batch-job requests, unbounded: the job runner limits them
+        self._last_live_at = 0.0  # when the last live request was queued
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # Occupancy bookkeeping
+        self._recent_batches = deque(maxlen=200)
+        self._recent_batch_seconds = deque(maxlen=50)
+        self._recent_waits = deque(maxlen=200)
+        self._rejected = 0
+        self._batches_run = 0
+        self._requests_served = 0
+        self._cancelled = Counter()  # (stage, reason) -> requests
+        self._tokens_saved = 0
+        self._prefix_skipped = 0  # prefix-cache hits prefilled in full to share a batch
+        self.last_success_at = None  # wall-clock time of the last batch that completed
+
+    # ---------------- lifecycle ----------------
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, name="gemma-batcher", daemon=True)
+        self._thread.start()
+        print(f"📦 Batch scheduler started (max_batch_size={self.max_batch_size}, "
+              f"max_wait_ms={self.max_wait_ms}, max_queue_size={self.max_queue_size})")
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            leftovers = list(self._pending) + list(self._background)
+            self._pending.clear()
+            self._background.clear()
+            self._cond.notify_all()
+        for request in leftovers:
+            request.fail(RuntimeError("Scheduler shut down"))
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._preprocess_pool is not None:
+            self._preprocess_pool.shutdown(wait=False)
+
+    @property
+    def alive(self):
+        return self._running and self._thread is not None and self._thread.is_alive()
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    @property
+    def background_depth(self):
+        return len(self._background)
+
+    # ---------------- public API ----------------
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        with self._cond:
+            depth = len(self._pending)
+            timings = list(self._recent_batch_seconds)
+        per_batch = sum(timings) / len(timings) if timings else 1.0
+        batches_ahead = depth / self.max_batch_size + 1
+        return max(1, round(batches_ahead * per_batch))
+
+    def _reject(self, depth):
+        self._rejected += 1
+        raise QueueFullError(depth, self.retry_after())
+
+    def encode(self, messages):
+        """Decode uploads and apply the chat template for one request (runs off the event loop)"""
+        return self.tokenizer.apply_chat_template(
+            decode_messages(messages, self.sampling_rate, self.audio_frontend, self.image_prestage),
+            add_generation_prompt=True,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+        )
+
+    async def submit(self, messages, max_tokens=256, use_sampling=True, media_key=None, choices=None,
+                     adapter=None, speculative=None):
+        """Queue one chat request and wait for its decoded reply
+
+        Pass a dict as `speculative` to decode greedily with the draft model;
+        it is filled with that request's acceptance/speedup stats.
+        """
+        self._admit(1)
+        request = await self._prepare(messages, max_tokens, use_sampling, media_key=media_key,
+                                      choices=choices, adapter=adapter, speculative=speculative)
+        self._push([request])
+        return await self._wait(request)
+
+    async def submit_many(self, messages_list, max_tokens=256, use_sampling=True, media_key=None,
+                          choices_list=None, adapter=None):
+        """Queue several prompts over one upload together so they land in one batch
+
+        `choices_list` optionally gives each prompt its own allowed answers (or None).
+        """
+        requests = await self._queue_many(messages_list, max_tokens, use_sampling, media_key, choices_list,
+                                          adapter)
+        return list(await asyncio.gather(*(self._wait(r) for r in requests)))
+
+    async def submit_each(self, messages_list, max_tokens=256, use_sampling=True, adapter=None):
+        """Queue prompts together like submit_many, but return one awaitable per prompt
+
+        Lets the caller report each reply as soon as its batch is decoded.
+        """
+        requests = await self._queue_many(messages_list, max_tokens, use_sampling, adapter=adapter)
+        return [self._wait(r) for r in requests]
+
+    async def _queue_many(self, messages_list, max_tokens, use_sampling, media_key=None, choices_list=None,
+                          adapter=None):
+        self._admit(len(messages_list))
+        choices_list = choices_list or [None] * len(messages_list)
+        requests = await asyncio.gather(*(
+            self._prepare(messages, max_tokens, use_sampling, media_key=media_key, choices=choices,
+                          adapter=adapter)
+            for messages, choices in zip(messages_list, choices_list)
+        ))
+        self._push(requests)
+        return requests
+
+    async def submit_batch(self, groups, max_tokens=256, use_sampling=True, adapter=None):
+        """Queue many uploads in one call; results come back in order
+
+        Each group is `(messages_list, media_key, choices_list)`, i.e. one upload
+        and the prompts asked about it. A group's result is its list of replies,
+        or the exception it failed with, so one bad upload never fails the rest.
+        Only about two batches' worth of rows are in the queue at a time: the next
+        batch is preprocessed while the current one decodes, and a large call
+        can't fill the queue on its own.
+        """
+        if self.adapters is not None:
+            self.adapters.check(adapter)  # a bad name fails the call, not every item
+        rows = max(len(group[0]) for group in groups) if groups else 1
+        window = asyncio.Semaphore(max(1, 2 * self.max_batch_size // rows))
+
+        async def run(messages_list, media_key, choices_list):
+            async with window:
+                try:
+                    return await self.submit_many(messages_list, max_tokens, use_sampling, media_key,
+                                                  choices_list, adapter)
+                except Exception as exc:
+                    return exc
+
+        return list(await asyncio.gather(*(run(*group) for group in groups)))
+
+    async def submit_stream(self, messages, max_tokens=256, use_sampling=True, media_key=None,
+                            adapter=None):
+        """Queue one chat request and return an async iterator over its text chunks"""
+        self._admit(1)
+        request = await self._prepare(messages, max_tokens, use_sampling, stream=True, media_key=media_key,
+                                      adapter=adapter)
+        self._push([request])
+        return self._iter_stream(request)
+
+    async def submit_score(self, messages, candidates, media_key=None, adapter=None):
+        """Queue a scoring pass: (log-probability, token count) per candidate completion"""
+        self._admit(1)
+        request = await self._prepare(messages, 1, False, media_key=media_key, adapter=adapter)
+        request.prefix = None  # scoring runs its own prefill
+        request.candidates = candidate_token_ids(self.tokenizer, candidates)
+        self._push([request])
+        return await self._wait(request)
+
+    async def run_on_worker(self, task):
+        """Run `task()` on the worker thread between batches (model changes must not race generate)"""
+        if not self._running:
+            raise RuntimeError("Scheduler is not running")
+        request = GenerationRequest(None, 0, False, asyncio.get_running_loop())
+        request.task = task
+        with self._cond:
+            self._pending.appendleft(request)  # maintenance jumps the queue and is never shed
+            self._cond.notify()
+        return await request.future
+
+    async def _wait(self, request):
+        """Await a reply, cancelling the request if its client goes away first"""
+        try:
+            async with watching(request.cancel, self.disconnect_poll_s):
+                return await request.future
+        except asyncio.CancelledError:
+            request.cancel.cancel("abandoned")
+            raise
+
+    async def _iter_stream(self, request):
+        try:
+            async with watching(request.cancel, self.disconnect_poll_s):
+                async for chunk in request.streamer:
+                    yield chunk
+                await request.future  # re-raises a failed generation
+        finally:
+            if not request.future.done():
+                request.cancel.cancel("abandoned")  # stream closed before the reply finished
+
+    def _speculative_unavailable(self, adapter, constraint):
+        if self.speculative is None:
+            return "no draft model loaded (GEMMA_DRAFT_MODEL_NAME)"
+        if adapter is not None:
+            return "not supported with adapters"
+        if constraint is not None:
+            return "not needed with choices"
+        return None
+
+    def _admit(self, count):
+        """Shed load before paying for preprocessing"""
+        if not self._running:
+            raise RuntimeError("Scheduler is not running")
+        if in_batch_job.get():
+            return  # background work never takes a live queue slot
+        depth = self.queue_depth
+        if depth + count > self.max_queue_size:
+            self._reject(depth)
+
+    async def _prepare(self, messages, max_tokens, use_sampling, stream=False, media_key=None,
+                       choices=None, adapter=None, speculative=None):
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")  # generate() would fail the whole batch
+        if self.adapters is not None:
+            self.adapters.check(adapter)
+        elif adapter is not None:
+            raise ValueError("Adapters are not enabled on this server")
+        constraint = None
+        if choices is not None:
+            # Greedy, and only as many steps as the longest choice plus EOS
+            constraint = ChoiceConstraint(self.tokenizer, choices)
+            max_tokens, use_sampling = constraint.max_tokens + 1, False
+
+        if speculative is not None:
+            reason = self._speculative_unavailable(adapter, constraint)
+            speculative.update({"enabled": reason is None, **({"reason": reason} if reason else {})})
+            if reason is None:
+                use_sampling = False  # assisted greedy decoding matches plain greedy exactly
+            else:
+                speculative = None
+
+        inputs = None
+        if media_key is not None and self.media_encoder is not None:
+            inputs = self.media_encoder.cached_inputs(media_key, messages)
+        if inputs is None:
+            inputs = await asyncio.get_running_loop().run_in_executor(self._preprocess_pool, self.encode, messages)
+            if media_key is not None and self.media_encoder is not None:
+                self.media_encoder.store_inputs(media_key, messages, inputs)
+
+        loop = asyncio.get_running_loop()
+        streamer = AsyncTextStreamer(self.tokenizer, loop) if stream else None
+        request = GenerationRequest(inputs, max_tokens, use_sampling, loop, streamer)
+        request.media_key = media_key
+        request.choices = constraint
+        request.adapter = adapter
+        request.speculative = speculative
+        request.cancel = current_cancel.get() or CancelToken()
+        request.background = in_batch_job.get()
+        if self.metrics is not None:
+            request.endpoint = self.metrics.endpoint()
+        if self.prefix_cache is not None and adapter is None and speculative is None:
+            # cached prefixes hold base-model KV (assisted decoding builds its own caches)
+            request.prefix = self.prefix_cache.lookup(inputs["input_ids"])
+        return request
+
+    def _push(self, requests):
+        with self._cond:
+            if requests and requests[0].background:
+                self._background.extend(requests)
+                self._cond.notify()
+                return
+            self._last_live_at = time.perf_counter()
+            depth = len(self._pending)
+            if depth + len(requests) <= self.max_queue_size:
+                self._pending.extend(requests)
+                self._cond.notify()
+                return
+        self._reject(depth)
+
+    def stats(self):
+        now = time.perf_counter()
+        with self._cond:
+            pending = len(self._pending)
+            oldest = now - self._pending[0].enqueued_at if self._pending else 0.0
+            sizes = list(self._recent_batches)
+            waits = sorted(self._recent_waits)
+
+        avg_size = sum(sizes) / len(sizes) if sizes else 0.0
+        return {
+            "worker_alive": self.alive,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_queue_size": self.max_queue_size,
+            "pending": pending,
+            "background_pending": len(self._background),
+            "oldest_pending_ms": round(oldest * 1000, 1),
+            "avg_queue_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p95_queue_wait_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+            "rejected": self._rejected,
+            "last_success_at": self.last_success_at,
+            "batches_run": self._batches_run,
+            "requests_served": self._requests_served,
+            "prefix_skipped_for_batching": self._prefix_skipped,
+            "cancelled": self.cancel_stats(),
+            "avg_batch_size": round(avg_size, 2),
+            "avg_occupancy": round(avg_size / self.max_batch_size, 3),
+            "recent_batch_sizes": sizes[-20:],
+        }
+
+    def cancel_stats(self):
+        """Requests stopped by a deadline, disconnect or abandoned caller, and decode steps not run
+
+        `tokens_saved` is an upper bound: a cancelled reply might have ended on EOS sooner.
+        """
+        by_stage, by_reason = Counter(), Counter()
+        for (stage, reason), count in list(self._cancelled.items()):
+            by_stage[stage] += count
+            by_reason[reason] += count
+        return {
+            "total": sum(by_stage.values()),
+            "while_queued": by_stage["queued"],
+            "while_decoding": by_stage["decoding"],
+            "by_reason": dict(by_reason),
+            "tokens_saved": self._tokens_saved,
+        }
+
+    def _record_cancel(self, request, stage, generated=0):
+        """Fail a tripped request with RequestCancelled and count what was saved"""
+        reason = request.cancel.reason
+        saved = max(request.max_tokens - generated, 0)
+        self._cancelled[(stage, reason)] += 1
+        self._tokens_saved += saved
+        if self.metrics is not None:
+            self.metrics.observe_cancel(request.endpoint, reason, stage, saved)
+        request.fail(RequestCancelled(reason, generated))
+        if request.streamer is not None and stage == "queued":
+            request.streamer.end()  # generate() ends the streamer of a decoding request itself
+
+    # ---------------- worker ----------------
+
+    def _wait_for_work(self):
+        """Block until live work is queued, or background work may run; True = background"""
+        while self._running and not self._pending:
+            idle_for = time.perf_counter() - self._last_live_at
+            if self._background and idle_for >= self.background_idle_s:
+                return True
+            self._cond.wait(self.background_idle_s - idle_for if self._background else None)
+        return False
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                background = self._wait_for_work()
+                if not self._running:
+                    return None
+                queue = self._background if background else self._pending
+                limit = self.background_batch_size if background else self.max_batch_size
+
+                # Give concurrent callers up to max_wait_ms to join the head request
+                # (pointless for a solo request, which always runs alone, and for
+                # background requests, which the job runner queues in bulk)
+                head = queue[0]
+                deadline = head.enqueued_at + self.max_wait_ms / 1000
+                while (self._running and not background and not head.solo
+                       and len(self._pending) < self.max_batch_size):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                key = head.batch_key
+                batch, rest = [], deque()
+                for request in queue:
+                    if request.cancel is not None and request.cancel.check() is not None:
+                        self._record_cancel(request, "queued")  # never prefilled
+                    elif request.batch_key == key and len(batch) < limit:
+                        batch.append(request)
+                    else:
+                        rest.append(request)
+                if background:
+                    self._background = rest
+                else:
+                    self._pending = rest
+                if batch:
+                    break
+
+            if len(batch) > 1:
+                # One cached prefix KV can't be shared across padded rows, and batching saves more
+                # than skipping the prefix prefill does: every row is prefilled in full instead
+                for request in batch:
+                    if request.prefix is not None:
+                        request.prefix = None
+                        self._prefix_skipped += 1
+
+            started = time.perf_counter()
+            for request in batch:
+                request.started_at = started
+                self._recent_waits.append(started - request.enqueued_at)
+            return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch[0].task is not None:
+                self._run_task(batch[0])
+            else:
+                self._run_batch(batch)
+
+    def _run_task(self, request):
+        try:
+            request.resolve(request.task())
+        except Exception as exc:
+            request.fail(exc)
+
+    @property
+    def model_for_generation(self):
+        return self.adapters.model if self.adapters is not None else self.model
+
+    def _drop_unloaded(self, batch):
+        """Fail rows whose adapter was unloaded while they were queued"""
+        loaded = set(self.adapters.names())
+        kept = []
+        for request in batch:
+            if request.adapter is None or request.adapter in loaded:
+                kept.append(request)
+                continue
+            request.fail(UnknownAdapterError(request.adapter, sorted(loaded)))
+            if request.streamer is not None:
+                request.streamer.end()
+        return kept
+
+    def _adapter_names(self, batch):
+        if self.adapters is None:
+            return None
+        return self.adapters.adapter_names([r.adapter for r in batch])
+
+    def _media_rows(self, batch):
+        """(one key per unique upload, row -> upload index or None) for the encoder hooks"""
+        if self.media_encoder is None or not self.media_encoder.installed:
+            return None, None
+        keys = [r.media_key for r in batch]
+        if None in keys:
+            return None, None
+        slots = {}
+        index = [slots.setdefault(key, len(slots)) for key in keys]
+        return list(slots), (index if len(slots) < len(keys) else None)
+
+    def _run_batch(self, batch):
+        if self.adapters is not None:
+            batch = self._drop_unloaded(batch)
+            if not batch:
+                return  # every row named an adapter that is gone: nothing ran, nothing to record
+        started = time.perf_counter()
+        eos_token_id = self.tokenizer.eos_token_id
+        try:
+            media_keys, media_index = self._media_rows(batch)
+            if batch[0].candidates is not None:
+                request = batch[0]
+                media = self.media_encoder.batch(media_keys) if media_keys else nullcontext()
+                with media:
+                    request.resolve(score_candidates(
+                        self.model_for_generation, request.inputs.to(self.device), request.candidates,
+                        eos_token_id, adapter=(self._adapter_names(batch) or [None])[0],
+                    ))
+                self.last_success_at = time.time()
+                return
+
+            inputs = pad_batch([r.inputs for r in batch], eos_token_id, media_index).to(self.device)
+            params = generation_params(
+                max(r.max_tokens for r in batch), batch[0].use_sampling, eos_token_id
+            )
+            if batch[0].streamer is not None:
+                params["streamer"] = batch[0].streamer
+            if batch[0].prefix is not None:
+                with self.adapters.base_only() if self.adapters is not None else nullcontext():
+                    params["past_key_values"] = self.prefix_cache.fetch(batch[0].prefix)
+            adapter_names = self._adapter_names(batch)
+            if adapter_names is not None:
+                params["adapter_names"] = adapter_names  # one LoRA per row, base rows use none
+            processors, timer = LogitsProcessorList(), None
+            if any(r.choices is not None for r in batch):
+                processors.append(ChoiceLogitsProcessor(
+                    [r.choices for r in batch], inputs["input_ids"].shape[-1], eos_token_id
+                ))
+            if self.metrics is not None:
+                timer = self.metrics.step_timer()
+                processors.append(timer)
+            if processors:
+                params["logits_processor"] = processors
+            prompt_len = inputs["input_ids"].shape[-1]
+            cancellation = CancellationCriteria([r.cancel for r in batch], prompt_len, eos_token_id)
+            params["stopping_criteria"] = StoppingCriteriaList([cancellation])
+            budgets = [r.max_tokens for r in batch]
+            if min(budgets) < params["max_new_tokens"]:
+                params["stopping_criteria"].append(TokenBudgetCriteria(budgets, prompt_len))
+
+            spec_stats = batch[0].speculative
+            if spec_stats is not None:
+                params.update(self.speculative.params())
+            measure = self.speculative.measure(spec_stats) if spec_stats is not None else nullcontext()
+
+            media = self.media_encoder.batch(media_keys, media_index) if media_keys else nullcontext()
+            with torch.inference_mode(), media, measure:
+                outputs = self.model_for_generation.generate(**inputs, **params)
+                if spec_stats is not None:
+                    new_tokens = outputs[0, inputs["input_ids"].shape[-1]:]
+                    spec_stats["generated"] = new_tokens.shape[0]
+
+            # Stamped before resolving so awaiting callers already see it
+            self.last_success_at = time.time()
+            finished = time.perf_counter()
+            generated = []
+            for row, request in enumerate(batch):
+                tokens = outputs[row, prompt_len:prompt_len + request.max_tokens]
+                generated.append(tokens)
+                if row in cancellation.stopped_at:
+                    self._record_cancel(request, "decoding", cancellation.stopped_at[row])
+                    continue
+                request.resolve(self.tokenizer.decode(tokens, skip_special_tokens=True).strip())
+
+            if timer is not None:
+                self.metrics.observe_batch(
+                    batch, started, timer, finished,
+                    prompt_tokens=inputs["attention_mask"].sum(dim=1).tolist(),
+                    generated_tokens=[int((t != eos_token_id).sum()) for t in generated],
+                )
+
+        except Exception as exc:
+            print(f"❌ Batch of {len(batch)} failed: {exc}")
+            for request in batch:
+                request.fail(exc)
+                if request.streamer is not None:
+                    request.streamer.end()
+
+        finally:
+            elapsed = time.perf_counter() - started
+            limit = self.background_batch_size if batch[0].background else self.max_batch_size
+            if not batch[0].background:  # occupancy stats describe live batching
+                self._recent_batches.append(len(batch))
+            self._recent_batch_seconds.append(elapsed)
+            self._batches_run += 1
+            self._requests_served += len(batch)
+            print(f"📦 {'Background batch' if batch[0].background else 'Batch'} {len(batch)}/{limit} "
+                  f"({len(batch) / limit:.0%} occupancy) in {elapsed:.2f}s")
@@ -0,0 +1,107 @@
+"""
+Client-disconnect cancellation and per-request deadlines
+
+Every generation request carries a CancelToken. The token trips when:
+
+• the deadline passes (`X-Deadline-Ms` header or `deadline_ms` field)
+• the HTTP client disconnects (polled while the handler awaits its reply)
+• the awaiting coroutine is cancelled (e.g. the self-test timing out)
+
+The scheduler drops tripped requests that are still queued. For requests
+already decoding, CancellationCriteria is checked between decode steps and
+finishes just the tripped rows. Their handlers get RequestCancelled instead
+of a partial reply.
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+import torch
+from transformers import StoppingCriteria
+
+# Token of the HTTP request being served, set by the cancellation middleware
+current_cancel = ContextVar("current_cancel", default=None)
+
+class RequestCancelled(Exception):
+    """A request stopped before its reply was complete"""
+
+    def __init__(self, reason, generated=0):
+        super().__init__(f"Request cancelled ({reason}) after {generated} generated tokens")
+        self.reason = reason        # "deadline", "disconnected" or "abandoned"
+        self.generated = generated
+
+def caused_by_cancel(exc):
+    """True for RequestCancelled, also when re-raised as an HTTP error"""
+    return isinstance(exc, RequestCancelled) or isinstance(exc.__cause__, RequestCancelled)
+
+class CancelToken:
+    def __init__(self, timeout_s=None, is_disconnected=None):
+        self.deadline = time.perf_counter() + timeout_s if timeout_s else None
+        self.is_disconnected = is_disconnected  # async callable, e.g. Request.is_disconnected
+        self.reason = None
+
+    def cancel(self, reason):
+        if self.reason is None:
+            self.reason = reason
+
+    def tighten(self, timeout_s):
+        """Apply a per-request timeout from the body; the earlier deadline wins"""
+        if not timeout_s:
+            return
+        deadline = time.perf_counter() + timeout_s
+        self.deadline = deadline if self.deadline is None else min(self.deadline, deadline)
+
+    def check(self):
+        """Why the request should stop, or None - cheap enough for every decode step"""
+        if self.reason is None and self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.reason = "deadline"
+        return self.reason
+
+async def _poll_disconnect(token, interval_s):
+    while token.check() is None:
+        if await token.is_disconnected():
+            token.cancel("disconnected")
+            return
+        await asyncio.sleep(interval_s)
+
+@asynccontextmanager
+async def watching(token, interval_s=0.25):
+    """Poll for a client disconnect while the block runs (only once the body has been read)"""
+    if token is None or token.is_disconnected is None:
+        yield
+        return
+    task = asyncio.create_task(_poll_disconnect(token, interval_s))
+    try:
+        yield
+    finally:
+        task.cancel()
+
+class CancellationCriteria(StoppingCriteria):
+    """Finishes the rows of a batch whose token has tripped
+
+    `stopped_at` maps row -> tokens generated when that row was stopped. Rows
+    that already ended on EOS are left alone.
+    """
+
+    def __init__(self, tokens, prompt_len, eos_token_id):
+        self.tokens = tokens
+        self.prompt_len = prompt_len
+        self.eos_token_id = eos_token_id
+        self.stopped_at = {}
+        self._none = None  # reused all-False result: no host->device copy on the common path
+
+    def __call__(self, input_ids, scores, **kwargs):
+        flags = [token is not None and token.check() is not None for token in self.tokens]
+        if not any(flags):
+            if self._none is None:
+                self._none = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+            return self._none
+
+        generated = input_ids.shape[-1] - self.prompt_len
+        last = input_ids[:, -1].tolist()
+        for row, flag in enumerate(flags):
+            if flag and row not in self.stopped_at and last[row] != self.eos_token_id:
+                self.stopped_at[row] = generated
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
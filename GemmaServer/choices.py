@@ -0,0 +1,81 @@
+"""
+Constrained-choice decoding
+
+For classification prompts ("answer Low, Medium or High") the caller passes
+the allowed answers. Logits are masked so each row can only continue one of
+its allowed strings, and EOS is forced the moment one is complete - the
+reply is always exactly one of the choices, in a handful of decode steps.
+When a complete choice is also the start of a longer one ("1" and "10"),
+the model picks between EOS and continuing.
+"""
+
+import torch
+from transformers import LogitsProcessor
+
+class ChoiceError(ValueError):
+    """Bad `choices` option - reported to the client as a 400"""
+
+def split_choice_fields(fields, prompt_count):
+    """Form/query `choices` fields ("Low|Medium|High") -> one list per prompt
+
+    One field applies to every prompt, otherwise there must be one per prompt.
+    """
+    if not fields:
+        return None
+    sets = [[c.strip() for c in field.split("|")] for field in fields]
+    if len(sets) == 1:
+        return sets * prompt_count
+    if len(sets) != prompt_count:
+        raise ChoiceError(f"Got {len(sets)} `choices` fields for {prompt_count} prompts")
+    return sets
+
+class ChoiceConstraint:
+    """Token trie over the allowed answers"""
+
+    def __init__(self, tokenizer, choices):
+        choices = [c for c in dict.fromkeys(choices)]  # dedupe, keep order
+        if not choices or any(not c.strip() for c in choices):
+            raise ChoiceError("`choices` must be a non-empty list of non-empty strings")
+
+        text_tokenizer = getattr(tokenizer, "tokenizer", tokenizer)  # processor -> tokenizer
+        self.choices = choices
+        self.trie = {}
+        self.max_tokens = 0
+        for choice in choices:
+            ids = text_tokenizer.encode(choice, add_special_tokens=False)
+            node = self.trie
+            for token in ids:
+                node = node.setdefault(token, {})
+            node[None] = choice  # end-of-choice marker
+            self.max_tokens = max(self.max_tokens, len(ids))
+
+    def allowed(self, generated, eos_token_id):
+        """Token ids that may follow `generated` (a list of ids)"""
+        node = self.trie
+        for token in generated:
+            if token == eos_token_id or token not in node:
+                return [eos_token_id]  # finished (or padding after finishing)
+            node = node[token]
+        children = [token for token in node if token is not None]
+        if None in node:
+            return [eos_token_id] + children  # a choice is complete - stop, or go on to a longer one
+        return children
+
+class ChoiceLogitsProcessor(LogitsProcessor):
+    """Applies each row's ChoiceConstraint (None = unconstrained row)"""
+
+    def __init__(self, constraints, prompt_len, eos_token_id):
+        self.constraints = constraints
+        self.prompt_len = prompt_len
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        for row, constraint in enumerate(self.constraints):
+            if constraint is None:
+                continue
+            generated = input_ids[row, self.prompt_len:].tolist()
+            allowed = constraint.allowed(generated, self.eos_token_id)
+            mask = torch.full_like(scores[row], float("-inf"))
+            mask[allowed] = 0
+            scores[row] = scores[row] + mask
+        return scores
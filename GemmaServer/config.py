@@ -0,0 +1,214 @@
+# config.py - Runtime settings for the Gemma server (override with env vars)
+import os
+
+# --------------------------------------------------------------------
+# Model
+# --------------------------------------------------------------------
+
+# Checkpoint served (also part of the response cache key)
+MODEL_NAME = os.getenv("GEMMA_MODEL_NAME", "unsloth/gemma-3n-E4B-it")
+
+# Local pre-quantized snapshot (see `python gemma_loader.py export`); empty = load from the hub
+SNAPSHOT_DIR = os.getenv("GEMMA_SNAPSHOT_DIR", "")
+
+# Serve the seeded tiny stand-in from stub_model.py instead of Gemma (benchmarks/CI on a laptop CPU)
+STUB_MODEL = os.getenv("GEMMA_STUB_MODEL", "0") == "1"
+
+# --------------------------------------------------------------------
+# Backend
+# --------------------------------------------------------------------
+
+# Where the model runs: auto (cuda if available), cuda, or cpu
+DEVICE = os.getenv("GEMMA_DEVICE", "auto")
+
+# CPU weights: bf16, fp32, or int8 (dynamic quantization of Linear layers)
+CPU_DTYPE = os.getenv("GEMMA_CPU_DTYPE", "bf16")
+
+# Intra-op threads for CPU matmuls (0 = one per core) and inter-op threads (0 = torch default)
+CPU_THREADS = int(os.getenv("GEMMA_CPU_THREADS", "0"))
+CPU_INTEROP_THREADS = int(os.getenv("GEMMA_CPU_INTEROP_THREADS", "0"))
+
+# --------------------------------------------------------------------
+# Uploads
+# --------------------------------------------------------------------
+
+# Largest audio clip accepted by /ask and /ask_audio
+MAX_AUDIO_MB = int(os.getenv("GEMMA_MAX_AUDIO_MB", "25"))
+
+# --------------------------------------------------------------------
+# Batching scheduler
+# --------------------------------------------------------------------
+
+# Most requests packed into one model.generate call
+MAX_BATCH_SIZE = int(os.getenv("GEMMA_MAX_BATCH_SIZE", "8"))
+
+# How long the first queued request waits for others to join its batch
+MAX_WAIT_MS = float(os.getenv("GEMMA_MAX_WAIT_MS", "15"))
+
+# Requests allowed to wait for the GPU before new ones get 429 + Retry-After
+MAX_QUEUE_SIZE = int(os.getenv("GEMMA_MAX_QUEUE_SIZE", "64"))
+
+# Threads decoding uploads and applying the chat template in parallel (0 = asyncio's default pool)
+PREPROCESS_THREADS = int(os.getenv("GEMMA_PREPROCESS_THREADS", "4"))
+
+# Most uploads accepted by one /ask_image_batch or /ask_batch call
+MAX_BATCH_ITEMS = int(os.getenv("GEMMA_MAX_BATCH_ITEMS", "256"))
+
+# --------------------------------------------------------------------
+# Cancellation
+# --------------------------------------------------------------------
+
+# Deadline for requests that send neither `X-Deadline-Ms` nor `deadline_ms` (0 = none)
+DEFAULT_DEADLINE_S = float(os.getenv("GEMMA_DEFAULT_DEADLINE_S", "0"))
+
+# How often a waiting handler checks whether its client has disconnected
+DISCONNECT_POLL_MS = float(os.getenv("GEMMA_DISCONNECT_POLL_MS", "250"))
+
+# --------------------------------------------------------------------
+# Shared-prefix KV cache
+# --------------------------------------------------------------------
+
+PREFIX_CACHE_ENABLED = os.getenv("GEMMA_PREFIX_CACHE", "1") == "1"
+
+# Device memory the cached prefix KV tensors may use in total
+PREFIX_CACHE_MAX_MB = int(os.getenv("GEMMA_PREFIX_CACHE_MAX_MB", "512"))
+
+# Shortest prefix worth caching, and how often it must repeat to be auto-cached
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv("GEMMA_PREFIX_CACHE_MIN_TOKENS", "32"))
+PREFIX_CACHE_MIN_SEEN = int(os.getenv("GEMMA_PREFIX_CACHE_MIN_SEEN", "3"))
+
+# --------------------------------------------------------------------
+# Media cache (processed uploads + encoder outputs, keyed by content)
+# --------------------------------------------------------------------
+
+MEDIA_CACHE_ENABLED = os.getenv("GEMMA_MEDIA_CACHE", "1") == "1"
+MEDIA_CACHE_MAX_MB = int(os.getenv("GEMMA_MEDIA_CACHE_MAX_MB", "256"))
+MEDIA_CACHE_TTL_S = float(os.getenv("GEMMA_MEDIA_CACHE_TTL_S", "300"))
+
+# --------------------------------------------------------------------
+# Response cache for greedy /generate calls (opt-in)
+# --------------------------------------------------------------------
+
+RESPONSE_CACHE_ENABLED = os.getenv("GEMMA_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_MAX_MB = int(os.getenv("GEMMA_RESPONSE_CACHE_MAX_MB", "32"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("GEMMA_RESPONSE_CACHE_TTL_S", "600"))
+
+# --------------------------------------------------------------------
+# Health probes
+# --------------------------------------------------------------------
+
+# How often the background deep self-test runs one short generation
+SELF_TEST_INTERVAL_S = float(os.getenv("GEMMA_SELF_TEST_INTERVAL_S", "300"))
+
+# A self-test that takes longer than this counts as failed
+SELF_TEST_TIMEOUT_S = float(os.getenv("GEMMA_SELF_TEST_TIMEOUT_S", "60"))
+
+# --------------------------------------------------------------------
+# Metrics
+# --------------------------------------------------------------------
+
+# Prometheus histograms/counters on GET /metrics (cheap enough to leave on)
+METRICS_ENABLED = os.getenv("GEMMA_METRICS", "1") == "1"
+
+# Level of the gemma_server logger; DEBUG adds a line per upload, long-audio run and batch call
+LOG_LEVEL = os.getenv("GEMMA_LOG_LEVEL", "INFO").upper()
+
+# --------------------------------------------------------------------
+# LoRA adapters on the shared base model
+# --------------------------------------------------------------------
+
+# Loaded at startup: "emergency=/models/FineTunedModel,other=/path" (more via POST /adapters)
+ADAPTERS = os.getenv("GEMMA_ADAPTERS", "")
+
+# Most adapters resident at once
+MAX_ADAPTERS = int(os.getenv("GEMMA_MAX_ADAPTERS", "4"))
+
+# --------------------------------------------------------------------
+# Speculative decoding
+# --------------------------------------------------------------------
+
+# Draft checkpoint, e.g. "unsloth/gemma-3n-E2B-it"; empty = speculative decoding off
+DRAFT_MODEL_NAME = os.getenv("GEMMA_DRAFT_MODEL_NAME", "")
+
+# Tokens the draft proposes per verification pass
+SPECULATIVE_TOKENS = int(os.getenv("GEMMA_SPECULATIVE_TOKENS", "5"))
+
+# --------------------------------------------------------------------
+# Offline batch jobs (low priority, served when no live request waits)
+# --------------------------------------------------------------------
+
+JOBS_ENABLED = os.getenv("GEMMA_JOBS", "1") == "1"
+
+# Submitted lines, results and checkpoints, one subdirectory per job
+JOBS_DIR = os.getenv("GEMMA_JOBS_DIR", "jobs")
+
+# Most background requests packed into one generate() call
+JOB_BATCH_SIZE = int(os.getenv("GEMMA_JOB_BATCH_SIZE", "16"))
+
+# Live traffic must have paused this long before a background batch starts
+JOB_IDLE_MS = float(os.getenv("GEMMA_JOB_IDLE_MS", "100"))
+
+# Largest job file accepted
+JOB_MAX_MB = int(os.getenv("GEMMA_JOB_MAX_MB", "512"))
+
+# --------------------------------------------------------------------
+# Audio front-end (silence trimming + length cap before the audio encoder)
+# --------------------------------------------------------------------
+
+AUDIO_FRONTEND_ENABLED = os.getenv("GEMMA_AUDIO_FRONTEND", "1") == "1"
+
+# Cut leading/trailing silence and shorten long pauses (0 = only apply the length cap)
+AUDIO_TRIM = os.getenv("GEMMA_AUDIO_TRIM", "1") == "1"
+
+# Frames this many dB below the loudest frame count as silence
+AUDIO_TRIM_TOP_DB = float(os.getenv("GEMMA_AUDIO_TRIM_TOP_DB", "35"))
+
+# Frames quieter than this (dBFS) always count as silence
+AUDIO_SILENCE_FLOOR_DB = float(os.getenv("GEMMA_AUDIO_SILENCE_FLOOR_DB", "-60"))
+
+# Margin of silence kept around speech
+AUDIO_TRIM_PAD_MS = int(os.getenv("GEMMA_AUDIO_TRIM_PAD_MS", "150"))
+
+# Longer pauses inside a clip are shortened to this (0 = keep pauses)
+AUDIO_MAX_PAUSE_MS = int(os.getenv("GEMMA_AUDIO_MAX_PAUSE_MS", "1000"))
+
+# Audio kept per clip after trimming (Gemma 3n's feature extractor stops at 30 s)
+AUDIO_MAX_SECONDS = float(os.getenv("GEMMA_AUDIO_MAX_SECONDS", "30"))
+
+# Which part of a longer clip is kept: "head" (the start) or "densest" (the window with most speech)
+AUDIO_LONG_MODE = os.getenv("GEMMA_AUDIO_LONG_MODE", "head")
+
+# --------------------------------------------------------------------
+# Long-audio mode (`long_audio`: overlapping windows, stitched transcript)
+# --------------------------------------------------------------------
+
+# Audio per window - under the 30 s the feature extractor keeps, with room for the
+# last window to run GEMMA_LONG_AUDIO_SEARCH_S longer instead of leaving a sliver
+LONG_AUDIO_WINDOW_S = float(os.getenv("GEMMA_LONG_AUDIO_WINDOW_S", "25"))
+
+# Audio shared by neighbouring windows; the repeated words are removed when stitching
+LONG_AUDIO_OVERLAP_S = float(os.getenv("GEMMA_LONG_AUDIO_OVERLAP_S", "2"))
+
+# How far before each window edge to look for the quietest point to cut at
+LONG_AUDIO_SEARCH_S = float(os.getenv("GEMMA_LONG_AUDIO_SEARCH_S", "3"))
+
+# Most windows per clip (about 9 minutes with the defaults)
+LONG_AUDIO_MAX_WINDOWS = int(os.getenv("GEMMA_LONG_AUDIO_MAX_WINDOWS", "24"))
+
+# --------------------------------------------------------------------
+# Image pre-stage (reduced-scale decode before the vision encoder)
+# --------------------------------------------------------------------
+
+IMAGE_PRESTAGE_ENABLED = os.getenv("GEMMA_IMAGE_PRESTAGE", "1") == "1"
+
+# Let libjpeg decode JPEGs at 1/2, 1/4 or 1/8 scale when that still covers the target size
+IMAGE_DRAFT = os.getenv("GEMMA_IMAGE_DRAFT", "1") == "1"
+
+# Rotate/flip images by their EXIF orientation (phone photos)
+IMAGE_EXIF = os.getenv("GEMMA_IMAGE_EXIF", "1") == "1"
+
+# Downscale decoded images to just cover the target size before the processor sees them
+IMAGE_DOWNSCALE = os.getenv("GEMMA_IMAGE_DOWNSCALE", "1") == "1"
+
+# Encoder input side in pixels; 0 = read it from the image processor (768 for Gemma 3n)
+IMAGE_TARGET_SIZE = int(os.getenv("GEMMA_IMAGE_TARGET_SIZE", "0"))
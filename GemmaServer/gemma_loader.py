@@ -1,10 +1,30 @@
 # gemma_loader.py - WORKING MULTIMODAL VERSION
+#
+# One-time export of the already-quantized model to a local snapshot:
+#     python gemma_loader.py export /models/gemma-3n-snapshot
+# then start the server from it (offline, no re-quantization):
+#     GEMMA_SNAPSHOT_DIR=/models/gemma-3n-snapshot python gemma_server.py
 import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+_IMPORT_STARTED = time.perf_counter()
+
 import torch
+import config
+from backend import BACKEND
+
+# A snapshot start must never touch the network
+if config.SNAPSHOT_DIR:
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
 
 # AGGRESSIVE compilation disable BEFORE any imports
 os.environ["TORCH_COMPILE_DISABLE"] = "1"
-os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
+if BACKEND.is_cuda:
+    os.environ["CUDA_LAUNCH_BLOCKING"] = "1"
 
 # Disable all torch compilation
 torch._dynamo.config.disable = True
@@ -15,28 +35,92 @@ torch.backends.cudnn.allow_tf32 = False
 
 from huggingface_hub import login
 from dotenv import load_dotenv
-from unsloth import FastModel
+
+# Unsloth needs a GPU - the CPU backend loads through plain transformers
+if BACKEND.is_cuda and not config.STUB_MODEL:
+    from unsloth import FastModel
 
 load_dotenv()
 
+SNAPSHOT_MANIFEST = "snapshot.json"
+
+# Seconds spent in each startup phase, reported by /readyz
+load_timings = {"imports": round(time.perf_counter() - _IMPORT_STARTED, 2)}
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    yield
+    load_timings[name] = round(time.perf_counter() - started, 2)
+    print(f"⏱️  {name}: {load_timings[name]:.2f}s")
+
+def read_snapshot_manifest(path):
+    manifest = os.path.join(path, SNAPSHOT_MANIFEST)
+    if not os.path.isfile(manifest):
+        raise RuntimeError(
+            f"{path} is not a Gemma snapshot (no {SNAPSHOT_MANIFEST}). "
+            f"Create one with: python gemma_loader.py export {path}"
+        )
+    with open(manifest) as f:
+        return json.load(f)
+
+def load_pretrained(source, local_only=False):
+    """(model, processor) for the selected backend"""
+    if BACKEND.is_cuda:
+        # Use EXACT tutorial configuration (this works for multimodal!)
+        return FastModel.from_pretrained(
+            model_name=source,
+            dtype=None,  # Auto detection (tutorial setting)
+            max_seq_length=1024,
+            load_in_4bit=True,  # Tutorial setting (works with multimodal)
+            full_finetuning=False,
+            trust_remote_code=True,
+            local_files_only=local_only,
+        )
+    
+    from transformers import AutoModelForImageTextToText, AutoProcessor
+    processor = AutoProcessor.from_pretrained(source, local_files_only=local_only)
+    model = AutoModelForImageTextToText.from_pretrained(
+        source,
+        dtype=BACKEND.torch_dtype(),
+        low_cpu_mem_usage=True,
+        local_files_only=local_only,
+    )
+    return BACKEND.quantize(model.eval()), processor
+
+def load_stub_model(seed=0):
+    """Seeded tiny stand-in (stub_model.py): no download, no login, same call surface"""
+    from stub_model import get_stub_model_and_processor
+    with phase("load_model"):
+        model, tokenizer = get_stub_model_and_processor(seed=seed)
+    return model.to(BACKEND.device), tokenizer
+
 def get_model_and_processor():
     """Load Gemma 3n model and tokenizer - WORKING MULTIMODAL CONFIG"""
     
-    # Login to HuggingFace 
-    login(token=os.getenv("HF_TOKEN"))
+    BACKEND.configure()
+    if config.STUB_MODEL:
+        print("🧪 GEMMA_STUB_MODEL=1 - serving the stub model, not Gemma")
+        return load_stub_model()
+    if config.SNAPSHOT_DIR and not BACKEND.is_cuda:
+        raise RuntimeError("Snapshots hold bitsandbytes 4-bit weights, which need GEMMA_DEVICE=cuda")
     
-    print("🚀 Loading Gemma 3n model and tokenizer...")
-    print("🔧 Using WORKING multimodal configuration...")
+    if config.SNAPSHOT_DIR:
+        # Weights are already 4-bit: no download, no re-quantization
+        manifest = read_snapshot_manifest(config.SNAPSHOT_DIR)
+        print(f"🚀 Loading pre-quantized snapshot of {manifest['model_name']} from {config.SNAPSHOT_DIR}...")
+        source, local_only = config.SNAPSHOT_DIR, True
+    else:
+        # Login to HuggingFace 
+        with phase("hf_login"):
+            login(token=os.getenv("HF_TOKEN"))
+        print("🚀 Loading Gemma 3n model and tokenizer...")
+        source, local_only = config.MODEL_NAME, False
     
-    # Use EXACT tutorial configuration (this works for multimodal!)
-    model, tokenizer = FastModel.from_pretrained(
-        model_name="unsloth/gemma-3n-E4B-it",
-        dtype=None,  # Auto detection (tutorial setting)
-        max_seq_length=1024,
-        load_in_4bit=True,  # Tutorial setting (works with multimodal)
-        full_finetuning=False,
-        trust_remote_code=True,
-    )
+    print(f"🔧 Using WORKING multimodal configuration on {BACKEND.device} ({BACKEND.precision})...")
+    
+    with phase("load_model"):
+        model, tokenizer = load_pretrained(source, local_only)
     
     # DON'T apply get_chat_template here! 
     # We'll apply it selectively in the server:
@@ -49,6 +133,42 @@ def get_model_and_processor():
     
     return model, tokenizer
 
+def get_draft_model():
+    """Smaller Gemma 3n checkpoint used as the speculative-decoding draft (shares the tokenizer)"""
+    if config.STUB_MODEL:
+        return load_stub_model(seed=1)[0]
+    print(f"🚀 Loading draft model {config.DRAFT_MODEL_NAME}...")
+    with phase("load_draft_model"):
+        draft, _ = load_pretrained(config.DRAFT_MODEL_NAME, local_only=bool(config.SNAPSHOT_DIR))
+    return draft
+
+def export_snapshot(path):
+    """Write the quantized model + processor to `path` as safetensors (one-time)"""
+    model, tokenizer = get_model_and_processor()
+    
+    with phase("save_snapshot"):
+        os.makedirs(path, exist_ok=True)
+        model.save_pretrained(path, safe_serialization=True)
+        tokenizer.save_pretrained(path)
+        with open(os.path.join(path, SNAPSHOT_MANIFEST), "w") as f:
+            json.dump({
+                "model_name": config.MODEL_NAME,
+                "load_in_4bit": True,
+                "torch": torch.__version__,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }, f, indent=2)
+    
+    print(f"✅ Snapshot written to {path}")
+
 def sanitize(text):
     """Clean up the generated text"""
-    return text.strip()
\ No newline at end of file
+    return text.strip()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "export":
+        sys.exit("usage: python gemma_loader.py export <snapshot_dir>")
+    if config.SNAPSHOT_DIR:
+        sys.exit("Unset GEMMA_SNAPSHOT_DIR to export from the hub checkpoint")
+    if not BACKEND.is_cuda:
+        sys.exit("Snapshots are 4-bit bitsandbytes weights - export with GEMMA_DEVICE=cuda")
+    export_snapshot(sys.argv[2])
\ No newline at end of file
@@ -4,13 +4,51 @@ FastAPI wrapper for Gemma-3n - CLEAN WORKING VERSION
 • POST /generate      – text→text (WORKING!)
 • POST /ask_image     – image+prompt→text (WORKING!)  
 • POST /ask          – audio+prompt→text (WORKING!)
+• POST /ask_audio    – same as /ask with a multipart or raw binary body (no base64)
+  (/ask_image and /ask also take a list of prompts for one upload → list of answers)
+  (/ask, /ask_audio and /ask/stream take `long_audio` for clips past 30 s → windowed transcript)
+• POST /ask_image_batch, /ask_batch – many images / clips in one call, answered in order
+• POST /jobs         – offline JSONL batch job, run at low priority (GET /jobs/{id} for progress)
+• POST /generate/stream, /ask_image/stream, /ask/stream – same, streamed as SSE / NDJSON
 """
 
-import base64, os, tempfile, torch
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import asyncio, base64, logging, os, time
+PROCESS_STARTED = time.perf_counter()
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from gemma_loader import get_model_and_processor, sanitize
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional
+from gemma_loader import get_draft_model, get_model_and_processor, load_timings, sanitize
+from adapters import AdapterRegistry, UnknownAdapterError, parse_adapter_specs
+from audio_frontend import AudioFrontEnd
+from image_prestage import ImagePreStage
+from backend import BACKEND
+from batch_jobs import JobError, JobManager
+from batch_scheduler import BatchScheduler, QueueFullError
+from cancellation import CancelToken, RequestCancelled, current_cancel
+from choices import ChoiceError, split_choice_fields
+from health import SelfTest
+from metrics import GenerationMetrics, current_endpoint
+from media_encoder import MediaEncoder, media_digest
+from media_io import (MediaDecodeError, decode_audio, processor_audio_frame_rate, processor_image_size,
+                      processor_sampling_rate)
+from long_audio import plan_windows, stitch, transcribe_windows
+from prefix_cache import PrefixCache
+from scoring import softmax
+from speculative import SpeculativeDecoder
+from response_cache import ResponseCache
+from ttl_cache import TTLCache
+from streaming import STREAM_MEDIA_TYPES, event_stream, format_event
+import config
+
+# Per-request detail (upload sizes, window timings, batch summaries) at DEBUG - GEMMA_LOG_LEVEL=DEBUG shows it
+log = logging.getLogger("gemma_server")
+log.setLevel(config.LOG_LEVEL)
+if not log.handlers:  # uvicorn only configures its own loggers
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(levelname)s:     %(name)s - %(message)s"))
+    log.addHandler(_handler)
 
 # --------------------------------------------------------------------
 # Request Models
@@ -18,11 +56,40 @@ from gemma_loader import get_model_and_processor, sanitize
 
 class TextRequest(BaseModel):
     prompt: str
-    max_tokens: int = 100
+    max_tokens: int = Field(100, gt=0)  # a reply needs at least one token
+    choices: Optional[List[str]] = None  # reply is forced to be exactly one of these
+    adapter: Optional[str] = None  # LoRA adapter to answer with, None = base model
+    speculative: bool = False  # decode with the draft model (same greedy output, faster)
+    deadline_ms: Optional[int] = None  # stop decoding after this long (same as X-Deadline-Ms)
+
+class AdapterRequest(BaseModel):
+    name: str
+    path: str  # local PEFT LoRA checkpoint trained on the served base model
+
+class PrefixRequest(BaseModel):
+    prompt: str  # instruction text that later prompts will start with
 
 class AudioPayload(BaseModel):
     data: str  # base-64 audio data
     prompt: str = "What is this audio about?"  # Default prompt with user customization
+    prompts: Optional[List[str]] = None  # several prompts answered over one clip
+    choices: Optional[List[str]] = None  # allowed answers, applied to every prompt
+    adapter: Optional[str] = None  # LoRA adapter to answer with, None = base model
+    speculative: bool = False  # greedy speculative decoding for a single prompt
+    long_audio: bool = False  # split a clip past 30 s into windows and stitch the transcripts
+    deadline_ms: Optional[int] = None  # stop decoding after this long (same as X-Deadline-Ms)
+
+class AudioBatchItem(BaseModel):
+    data: str  # base-64 audio data
+    prompt: Optional[str] = None  # this clip's own prompt, else the shared one
+
+class AudioBatchPayload(BaseModel):
+    items: List[AudioBatchItem]
+    prompt: str = "What is this audio about?"  # for items without their own prompt
+    prompts: Optional[List[str]] = None  # asked of every clip instead → `texts` per item
+    choices: Optional[List[str]] = None  # allowed answers, applied to every prompt
+    adapter: Optional[str] = None  # LoRA adapter to answer with, None = base model
+    deadline_ms: Optional[int] = None  # for the whole call (same as X-Deadline-Ms)
 
 # --------------------------------------------------------------------
 # FastAPI + CORS
@@ -42,48 +109,278 @@ app.add_middleware(
 
 model, tokenizer = get_model_and_processor()
 
+MAX_AUDIO_BYTES = config.MAX_AUDIO_MB * 1024 * 1024
+
+# --------------------------------------------------------------------
+# Batching scheduler - concurrent requests share one generate() call
+# --------------------------------------------------------------------
+
+prefix_cache = PrefixCache(
+    model,
+    tokenizer,
+    max_bytes=config.PREFIX_CACHE_MAX_MB * 1024 * 1024,
+    min_tokens=config.PREFIX_CACHE_MIN_TOKENS,
+    min_seen=config.PREFIX_CACHE_MIN_SEEN,
+    device=BACKEND.device,
+) if config.PREFIX_CACHE_ENABLED else None
+
+# Lets prompts that share one upload run the vision/audio encoder once,
+# and serves repeated uploads from a content-addressed cache
+media_cache = TTLCache(
+    max_bytes=config.MEDIA_CACHE_MAX_MB * 1024 * 1024,
+    ttl_seconds=config.MEDIA_CACHE_TTL_S,
+) if config.MEDIA_CACHE_ENABLED else None
+
+media_encoder = MediaEncoder(model, tokenizer, cache=media_cache)
+
+GENERATION_ENDPOINTS = [
+    "/generate", "/ask_image", "/ask", "/ask_audio", "/score", "/ask_image_batch", "/ask_batch",
+    "/generate/stream", "/ask_image/stream", "/ask/stream",
+]
+
+# Prometheus metrics, labelled per generation endpoint
+metrics = GenerationMetrics(GENERATION_ENDPOINTS) if config.METRICS_ENABLED else None
+
+# Silence trimming and a length cap on every clip before the audio encoder
+audio_frontend = AudioFrontEnd(
+    sampling_rate=processor_sampling_rate(tokenizer),
+    trim=config.AUDIO_TRIM,
+    top_db=config.AUDIO_TRIM_TOP_DB,
+    floor_db=config.AUDIO_SILENCE_FLOOR_DB,
+    pad_ms=config.AUDIO_TRIM_PAD_MS,
+    max_pause_ms=config.AUDIO_MAX_PAUSE_MS,
+    max_seconds=config.AUDIO_MAX_SECONDS,
+    long_audio=config.AUDIO_LONG_MODE,
+    encoder_frames_per_s=processor_audio_frame_rate(tokenizer),
+    metrics=metrics,
+) if config.AUDIO_FRONTEND_ENABLED else None
+
+# Reduced-scale JPEG decode, EXIF orientation and downscale to the vision encoder's input size
+image_prestage = ImagePreStage(
+    target_size=((config.IMAGE_TARGET_SIZE, config.IMAGE_TARGET_SIZE) if config.IMAGE_TARGET_SIZE
+                 else processor_image_size(tokenizer) or (768, 768)),
+    draft=config.IMAGE_DRAFT,
+    exif=config.IMAGE_EXIF,
+    downscale=config.IMAGE_DOWNSCALE,
+    metrics=metrics,
+) if config.IMAGE_PRESTAGE_ENABLED else None
+
+# Named LoRA adapters sharing the base weights, loadable at runtime
+adapters = AdapterRegistry(model, max_adapters=config.MAX_ADAPTERS)
+
+# Optional draft model for speculative decoding (E2B drafting for E4B)
+speculative_decoder = SpeculativeDecoder(
+    model, get_draft_model(), num_tokens=config.SPECULATIVE_TOKENS
+) if config.DRAFT_MODEL_NAME else None
+
+scheduler = BatchScheduler(
+    model,
+    tokenizer,
+    max_batch_size=config.MAX_BATCH_SIZE,
+    max_wait_ms=config.MAX_WAIT_MS,
+    max_queue_size=config.MAX_QUEUE_SIZE,
+    device=BACKEND.device,
+    prefix_cache=prefix_cache,
+    media_encoder=media_encoder,
+    metrics=metrics,
+    adapters=adapters,
+    speculative=speculative_decoder,
+    disconnect_poll_ms=config.DISCONNECT_POLL_MS,
+    preprocess_threads=config.PREPROCESS_THREADS,
+    background_batch_size=config.JOB_BATCH_SIZE,
+    background_idle_ms=config.JOB_IDLE_MS,
+    audio_frontend=audio_frontend,
+    image_prestage=image_prestage,
+)
+if metrics is not None:
+    metrics.watch_scheduler(scheduler)
+    metrics.set_backend(BACKEND.describe())
+
+# Deep check on a schedule - probes only read its cached result
+self_test = SelfTest(
+    lambda: generate_response(text_messages("Hello"), max_tokens=10, use_sampling=False),
+    scheduler,
+    interval_s=config.SELF_TEST_INTERVAL_S,
+    timeout_s=config.SELF_TEST_TIMEOUT_S,
+)
+
+@app.on_event("startup")
+async def start_scheduler():
+    scheduler.start()
+    for name, path in parse_adapter_specs(config.ADAPTERS).items():
+        await scheduler.run_on_worker(lambda name=name, path=path: adapters.load(name, path))
+    self_test.start()
+    if job_manager is not None:
+        job_manager.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    if job_manager is not None:
+        await job_manager.stop()  # before the scheduler, so cut-off lines aren't recorded as failures
+    await self_test.stop()
+    scheduler.stop()
+
+@app.middleware("http")
+async def add_queue_headers(request, call_next):
+    """Expose queue depth on every response so load balancers can shed traffic"""
+    response = await call_next(request)
+    response.headers["X-Queue-Depth"] = str(scheduler.queue_depth)
+    return response
+
+@app.middleware("http")
+async def record_metrics(request, call_next):
+    """Latency and in-flight count per generation endpoint"""
+    endpoint = metrics.label(request.url.path) if metrics is not None else None
+    if endpoint is None:
+        return await call_next(request)
+
+    current_endpoint.set(endpoint)  # lets the scheduler attribute tokens to the endpoint
+    started = time.perf_counter()
+    metrics.inflight.labels(endpoint).inc()
+    try:
+        return await call_next(request)
+    finally:
+        metrics.inflight.labels(endpoint).dec()
+        metrics.latency.labels(endpoint).observe(time.perf_counter() - started)
+
+@app.middleware("http")
+async def track_cancellation(request, call_next):
+    """Give each generation request a deadline and a disconnect check the scheduler can see"""
+    if request.url.path not in GENERATION_ENDPOINTS:
+        return await call_next(request)
+    try:
+        timeout_s = float(request.headers.get("x-deadline-ms") or 0) / 1000 or config.DEFAULT_DEADLINE_S
+    except ValueError:
+        return JSONResponse({"detail": "X-Deadline-Ms must be a number of milliseconds"}, status_code=400)
+    current_cancel.set(CancelToken(timeout_s, is_disconnected=request.is_disconnected))
+    return await call_next(request)
+
+# Greedy /generate replies are deterministic, so repeats can be served from cache
+response_cache = ResponseCache(
+    TTLCache(
+        max_bytes=config.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        ttl_seconds=config.RESPONSE_CACHE_TTL_S,
+    ),
+    model_version=config.MODEL_NAME,
+    adapters=adapters,
+) if config.RESPONSE_CACHE_ENABLED else None
+
 # --------------------------------------------------------------------
 # SINGLE GENERATION FUNCTION - WORKS FOR EVERYTHING
 # --------------------------------------------------------------------
 
-def generate_response(messages, max_tokens=256, use_sampling=True):
-    """Universal generation function using RAW tokenizer (WORKING!)"""
-    
-    # Use RAW tokenizer for EVERYTHING (works for both text and multimodal)
-    inputs = tokenizer.apply_chat_template(
-        messages,
-        add_generation_prompt=True,
-        tokenize=True,
-        return_dict=True,
-        return_tensors="pt",
-    ).to("cuda")
-
-    generation_params = {
-        "max_new_tokens": max_tokens,
-        "pad_token_id": tokenizer.eos_token_id,
-        "eos_token_id": tokenizer.eos_token_id,
-    }
-    
-    if use_sampling:
-        # Use tutorial settings for more natural responses
-        generation_params.update({
-            "temperature": 1.0,
-            "top_p": 0.95,
-            "top_k": 64,
-        })
-    else:
-        # Greedy decoding for consistent text responses
-        generation_params["do_sample"] = False
+def queue_full(exc):
+    return HTTPException(429, str(exc), headers={"Retry-After": str(exc.retry_after)})
+
+def unknown_adapter(exc):
+    return HTTPException(404, str(exc))
+
+def cancelled(exc):
+    # 499 = client closed request; nobody reads it, but logs and metrics do
+    return HTTPException(504 if exc.reason == "deadline" else 499, str(exc))
 
-    with torch.inference_mode():
-        outputs = model.generate(**inputs, **generation_params)
+def undecodable(exc):
+    return HTTPException(422, str(exc))
 
-    reply = tokenizer.decode(
-        outputs[0][inputs["input_ids"].shape[-1]:], 
-        skip_special_tokens=True
-    ).strip()
-    
-    return reply
+def apply_deadline(deadline_ms):
+    """Body/form `deadline_ms` - tightens the X-Deadline-Ms deadline set by the middleware"""
+    token = current_cancel.get()
+    if token is not None and deadline_ms:
+        token.tighten(deadline_ms / 1000)
+
+async def generate_response(messages, max_tokens=256, use_sampling=True, media_key=None, choices=None,
+                            adapter=None, speculative=None):
+    """Universal generation function - queued and batched by the scheduler
+
+    `speculative`: a dict to decode greedily with the draft model; it receives
+    acceptance rate and speedup for this request.
+    """
+    try:
+        return await scheduler.submit(
+            messages, max_tokens=max_tokens, use_sampling=use_sampling, media_key=media_key,
+            choices=choices, adapter=adapter, speculative=speculative,
+        )
+    except QueueFullError as exc:
+        raise queue_full(exc) from exc
+    except ChoiceError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    except MediaDecodeError as exc:
+        raise undecodable(exc) from exc
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+    except RequestCancelled as exc:
+        raise cancelled(exc) from exc
+
+async def generate_many(messages_list, max_tokens=256, use_sampling=True, media_key=None,
+                        choices_list=None, adapter=None):
+    """Answer several prompts over one upload in one batched decode"""
+    if len(messages_list) > scheduler.max_batch_size:
+        raise HTTPException(400, f"At most {scheduler.max_batch_size} prompts per upload")
+    try:
+        return await scheduler.submit_many(
+            messages_list, max_tokens=max_tokens, use_sampling=use_sampling, media_key=media_key,
+            choices_list=choices_list, adapter=adapter,
+        )
+    except QueueFullError as exc:
+        raise queue_full(exc) from exc
+    except ChoiceError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    except MediaDecodeError as exc:
+        raise undecodable(exc) from exc
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+    except RequestCancelled as exc:
+        raise cancelled(exc) from exc
+
+def choice_fields(fields, prompt_count):
+    try:
+        return split_choice_fields(fields, prompt_count)
+    except ChoiceError as exc:
+        raise HTTPException(400, str(exc)) from exc
+
+async def stream_response(messages, fmt, max_tokens=256, use_sampling=True, media_key=None, adapter=None):
+    """Streaming variant of generate_response - tokens go out as they are decoded"""
+    if fmt not in STREAM_MEDIA_TYPES:
+        raise HTTPException(400, f"Unknown stream format '{fmt}' (use sse or ndjson)")
+
+    started = time.perf_counter()
+    try:
+        chunks = await scheduler.submit_stream(
+            messages, max_tokens=max_tokens, use_sampling=use_sampling, media_key=media_key,
+            adapter=adapter,
+        )
+    except QueueFullError as exc:
+        raise queue_full(exc) from exc
+    except MediaDecodeError as exc:
+        raise undecodable(exc) from exc
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+
+    return StreamingResponse(event_stream(chunks, fmt, started), media_type=STREAM_MEDIA_TYPES[fmt])
+
+# --------------------------------------------------------------------
+# Message helpers
+# --------------------------------------------------------------------
+
+def text_messages(prompt):
+    return [{
+        "role": "user",
+        "content": [{"type": "text", "text": prompt}],
+    }]
+
+def media_messages(kind, data, prompt):
+    """Use the WORKING multimodal format - media first, then the prompt
+
+    `data` is the raw upload; the scheduler decodes it in memory
+    (PIL image / float32 array) only if the processed inputs aren't cached.
+    """
+    return [{
+        "role": "user",
+        "content": [
+            {"type": kind, kind: data},
+            {"type": "text", "text": prompt},
+        ],
+    }]
 
 # --------------------------------------------------------------------
 # Endpoints - ALL WORKING!
@@ -100,113 +397,733 @@ async def root():
         "note": "Using RAW tokenizer for everything - no Unsloth template conflicts"
     }
 
+def cache_bypassed(http_request):
+    """Per-request opt-out: `X-Cache-Bypass: 1` or `Cache-Control: no-cache`"""
+    return (http_request.headers.get("x-cache-bypass") == "1"
+            or "no-cache" in http_request.headers.get("cache-control", ""))
+
 @app.post("/generate")
-async def generate_text(request: TextRequest):
+async def generate_text(request: TextRequest, http_request: Request, response: Response):
     """Text generation - WORKING PERFECTLY!"""
+    apply_deadline(request.deadline_ms)
     try:
-        messages = [{
-            "role": "user",
-            "content": [{"type": "text", "text": request.prompt}],
-        }]
-        
-        reply = generate_response(messages, max_tokens=request.max_tokens, use_sampling=False)
+        messages = text_messages(request.prompt)
+        spec_stats = {} if request.speculative else None
+        produce = lambda: generate_response(messages, max_tokens=request.max_tokens, use_sampling=False,
+                                            choices=request.choices, adapter=request.adapter,
+                                            speculative=spec_stats)
+
+        # Speculative requests skip the cache so their stats describe a real decode
+        if response_cache is None or spec_stats is not None or cache_bypassed(http_request):
+            reply, status = await produce(), "BYPASS"
+        else:
+            key = response_cache.key(request.prompt, request.max_tokens, adapter=request.adapter,
+                                     choices=request.choices)
+            reply, status = await response_cache.get_or_generate(key, produce)
+
+        response.headers["X-Cache"] = status
+        if spec_stats is not None:
+            return {"text": sanitize(reply), "speculative": spec_stats}
         return {"text": sanitize(reply)}
 
+    except HTTPException:
+        raise
     except Exception as exc:
         raise HTTPException(500, f"Text generation failed: {str(exc)}") from exc
 
 @app.post("/ask_image")
 async def ask_image(
-    prompt: str = Form(...),
+    prompt: Optional[str] = Form(None),
+    prompts: Optional[List[str]] = Form(None),
+    choices: Optional[List[str]] = Form(None),
+    adapter: Optional[str] = Form(None),
+    deadline_ms: Optional[int] = Form(None),
     image: UploadFile = File(...),
 ):
-    """Image processing - NOW WORKING! 🎉"""
-    img_path = None
-    try:
-        # Save uploaded image
-        suffix = os.path.splitext(image.filename)[1] or ".png"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            img_path = tmp.name
-            tmp.write(await image.read())
-
-        # Use the WORKING multimodal format
-        messages = [{
-            "role": "user",
-            "content": [
-                {"type": "image", "image": img_path},
-                {"type": "text", "text": prompt},
-            ],
-        }]
-
-        reply = generate_response(messages, max_tokens=256, use_sampling=True)
+    """Image processing - NOW WORKING! 🎉 (repeat `prompts` to ask several questions at once)
+
+    `choices` ("Low|Medium|High") restricts the answer to one of the listed strings:
+    one field applies to every prompt, or repeat it once per prompt.
+    """
+    apply_deadline(deadline_ms)
+    if not prompt and not prompts:
+        raise HTTPException(422, "Provide `prompt` or one or more `prompts`")
+    choices_list = choice_fields(choices, len(prompts) if prompts else 1)
+    try:
+        data = await image.read()
+        if prompts:
+            replies = await generate_many(
+                [media_messages("image", data, p) for p in prompts],
+                max_tokens=256, use_sampling=True, media_key=media_digest(data),
+                choices_list=choices_list, adapter=adapter,
+            )
+            return {
+                "texts": [sanitize(r) for r in replies],
+                "prompts_used": prompts,
+                "status": "✅ Multimodal processing successful!"
+            }
+
+        messages = media_messages("image", data, prompt)
+        reply = await generate_response(messages, max_tokens=256, use_sampling=True,
+                                        media_key=media_digest(data),
+                                        choices=choices_list[0] if choices_list else None,
+                                        adapter=adapter)
         
         return {
             "text": sanitize(reply),
             "status": "✅ Multimodal processing successful!"
         }
 
+    except HTTPException:
+        raise
     except Exception as exc:
         raise HTTPException(500, f"Image processing failed: {str(exc)}") from exc
-    finally:
-        if img_path and os.path.exists(img_path):
-            os.remove(img_path)
+
+async def answer_audio(wav_bytes, prompt, prompts, upload, choices_list=None, adapter=None,
+                       speculative=False):
+    """Shared body of /ask and /ask_audio - `choices_list` has one entry per prompt
+
+    `speculative` applies to the single-prompt form (several prompts already share a batch).
+    """
+    upload["bytes"] = len(wav_bytes)
+    log.debug("Audio upload (%s): %d bytes on the wire, %d audio bytes, decoded in %s ms",
+              upload["form"], upload["wire_bytes"], upload["bytes"], upload["decode_ms"])
+
+    if prompts:
+        replies = await generate_many(
+            [media_messages("audio", wav_bytes, p) for p in prompts],
+            max_tokens=256, use_sampling=True, media_key=media_digest(wav_bytes),
+            choices_list=choices_list, adapter=adapter,
+        )
+        return {
+            "texts": [sanitize(r) for r in replies],
+            "status": "✅ Audio processing successful!",
+            "prompts_used": prompts,
+            "upload": upload,
+        }
+
+    # Use the WORKING multimodal format with user-provided prompt
+    messages = media_messages("audio", wav_bytes, prompt)
+    spec_stats = {} if speculative else None
+    reply = await generate_response(messages, max_tokens=256, use_sampling=True,
+                                    media_key=media_digest(wav_bytes),
+                                    choices=choices_list[0] if choices_list else None,
+                                    adapter=adapter, speculative=spec_stats)
+
+    result = {
+        "text": sanitize(reply),
+        "status": "✅ Audio processing successful!",
+        "prompt_used": prompt,
+        "upload": upload,
+    }
+    if spec_stats is not None:
+        result["speculative"] = spec_stats
+    return result
+
+# --------------------------------------------------------------------
+# Long-audio mode - overlapping windows decoded as one batch, then stitched
+# --------------------------------------------------------------------
+
+def check_long_audio(prompts, choices, speculative):
+    if prompts or choices or speculative:
+        raise HTTPException(400, "`long_audio` takes a single `prompt` (no prompts, choices or speculative)")
+
+async def long_audio_plan(wav_bytes):
+    """Decode, trim silence (no length cap - that's what the windows are for) and split into windows"""
+    def prepare():
+        audio = decode_audio(wav_bytes, scheduler.sampling_rate)
+        return audio_frontend.process(audio, cap=False) if audio_frontend is not None else audio
+
+    try:
+        audio = await asyncio.to_thread(prepare)
+    except MediaDecodeError as exc:
+        raise undecodable(exc) from exc
+    windows = plan_windows(audio, scheduler.sampling_rate, window_s=config.LONG_AUDIO_WINDOW_S,
+                           overlap_s=config.LONG_AUDIO_OVERLAP_S, search_s=config.LONG_AUDIO_SEARCH_S)
+    if len(windows) > config.LONG_AUDIO_MAX_WINDOWS:
+        raise HTTPException(413, f"Audio needs {len(windows)} windows; at most "
+                                 f"{config.LONG_AUDIO_MAX_WINDOWS} are allowed (GEMMA_LONG_AUDIO_MAX_WINDOWS)")
+    return audio, windows
+
+async def long_audio_results(audio, windows, prompt, adapter):
+    """Queue every window; async iterator of per-window results in completion order"""
+    try:
+        return await transcribe_windows(
+            scheduler, audio, windows, scheduler.sampling_rate,
+            lambda samples: media_messages("audio", samples, prompt), adapter=adapter,
+        )
+    except QueueFullError as exc:
+        raise queue_full(exc) from exc
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+
+async def answer_long_audio(wav_bytes, prompt, adapter, upload):
+    """Long-audio body of /ask and /ask_audio: stitched text plus every window with its latency"""
+    started = time.perf_counter()
+    audio, windows = await long_audio_plan(wav_bytes)
+    results = [None] * len(windows)
+    try:
+        async for window in await long_audio_results(audio, windows, prompt, adapter):
+            window["text"] = sanitize(window["text"])
+            results[window["index"]] = window
+    except RequestCancelled as exc:
+        raise cancelled(exc) from exc
+
+    total_ms = round((time.perf_counter() - started) * 1000, 1)
+    log.debug("Long audio: %.1fs in %d windows, %s ms", len(audio) / scheduler.sampling_rate, len(windows), total_ms)
+    return {
+        "text": stitch([w["text"] for w in results]),
+        "status": "✅ Audio processing successful!",
+        "prompt_used": prompt,
+        "upload": upload,
+        "long_audio": {
+            "duration_s": round(len(audio) / scheduler.sampling_rate, 2),
+            "windows": results,
+            "total_ms": total_ms,
+        },
+    }
+
+async def long_audio_events(audio, windows, results, fmt, started):
+    """Stream a `window` event per decoded window, then `done` with the stitched text"""
+    texts = [None] * len(windows)
+    try:
+        async for window in results:
+            window["text"] = sanitize(window["text"])
+            texts[window["index"]] = window["text"]
+            finished = sum(text is not None for text in texts)
+            yield format_event(fmt, "window", {**window, "finished": finished, "total": len(windows)})
+        yield format_event(fmt, "done", {
+            "text": stitch(texts),
+            "duration_s": round(len(audio) / scheduler.sampling_rate, 2),
+            "windows": len(windows),
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+    except Exception as exc:
+        yield format_event(fmt, "error", {"error": str(exc)})
+
+def decode_audio_field(data):
+    """Base64 `data` of a JSON audio request -> bytes (422 if not base64, 413 over the size cap)"""
+    try:
+        wav_bytes = base64.b64decode(data, validate=True)
+    except ValueError:
+        raise HTTPException(422, "Invalid base64 audio") from None
+    if len(wav_bytes) > MAX_AUDIO_BYTES:
+        raise HTTPException(413, f"Audio larger than {config.MAX_AUDIO_MB} MB")
+    return wav_bytes
 
 @app.post("/ask")
 async def ask_audio(payload: AudioPayload):
-    """Audio processing - NOW WORKING! 🎉"""
-    wav_path = None
+    """Audio processing - NOW WORKING! 🎉 (base64 JSON form, kept for compatibility)"""
+    apply_deadline(payload.deadline_ms)
     try:
         # Decode base64 audio data
-        wav_bytes = base64.b64decode(payload.data)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            wav_path = tmp.name
-            tmp.write(wav_bytes)
-
-        # Use the WORKING multimodal format with user-provided prompt
-        messages = [{
-            "role": "user",
-            "content": [
-                {"type": "audio", "audio": wav_path},
-                {"type": "text", "text": payload.prompt},
-            ],
-        }]
-
-        reply = generate_response(messages, max_tokens=256, use_sampling=True)
-        
-        return {
-            "text": sanitize(reply),
-            "status": "✅ Audio processing successful!",
-            "prompt_used": payload.prompt
+        started = time.perf_counter()
+        wav_bytes = decode_audio_field(payload.data)
+
+        upload = {
+            "form": "json",
+            "wire_bytes": len(payload.data),
+            "decode_ms": round((time.perf_counter() - started) * 1000, 2),
         }
+        if payload.long_audio:
+            check_long_audio(payload.prompts, payload.choices, payload.speculative)
+            return await answer_long_audio(wav_bytes, payload.prompt, payload.adapter, upload)
+        choices_list = [payload.choices] * len(payload.prompts or [None]) if payload.choices else None
+        return await answer_audio(wav_bytes, payload.prompt, payload.prompts, upload, choices_list,
+                                  payload.adapter, payload.speculative)
 
+    except HTTPException:
+        raise
     except Exception as exc:
         raise HTTPException(500, f"Audio processing failed: {str(exc)}") from exc
-    finally:
-        if wav_path and os.path.exists(wav_path):
-            os.remove(wav_path)
+
+async def read_body_capped(request, limit):
+    """Read a raw request body chunk by chunk, refusing anything over `limit`"""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(413, f"Audio larger than {config.MAX_AUDIO_MB} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+@app.post("/ask_audio")
+async def ask_audio_binary(
+    request: Request,
+    prompt: str = "What is this audio about?",
+    prompts: Optional[List[str]] = Query(None),
+    choices: Optional[List[str]] = Query(None),
+    adapter: Optional[str] = None,
+    speculative: bool = False,
+    long_audio: bool = False,
+    deadline_ms: Optional[int] = None,
+):
+    """Audio processing without base64 - multipart `audio` file or raw audio body
+
+    • multipart/form-data: `audio` file plus `prompt` or repeated `prompts` fields
+    • raw body (audio/wav, application/octet-stream, ...): prompt(s) as query params
+    • `choices` ("Yes|No") and `adapter` work as on /ask_image, as fields or query params
+    • `speculative=true` decodes greedily with the draft model (single prompt)
+    • `long_audio=true` transcribes a clip past 30 s in overlapping windows
+    """
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+        if declared > MAX_AUDIO_BYTES + 64 * 1024:  # allow for multipart framing
+            raise HTTPException(413, f"Audio larger than {config.MAX_AUDIO_MB} MB")
+
+        started = time.perf_counter()
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            audio = form.get("audio")
+            if audio is None or isinstance(audio, str):
+                raise HTTPException(422, "Multipart upload needs an `audio` file field")
+            wav_bytes = await audio.read()
+            if len(wav_bytes) > MAX_AUDIO_BYTES:
+                raise HTTPException(413, f"Audio larger than {config.MAX_AUDIO_MB} MB")
+            prompt = form.get("prompt") or prompt
+            prompts = form.getlist("prompts") or prompts
+            choices = form.getlist("choices") or choices
+            adapter = form.get("adapter") or adapter
+            speculative = form.get("speculative", str(speculative)).lower() in ("1", "true")
+            long_audio = form.get("long_audio", str(long_audio)).lower() in ("1", "true")
+            deadline_ms = int(form.get("deadline_ms") or deadline_ms or 0)
+            form_name = "multipart"
+        else:
+            wav_bytes = await read_body_capped(request, MAX_AUDIO_BYTES)
+            form_name = "raw"
+
+        if not wav_bytes:
+            raise HTTPException(422, "Empty audio upload")
+        apply_deadline(deadline_ms)
+
+        upload = {
+            "form": form_name,
+            "wire_bytes": declared or len(wav_bytes),
+            "decode_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        if long_audio:
+            check_long_audio(prompts, choices, speculative)
+            return await answer_long_audio(wav_bytes, prompt, adapter, upload)
+        choices_list = choice_fields(choices, len(prompts) if prompts else 1)
+        return await answer_audio(wav_bytes, prompt, prompts, upload, choices_list, adapter, speculative)
+
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise HTTPException(500, f"Audio processing failed: {str(exc)}") from exc
+
+# --------------------------------------------------------------------
+# Batch endpoints - many uploads per call, each item succeeds or fails alone
+# --------------------------------------------------------------------
+
+def batch_prompts(count, prompt, item_prompts, prompts):
+    """Each item's prompt (its own, else the shared `prompt`), or None when `prompts` is asked of all"""
+    if count == 0:
+        raise HTTPException(422, "No items to process")
+    if count > config.MAX_BATCH_ITEMS:
+        raise HTTPException(413, f"At most {config.MAX_BATCH_ITEMS} items per batch call")
+    if prompts:
+        if len(prompts) > scheduler.max_batch_size:
+            raise HTTPException(400, f"At most {scheduler.max_batch_size} prompts per upload")
+        return None
+    if item_prompts and len(item_prompts) != count:
+        raise HTTPException(422, f"Got {len(item_prompts)} item prompts for {count} items")
+    resolved = [own or prompt for own in (item_prompts or [None] * count)]
+    if not all(resolved):
+        raise HTTPException(422, "Provide `prompt`, `prompts` or a prompt for every item")
+    return resolved
+
+def item_error(exc):
+    """Status and message for one failed item - the HTTP error it would get on its own"""
+    if isinstance(exc, QueueFullError):
+        exc = queue_full(exc)
+    elif isinstance(exc, RequestCancelled):
+        exc = cancelled(exc)
+    elif isinstance(exc, ChoiceError):
+        exc = HTTPException(400, str(exc))
+    elif isinstance(exc, MediaDecodeError):
+        exc = undecodable(exc)
+    elif isinstance(exc, ValidationError):
+        exc = HTTPException(422, str(exc))
+    if isinstance(exc, HTTPException):
+        return {"error": exc.detail, "status": exc.status_code}
+    return {"error": f"Processing failed: {str(exc) or type(exc).__name__}", "status": 500}
+
+async def answer_batch(kind, uploads, item_prompts, prompts, choices_list, adapter):
+    """Shared body of /ask_image_batch and /ask_batch
+
+    `uploads` holds each item's bytes, or the HTTPException reading it failed with.
+    Items go through the scheduler together (see BatchScheduler.submit_batch), so
+    frames from one burst share batches instead of decoding one by one.
+    """
+    started = time.perf_counter()
+    results = list(uploads)
+    groups, indices = [], []
+    for index, data in enumerate(uploads):
+        if isinstance(data, Exception):
+            continue
+        asked = prompts or [item_prompts[index]]
+        groups.append(([media_messages(kind, data, p) for p in asked], media_digest(data), choices_list))
+        indices.append(index)
+
+    try:
+        replies = await scheduler.submit_batch(groups, max_tokens=256, use_sampling=True, adapter=adapter)
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+    for index, reply in zip(indices, replies):
+        results[index] = reply
+
+    items = []
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            items.append({"index": index, **item_error(result)})
+        elif prompts:
+            items.append({"index": index, "texts": [sanitize(r) for r in result]})
+        else:
+            items.append({"index": index, "text": sanitize(result[0])})
+    failed = sum("error" in item for item in items)
+    log.debug("%s batch: %d items, %d failed, %.0f ms", kind, len(items), failed,
+              (time.perf_counter() - started) * 1000)
+    return {
+        "results": items,
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "status": "✅ Batch processed" if not failed else "⚠️ Batch processed with item errors",
+    }
+
+@app.post("/ask_image_batch")
+async def ask_image_batch(
+    images: List[UploadFile] = File(...),
+    prompt: Optional[str] = Form(None),
+    item_prompts: Optional[List[str]] = Form(None),
+    prompts: Optional[List[str]] = Form(None),
+    choices: Optional[List[str]] = Form(None),
+    adapter: Optional[str] = Form(None),
+    deadline_ms: Optional[int] = Form(None),
+):
+    """Many images in one call (repeat `images`) - results come back in upload order
+
+    • `prompt`: asked of every image, or `item_prompts` repeated once per image
+    • `prompts` (repeated): all asked of every image → `texts` per item
+    • `choices` and `adapter` work as on /ask_image
+    A bad image only fails its own item (`error` + `status` in its result).
+    """
+    apply_deadline(deadline_ms)
+    per_item = batch_prompts(len(images), prompt, item_prompts, prompts)
+    choices_list = choice_fields(choices, len(prompts) if prompts else 1)
+
+    uploads = []
+    for image in images:
+        data = await image.read()
+        uploads.append(data if data else HTTPException(422, f"Empty upload '{image.filename}'"))
+    return await answer_batch("image", uploads, per_item, prompts, choices_list, adapter)
+
+@app.post("/ask_batch")
+async def ask_batch(payload: AudioBatchPayload):
+    """Many base64 audio clips in one call - results come back in item order
+
+    Each item may carry its own `prompt`; `prompts` asks every prompt of every clip.
+    A bad clip only fails its own item (`error` + `status` in its result).
+    """
+    apply_deadline(payload.deadline_ms)
+    per_item = batch_prompts(len(payload.items), payload.prompt,
+                             [item.prompt for item in payload.items], payload.prompts)
+    choices_list = [payload.choices] * len(payload.prompts or [None]) if payload.choices else None
+
+    uploads = []
+    for item in payload.items:
+        try:
+            wav_bytes = base64.b64decode(item.data, validate=True)
+        except ValueError:
+            uploads.append(HTTPException(422, "Invalid base64 audio"))
+            continue
+        if not wav_bytes:
+            uploads.append(HTTPException(422, "Empty audio upload"))
+        elif len(wav_bytes) > MAX_AUDIO_BYTES:
+            uploads.append(HTTPException(413, f"Audio larger than {config.MAX_AUDIO_MB} MB"))
+        else:
+            uploads.append(wav_bytes)
+    return await answer_batch("audio", uploads, per_item, payload.prompts, choices_list, payload.adapter)
+
+async def rank_candidates(messages, media_key, candidates, length_normalize=False, adapter=None):
+    """Shared body of /score and /score batch-job lines"""
+    if len(set(candidates)) != len(candidates):
+        raise HTTPException(400, "Candidates must be distinct")
+    try:
+        logprobs, lengths = await scheduler.submit_score(messages, candidates, media_key=media_key,
+                                                         adapter=adapter)
+    except QueueFullError as exc:
+        raise queue_full(exc) from exc
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+    except RequestCancelled as exc:
+        raise cancelled(exc) from exc
+    except MediaDecodeError as exc:
+        raise undecodable(exc) from exc
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+
+    averages = [lp / n for lp, n in zip(logprobs, lengths)]
+    probabilities = softmax(averages if length_normalize else logprobs)
+    scores = [
+        {"candidate": c, "probability": round(p, 6), "logprob": round(lp, 4),
+         "avg_logprob": round(avg, 4), "tokens": n}
+        for c, p, lp, avg, n in zip(candidates, probabilities, logprobs, averages, lengths)
+    ]
+    return {"best": max(scores, key=lambda s: s["probability"])["candidate"], "scores": scores}
+
+@app.post("/score")
+async def score(
+    prompt: str = Form(...),
+    candidates: List[str] = Form(...),
+    length_normalize: bool = Form(False),
+    adapter: Optional[str] = Form(None),
+    deadline_ms: Optional[int] = Form(None),
+    image: Optional[UploadFile] = File(None),
+    audio: Optional[UploadFile] = File(None),
+):
+    """Rank candidate answers by likelihood - one prefill + one batched pass, no generation
+
+    Repeat `candidates` once per answer; attach at most one `image` or `audio` file.
+    `length_normalize` ranks by mean per-token log-probability instead of the sum.
+    """
+    if image is not None and audio is not None:
+        raise HTTPException(422, "Attach an image or an audio clip, not both")
+    apply_deadline(deadline_ms)
+    try:
+        started = time.perf_counter()
+        upload = image or audio
+        if upload is not None:
+            data = await upload.read()
+            kind = "image" if image is not None else "audio"
+            messages, media_key = media_messages(kind, data, prompt), media_digest(data)
+        else:
+            messages, media_key = text_messages(prompt), None
+
+        result = await rank_candidates(messages, media_key, candidates, length_normalize, adapter)
+        return {**result, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise HTTPException(500, f"Scoring failed: {str(exc)}") from exc
+
+# --------------------------------------------------------------------
+# Batch jobs - JSONL lines answered like their endpoints, on idle GPU time
+# --------------------------------------------------------------------
+
+def job_upload(body, field):
+    try:
+        return base64.b64decode(body[field], validate=True)
+    except KeyError:
+        raise HTTPException(422, f"`{field}` (base64) is required") from None
+    except (ValueError, TypeError):
+        raise HTTPException(422, f"Invalid base64 in `{field}`") from None
+
+async def job_generate(body):
+    request = TextRequest(**body)
+    reply = await generate_response(text_messages(request.prompt), max_tokens=request.max_tokens,
+                                    use_sampling=False, choices=request.choices, adapter=request.adapter)
+    return {"text": sanitize(reply)}
+
+async def job_media(kind, field, body, default_prompt=None):
+    """/ask_image and /ask lines: base64 upload in `field`, `prompt` or `prompts`, `choices`, `adapter`"""
+    data = job_upload(body, field)
+    prompts, choices, adapter = body.get("prompts"), body.get("choices"), body.get("adapter")
+    if prompts:
+        replies = await generate_many(
+            [media_messages(kind, data, p) for p in prompts], max_tokens=256, use_sampling=True,
+            media_key=media_digest(data), choices_list=[choices] * len(prompts) if choices else None,
+            adapter=adapter,
+        )
+        return {"texts": [sanitize(r) for r in replies]}
+    prompt = body.get("prompt") or default_prompt
+    if not prompt:
+        raise HTTPException(422, "Provide `prompt` or `prompts`")
+    reply = await generate_response(media_messages(kind, data, prompt), max_tokens=256, use_sampling=True,
+                                    media_key=media_digest(data), choices=choices, adapter=adapter)
+    return {"text": sanitize(reply)}
+
+async def job_score(body):
+    """/score lines: `prompt`, `candidates`, optional base64 `image` or `audio`"""
+    if "image" in body and "audio" in body:
+        raise HTTPException(422, "Attach an image or an audio clip, not both")
+    kind = "image" if "image" in body else "audio" if "audio" in body else None
+    prompt, candidates = body.get("prompt"), body.get("candidates")
+    if not prompt or not candidates:
+        raise HTTPException(422, "`prompt` and `candidates` are required")
+    if kind is not None:
+        data = job_upload(body, kind)
+        messages, media_key = media_messages(kind, data, prompt), media_digest(data)
+    else:
+        messages, media_key = text_messages(prompt), None
+    return await rank_candidates(messages, media_key, candidates, body.get("length_normalize", False),
+                                 body.get("adapter"))
+
+JOB_HANDLERS = {
+    "/generate": job_generate,
+    "/ask_image": lambda body: job_media("image", "image", body),
+    "/ask": lambda body: job_media("audio", "data", body, "What is this audio about?"),
+    "/score": job_score,
+}
+
+job_manager = JobManager(
+    JOB_HANDLERS,
+    item_error,
+    directory=config.JOBS_DIR,
+    concurrency=2 * config.JOB_BATCH_SIZE,
+) if config.JOBS_ENABLED else None
+
+def find_job(job_id):
+    if job_manager is None:
+        raise HTTPException(404, "Batch jobs are disabled (GEMMA_JOBS=0)")
+    job = job_manager.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"No batch job '{job_id}'")
+    return job
+
+@app.post("/jobs")
+async def submit_job(file: UploadFile = File(...), name: Optional[str] = Form(None)):
+    """Queue a JSONL batch job: one {"request_id", "endpoint", "json"} object per line
+
+    Lines go to /generate, /ask_image, /ask or /score with the same fields as
+    those endpoints take (uploads as base64). They run only while no live
+    request is waiting. Poll GET /jobs/{id}; fetch GET /jobs/{id}/results.
+    """
+    if job_manager is None:
+        raise HTTPException(404, "Batch jobs are disabled (GEMMA_JOBS=0)")
+    content = await file.read()
+    if len(content) > config.JOB_MAX_MB * 1024 * 1024:
+        raise HTTPException(413, f"Job file larger than {config.JOB_MAX_MB} MB")
+    try:
+        job = await job_manager.submit(content, name or file.filename)
+    except JobError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    return JSONResponse(job.progress(), status_code=202)
+
+@app.get("/jobs")
+async def list_jobs():
+    """Every batch job with its progress, newest first"""
+    if job_manager is None:
+        return {"enabled": False}
+    return {"enabled": True, "background_pending": scheduler.background_depth, **job_manager.stats()}
+
+@app.get("/jobs/{job_id}")
+async def job_progress(job_id: str):
+    """Status, lines finished/failed, throughput (lines/s) and ETA of one job"""
+    return find_job(job_id).progress()
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str):
+    """Results JSONL - complete and in input order once the job is `completed`"""
+    job = find_job(job_id)
+    path = job.path("results.jsonl")
+    if not os.path.exists(path):
+        raise HTTPException(404, f"Batch job '{job_id}' has no results yet")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{job_id}-results.jsonl")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Stop a queued or running job; results written so far are kept"""
+    job = find_job(job_id)
+    job_manager.cancel(job)
+    return job.progress()
+
+# --------------------------------------------------------------------
+# Streaming endpoints - opt-in, ?format=sse (default) or ?format=ndjson
+# --------------------------------------------------------------------
+
+@app.post("/generate/stream")
+async def generate_text_stream(request: TextRequest, format: str = "sse"):
+    """Text generation, streamed token by token"""
+    apply_deadline(request.deadline_ms)
+    messages = text_messages(request.prompt)
+    return await stream_response(messages, format, max_tokens=request.max_tokens, use_sampling=False,
+                                 adapter=request.adapter)
+
+@app.post("/ask_image/stream")
+async def ask_image_stream(
+    prompt: str = Form(...),
+    image: UploadFile = File(...),
+    adapter: Optional[str] = Form(None),
+    deadline_ms: Optional[int] = Form(None),
+    format: str = "sse",
+):
+    """Image processing, streamed token by token"""
+    apply_deadline(deadline_ms)
+    data = await image.read()
+    messages = media_messages("image", data, prompt)
+    return await stream_response(messages, format, max_tokens=256, use_sampling=True,
+                                 media_key=media_digest(data), adapter=adapter)
+
+@app.post("/ask/stream")
+async def ask_audio_stream(payload: AudioPayload, format: str = "sse"):
+    """Audio processing, streamed token by token
+
+    With `long_audio` the stream carries one `window` event per decoded window
+    (text, time span, latency, progress) and a `done` event with the stitched text.
+    """
+    apply_deadline(payload.deadline_ms)
+    wav_bytes = decode_audio_field(payload.data)  # before the stream starts, so errors get a status code
+    if payload.long_audio:
+        if format not in STREAM_MEDIA_TYPES:
+            raise HTTPException(400, f"Unknown stream format '{format}' (use sse or ndjson)")
+        check_long_audio(payload.prompts, payload.choices, payload.speculative)
+        started = time.perf_counter()
+        audio, windows = await long_audio_plan(wav_bytes)
+        results = await long_audio_results(audio, windows, payload.prompt, payload.adapter)
+        return StreamingResponse(long_audio_events(audio, windows, results, format, started),
+                                 media_type=STREAM_MEDIA_TYPES[format])
+    messages = media_messages("audio", wav_bytes, payload.prompt)
+    return await stream_response(messages, format, max_tokens=256, use_sampling=True,
+                                 media_key=media_digest(wav_bytes), adapter=payload.adapter)
+
+@app.get("/livez")
+async def liveness():
+    """Process is up and the batch worker thread is running - no generation"""
+    if not scheduler.alive:
+        return JSONResponse({"status": "dead", "worker_alive": False}, status_code=503)
+    return {"status": "alive", "worker_alive": True}
+
+def startup_timings():
+    """Seconds per loader phase plus process start -> first passing self-test"""
+    timings = dict(load_timings)
+    if self_test.first_ok_at is not None:
+        timings["time_to_ready"] = round(self_test.first_ok_at - PROCESS_STARTED, 2)
+    return timings
+
+@app.get("/readyz")
+async def readiness():
+    """Ready for traffic: model loaded, worker alive, queue has room, self-test passing"""
+    checks = {
+        "model_loaded": model is not None,
+        "worker_alive": scheduler.alive,
+        "queue_has_room": scheduler.queue_depth < scheduler.max_queue_size,
+        "self_test_ok": self_test.healthy,
+    }
+    body = {
+        "status": "ready" if all(checks.values()) else "not_ready",
+        **checks,
+        "queue_depth": scheduler.queue_depth,
+        "last_success_at": scheduler.last_success_at,
+        "self_test": self_test.result,
+        "startup": startup_timings(),
+    }
+    return JSONResponse(body, status_code=200 if all(checks.values()) else 503)
 
 @app.get("/health")
 async def health_check():
-    """Health check - test both text and multimodal"""
-    try:
-        # Test text
-        text_messages = [{
-            "role": "user", 
-            "content": [{"type": "text", "text": "Hello"}]
-        }]
-        text_response = generate_response(text_messages, max_tokens=10, use_sampling=False)
-        
-        return {
-            "status": "healthy",
-            "text_generation": "✅ working",
-            "text_test": text_response,
-            "note": "Using unified RAW tokenizer approach"
-        }
-    except Exception as e:
-        return {
-            "status": "unhealthy", 
-            "error": str(e)
-        }
+    """Cached result of the background self-test (does not run generation)"""
+    result = self_test.result
+    if result is None:
+        return {"status": "starting", "note": "First self-test has not finished yet"}
+    return {
+        "status": "healthy" if self_test.healthy else "unhealthy",
+        "text_generation": "✅ working" if self_test.healthy else "❌ failing",
+        "self_test": result,
+        "last_success_at": scheduler.last_success_at,
+    }
 
 @app.get("/capabilities")
 async def get_capabilities():
@@ -215,11 +1132,100 @@ async def get_capabilities():
         "text_generation": "✅ Fully supported and working",
         "image_processing": "✅ WORKING! (Using RAW tokenizer)", 
         "audio_processing": "✅ WORKING! (Using RAW tokenizer with custom prompts)",
-        "model": "gemma-3n-E4B-it",
-        "precision": "4-bit (tutorial config)",
+        "model": config.MODEL_NAME,
+        "precision": BACKEND.precision,
+        "backend": BACKEND.describe(),
         "approach": "Single RAW tokenizer for all requests - no template conflicts"
     }
 
+@app.get("/scheduler")
+async def scheduler_stats():
+    """Batch occupancy, queue depth and queue wait times"""
+    return scheduler.stats()
+
+@app.post("/prefix_cache/register")
+async def register_prefix(request: PrefixRequest):
+    """Pre-register a prompt prefix (e.g. a fixed instruction) for KV reuse"""
+    if prefix_cache is None:
+        raise HTTPException(404, "Prefix cache is disabled (GEMMA_PREFIX_CACHE=0)")
+    try:
+        tokens = prefix_cache.register_prompt(request.prompt)
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    return {"status": "registered", "prefix_tokens": tokens}
+
+@app.get("/prefix_cache")
+async def prefix_cache_stats():
+    """Hit/miss counters, prefill tokens saved and cached prefixes"""
+    if prefix_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **prefix_cache.stats()}
+
+@app.get("/media_cache")
+async def media_cache_stats():
+    """Encoder rows saved plus media cache hits, misses, bytes and evictions"""
+    return media_encoder.stats()
+
+@app.get("/audio_frontend")
+async def audio_frontend_stats():
+    """Seconds of audio trimmed before the encoder (silence, pauses, length cap) and frames saved"""
+    if audio_frontend is None:
+        return {"enabled": False}
+    return {"enabled": True, **audio_frontend.stats()}
+
+@app.get("/image_prestage")
+async def image_prestage_stats():
+    """Draft decodes, EXIF rotations, downscales, decode time and pixel bytes saved"""
+    if image_prestage is None:
+        return {"enabled": False}
+    return {"enabled": True, **image_prestage.stats()}
+
+@app.get("/adapters")
+async def list_adapters():
+    """LoRA adapters currently loaded on the shared base model"""
+    return adapters.stats()
+
+@app.post("/adapters")
+async def load_adapter(request: AdapterRequest):
+    """Load a LoRA adapter at runtime (runs between batches, no restart)"""
+    try:
+        info = await scheduler.run_on_worker(lambda: adapters.load(request.name, request.path))
+    except ValueError as exc:
+        raise HTTPException(400, str(exc)) from exc
+    except Exception as exc:
+        raise HTTPException(500, f"Adapter load failed: {str(exc)}") from exc
+    return {"status": "loaded", "name": request.name, **info}
+
+@app.delete("/adapters/{name}")
+async def unload_adapter(name: str):
+    """Unload a LoRA adapter; queued requests that asked for it get a 404"""
+    try:
+        await scheduler.run_on_worker(lambda: adapters.unload(name))
+    except UnknownAdapterError as exc:
+        raise unknown_adapter(exc) from exc
+    return {"status": "unloaded", "name": name}
+
+@app.get("/speculative")
+async def speculative_stats():
+    """Draft-token acceptance across all speculative requests"""
+    if speculative_decoder is None:
+        return {"enabled": False}
+    return {"enabled": True, "draft_model": config.DRAFT_MODEL_NAME, **speculative_decoder.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape target"""
+    if metrics is None:
+        raise HTTPException(404, "Metrics are disabled (GEMMA_METRICS=0)")
+    return PlainTextResponse(metrics.export(), media_type="text/plain; version=0.0.4")
+
+@app.get("/response_cache")
+async def response_cache_stats():
+    """Hit ratio, entries and bytes of the greedy /generate response cache"""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
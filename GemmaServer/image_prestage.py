@@ -0,0 +1,109 @@
+"""
+Image pre-stage - decode only as many pixels as the vision encoder will see
+
+The processor resizes every image to the encoder's input size (768x768 for
+Gemma 3n). Full-resolution webcam frames and phone photos used to be decoded
+completely first and thrown away in that resize. This stage:
+
+• asks libjpeg for a reduced-scale "draft" decode (1/2, 1/4 or 1/8 size, never
+  below the target), which skips most of the IDCT work
+• applies the EXIF orientation, so phone photos reach the model upright
+• resizes what is left straight to the target size with the processor's own
+  bicubic filter, so the processor's resize becomes a plain copy (Gemma 3n's
+  processor stretches to 768x768 regardless of aspect ratio, and so does this)
+
+It runs wherever uploads are decoded, i.e. on the scheduler's preprocessing
+thread pool, and keeps running totals of decode time and pixel bytes saved.
+"""
+
+import io
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+from media_io import unreadable_image
+
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)  # EXIF orientations that swap width and height
+
+class ImagePreStage:
+    def __init__(self, target_size=(768, 768), draft=True, exif=True, downscale=True, metrics=None):
+        self.target_size = target_size  # (width, height) the encoder takes, None = keep full size
+        self.draft = draft
+        self.exif = exif
+        self.downscale = downscale
+        self.metrics = metrics
+
+        self._lock = threading.Lock()  # images are decoded on the preprocessing pool
+        self._images = 0
+        self._drafted = 0
+        self._rotated = 0
+        self._downscaled = 0
+        self._decode_seconds = 0.0
+        self._max_decode_seconds = 0.0
+        self._upload_bytes = 0
+        self._bytes_saved = 0
+
+    def decode(self, data):
+        """JPEG/PNG/... bytes -> upright RGB PIL image, no bigger than the encoder needs"""
+        try:
+            return self._decode(data)
+        except OSError as exc:
+            raise unreadable_image(exc) from exc
+
+    def _decode(self, data):
+        started = time.perf_counter()
+        image = Image.open(io.BytesIO(data))
+        full_width, full_height = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1) if self.exif else 1
+
+        target = self.target_size
+        if target is not None and orientation in TRANSPOSED_ORIENTATIONS:
+            target = target[::-1]  # the stored image is sideways
+        drafted = False
+        if self.draft and target is not None and image.format == "JPEG":
+            image.draft("RGB", target)
+            drafted = image.size != (full_width, full_height)
+
+        rotated = orientation != 1
+        if rotated:
+            image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+
+        downscaled = False
+        if self.downscale and self.target_size is not None:
+            width, height = self.target_size
+            if image.width * image.height > width * height:  # smaller images are left to the processor
+                image = image.resize(self.target_size, Image.Resampling.BICUBIC, reducing_gap=3.0)
+                downscaled = True
+
+        elapsed = time.perf_counter() - started
+        saved = (full_width * full_height - image.width * image.height) * 3  # RGB bytes never handed on
+        with self._lock:
+            self._images += 1
+            self._drafted += drafted
+            self._rotated += rotated
+            self._downscaled += downscaled
+            self._decode_seconds += elapsed
+            self._max_decode_seconds = max(self._max_decode_seconds, elapsed)
+            self._upload_bytes += len(data)
+            self._bytes_saved += saved
+        if self.metrics is not None:
+            self.metrics.observe_image(elapsed, saved)
+        return image
+
+    def stats(self):
+        with self._lock:
+            images = self._images
+            return {
+                "target_size": list(self.target_size) if self.target_size else None,
+                "images": images,
+                "drafted": self._drafted,
+                "rotated": self._rotated,
+                "downscaled": self._downscaled,
+                "avg_decode_ms": round(self._decode_seconds / images * 1000, 2) if images else 0.0,
+                "max_decode_ms": round(self._max_decode_seconds * 1000, 2),
+                "upload_bytes": self._upload_bytes,
+                "decoded_bytes_saved": self._bytes_saved,
+            }
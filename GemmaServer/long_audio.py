@@ -0,0 +1,114 @@
+"""
+Long-audio transcription - clips longer than one audio-encoder window
+
+Gemma 3n's feature extractor keeps the first 30 s of a clip and drops the
+rest. In long-audio mode a clip is instead split into overlapping windows
+(GEMMA_LONG_AUDIO_WINDOW_S, with GEMMA_LONG_AUDIO_OVERLAP_S overlap). Each
+window edge is moved to the quietest moment in the last seconds before it,
+so words are rarely cut in half.
+
+All windows are queued together, so they decode as one batch (or a few, past
+GEMMA_MAX_BATCH_SIZE). The transcripts are then stitched back together in
+order, dropping the words repeated in each overlap.
+"""
+
+import asyncio
+import re
+import time
+
+import numpy as np
+
+from audio_frontend import FRAME_MS, frame_db
+
+def plan_windows(audio, sampling_rate, window_s=25.0, overlap_s=2.0, search_s=3.0):
+    """(start, end) sample ranges covering the clip, each ending at a quiet point
+
+    The last window may run up to `search_s` past `window_s` rather than leave a sliver.
+    """
+    total = len(audio)
+    window = int(window_s * sampling_rate)
+    search = int(search_s * sampling_rate)
+    if total <= window + search:
+        return [(0, total)]
+
+    frame = int(sampling_rate * FRAME_MS / 1000)
+    overlap = int(overlap_s * sampling_rate)
+    levels = frame_db(audio, frame)
+    windows, start = [], 0
+    while total - start > window + search:
+        target = start + window
+        # Search the last `search_s` before the target, but always move past the overlap
+        lo = max(target - search, start + overlap + frame) // frame
+        hi = target // frame
+        end = (lo + int(np.argmin(levels[lo:hi])) + 1) * frame if hi > lo else target
+        windows.append((start, min(end, target)))
+        start = windows[-1][1] - overlap
+    windows.append((start, total))
+    return windows
+
+def _normalize(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+def stitch(texts, max_overlap_words=40, min_match=2):
+    """Join window transcripts, dropping the words both sides of an overlap transcribed
+
+    Looks for the longest run of words (case and punctuation ignored) shared by
+    the end of the text so far and the start of the next window. Keeps the
+    earlier copy and continues after the run. Words past the run at the end of
+    the earlier window were heard at its cut edge, so they are dropped too.
+    """
+    words = []
+    for text in texts:
+        new = text.split()
+        if words and new:
+            tail = [_normalize(w) for w in words[-max_overlap_words:]]
+            head = [_normalize(w) for w in new[:max_overlap_words]]
+            best, tail_end, head_end = 0, 0, 0
+            for i in range(len(tail)):
+                for j in range(len(head)):
+                    k = 0
+                    while i + k < len(tail) and j + k < len(head) and tail[i + k] and tail[i + k] == head[j + k]:
+                        k += 1
+                    if k > best:
+                        best, tail_end, head_end = k, i + k, j + k
+            if best >= min_match:
+                words = words[:len(words) - len(tail) + tail_end]
+                new = new[head_end:]
+        words.extend(new)
+    return " ".join(words)
+
+async def transcribe_windows(scheduler, audio, windows, sampling_rate, messages_for, adapter=None,
+                             max_tokens=256):
+    """Queue every window at once and return an async iterator over their results
+
+    `messages_for(samples)` builds the chat messages for one window. Queueing
+    errors (queue full, unknown adapter) raise here, before anything is
+    streamed. Results arrive in completion order, each with its index, time
+    span, text and latency from queueing to reply.
+    """
+    started = time.perf_counter()
+    waits = await scheduler.submit_each(
+        [messages_for(audio[start:end]) for start, end in windows],
+        max_tokens=max_tokens, use_sampling=False, adapter=adapter,
+    )
+    return _window_results(waits, windows, sampling_rate, started)
+
+async def _window_results(waits, windows, sampling_rate, started):
+    async def tagged(index, wait):
+        return index, await wait
+
+    tasks = [asyncio.ensure_future(tagged(i, wait)) for i, wait in enumerate(waits)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, text = await next_done
+            start, end = windows[index]
+            yield {
+                "index": index,
+                "start_s": round(start / sampling_rate, 2),
+                "end_s": round(end / sampling_rate, 2),
+                "text": text,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+    finally:
+        for task in tasks:
+            task.cancel()  # only still-pending windows: the caller gave up or one window failed
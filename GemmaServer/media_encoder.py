@@ -0,0 +1,208 @@
+"""
+Vision / audio encoder hooks and content-addressed media cache
+
+Uploads are identified by a digest of their bytes plus the processor config.
+The hooks wrap `get_image_features` / `get_audio_features` on the model's
+multimodal core so that, inside one generate() call:
+
+• rows that share an upload carry its media tensor once and the encoder
+  output is fanned back out to every row that needs it, and
+• encoder outputs for uploads seen recently come from a byte-bounded LRU
+  with a TTL instead of being recomputed.
+
+Processed inputs for a (upload, prompt) pair are cached as well, so a
+retried request also skips media decoding and preprocessing.
+"""
+
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+
+import torch
+from transformers import BatchEncoding
+from transformers.utils import ModelOutput
+
+ENCODER_METHODS = ("get_image_features", "get_audio_features")
+
+def media_digest(data):
+    """Content address for uploaded media bytes"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def processor_fingerprint(processor):
+    """Short hash of the image/audio preprocessing config"""
+    parts = []
+    for name in ("image_processor", "feature_extractor"):
+        component = getattr(processor, name, None)
+        if component is not None and hasattr(component, "to_dict"):
+            parts.append(json.dumps(component.to_dict(), sort_keys=True, default=str))
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=8).hexdigest()
+
+def find_multimodal_core(model):
+    """Innermost module that owns the encoder methods (parents are visited first)"""
+    core = None
+    for module in model.modules():
+        if any(hasattr(module, name) for name in ENCODER_METHODS):
+            core = module
+    return core
+
+# --------------------------------------------------------------------
+# Row helpers - encoder outputs are a tensor, a tuple of tensors, or a
+# ModelOutput (transformers >= 5: Gemma 3n reads `.pooler_output` and
+# `.audio_mel_mask` from it) whose fields are handled one by one
+# --------------------------------------------------------------------
+
+def _rebuild(output, fields):
+    """Same ModelOutput class, with every set field replaced"""
+    return type(output)(**fields)
+
+def _expand(output, index):
+    """Fan encoder output rows back out to one row per batch entry"""
+    if isinstance(output, torch.Tensor):
+        return output[index.to(output.device)]
+    if isinstance(output, ModelOutput):
+        return _rebuild(output, {name: _expand(value, index) for name, value in output.items()})
+    if isinstance(output, tuple):
+        return tuple(_expand(item, index) for item in output)
+    raise TypeError(f"Unsupported encoder output type: {type(output).__name__}")
+
+def _row(output, i):
+    if isinstance(output, ModelOutput):
+        return _rebuild(output, {name: _row(value, i) for name, value in output.items()})
+    if isinstance(output, tuple):
+        return tuple(_row(item, i) for item in output)
+    return output[i:i + 1]
+
+def _stack(rows):
+    """Concatenate per-upload outputs, or None when their shapes differ"""
+    if isinstance(rows[0], ModelOutput):
+        fields = {name: _stack([r[name] for r in rows]) for name in rows[0].keys()}
+        return None if any(v is None for v in fields.values()) else _rebuild(rows[0], fields)
+    if isinstance(rows[0], tuple):
+        parts = [_stack([r[j] for r in rows]) for j in range(len(rows[0]))]
+        return None if any(p is None for p in parts) else tuple(parts)
+    if any(r.shape[1:] != rows[0].shape[1:] for r in rows):
+        return None
+    return torch.cat(rows, dim=0)
+
+def _select_rows(args, kwargs, count, rows):
+    """Keep only `rows` of every tensor argument batched over `count` uploads"""
+    def pick(value):
+        if isinstance(value, torch.Tensor) and value.dim() > 0 and value.shape[0] == count:
+            return value[rows]
+        return value
+    return [pick(a) for a in args], {k: pick(v) for k, v in kwargs.items()}
+
+# --------------------------------------------------------------------
+# Encoder hooks
+# --------------------------------------------------------------------
+
+class MediaEncoder:
+    """Installs the encoder hooks and tracks how much encoder work was skipped"""
+
+    def __init__(self, model, processor, cache=None):
+        self.core = find_multimodal_core(model)
+        self.cache = cache
+        self.fingerprint = processor_fingerprint(processor)
+        self._local = threading.local()
+        self.rows_requested = 0
+        self.rows_encoded = 0
+
+        if self.core is not None:
+            for name in ENCODER_METHODS:
+                if hasattr(self.core, name):
+                    setattr(self.core, name, self._wrap(name, getattr(self.core, name)))
+
+    @property
+    def installed(self):
+        return self.core is not None
+
+    def cache_key(self, media_key):
+        return f"{media_key}:{self.fingerprint}"
+
+    # ---------------- processed inputs ----------------
+
+    @staticmethod
+    def _signature(messages):
+        """Messages with media references blanked out (the media key covers them)"""
+        return json.dumps([
+            {**m, "content": [
+                {k: v for k, v in item.items() if k in ("type", "text")}
+                for item in m["content"]
+            ]} for m in messages
+        ], sort_keys=True)
+
+    def cached_inputs(self, media_key, messages):
+        if self.cache is None:
+            return None
+        inputs = self.cache.get("inputs", f"{self.cache_key(media_key)}:{self._signature(messages)}")
+        # Shallow copy - BatchEncoding.to() replaces tensors in place
+        return BatchEncoding(dict(inputs)) if inputs is not None else None
+
+    def store_inputs(self, media_key, messages, inputs):
+        if self.cache is not None:
+            key = f"{self.cache_key(media_key)}:{self._signature(messages)}"
+            self.cache.put("inputs", key, BatchEncoding(dict(inputs)))
+
+    # ---------------- encoder outputs ----------------
+
+    @contextmanager
+    def batch(self, media_keys, index=None):
+        """Within this block the hooks know which upload each media row is
+
+        `media_keys` has one key per media row in the batch, `index` maps
+        every batch row to one of those media rows when uploads are shared.
+        """
+        self._local.keys = [self.cache_key(k) for k in media_keys]
+        self._local.index = torch.tensor(index, dtype=torch.long) if index is not None else None
+        try:
+            yield
+        finally:
+            self._local.keys = None
+            self._local.index = None
+
+    def _wrap(self, name, encode):
+        def wrapped(*args, **kwargs):
+            keys = getattr(self._local, "keys", None)
+            if keys is None:
+                return encode(*args, **kwargs)
+
+            output = self._encode_cached(name, encode, keys, args, kwargs)
+            index = self._local.index
+            self.rows_requested += len(index) if index is not None else len(keys)
+            return _expand(output, index) if index is not None else output
+        return wrapped
+
+    def _encode_cached(self, name, encode, keys, args, kwargs):
+        if self.cache is None:
+            self.rows_encoded += len(keys)
+            return encode(*args, **kwargs)
+
+        rows = [self.cache.get("features", f"{name}:{key}") for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            sub_args, sub_kwargs = _select_rows(args, kwargs, len(keys), missing)
+            computed = encode(*sub_args, **sub_kwargs)
+            self.rows_encoded += len(missing)
+            for j, i in enumerate(missing):
+                rows[i] = _row(computed, j)
+                self.cache.put("features", f"{name}:{keys[i]}", rows[i])
+
+        merged = _stack(rows)
+        if merged is None:
+            # Cached rows were padded differently (e.g. audio length) - recompute together
+            self.rows_encoded += len(keys) - len(missing)
+            return encode(*args, **kwargs)
+        return merged
+
+    def stats(self):
+        stats = {
+            "hooks_installed": self.installed,
+            "processor_fingerprint": self.fingerprint,
+            "rows_requested": self.rows_requested,
+            "rows_encoded": self.rows_encoded,
+            "encoder_rows_saved": self.rows_requested - self.rows_encoded,
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
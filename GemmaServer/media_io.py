@@ -0,0 +1,103 @@
+"""
+In-memory media decoding for the Gemma server
+
+Uploads are decoded straight from bytes: images to PIL, audio to a mono float32
+array at the processor's sampling rate. Nothing is written to disk, so the
+server also works on read-only or slow container filesystems.
+"""
+
+import io
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_SAMPLING_RATE = 16000
+
+class MediaDecodeError(ValueError):
+    """An upload that is not a readable image or audio clip - the client's fault, so a 422"""
+
+def unreadable_image(exc):
+    """PIL raises UnidentifiedImageError (an OSError) for non-images, OSError for truncated ones"""
+    return MediaDecodeError(f"Upload is not a readable image ({type(exc).__name__})")
+
+def decode_image(data):
+    """JPEG/PNG/... bytes -> RGB PIL image"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        return image.convert("RGB")
+    except OSError as exc:
+        raise unreadable_image(exc) from exc
+
+def decode_audio(data, sampling_rate=DEFAULT_SAMPLING_RATE):
+    """WAV/FLAC/OGG bytes -> mono float32 array at `sampling_rate`"""
+    import soundfile as sf
+
+    try:
+        audio, source_rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    except RuntimeError:  # libsndfile could not parse the container
+        # mp3/mp4 still need librosa's audioread backend, which only reads from a path
+        return _decode_audio_via_file(data, sampling_rate)
+
+    audio = audio.mean(axis=1)  # downmix to mono
+    if source_rate != sampling_rate:
+        import librosa
+        audio = librosa.resample(audio, orig_sr=source_rate, target_sr=sampling_rate)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+def _decode_audio_via_file(data, sampling_rate):
+    import audioread
+    import librosa
+
+    path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            path = tmp.name
+            tmp.write(data)
+        audio, _ = librosa.load(path, sr=sampling_rate, mono=True)
+        return audio.astype(np.float32)
+    except (audioread.DecodeError, RuntimeError, EOFError) as exc:  # no reader understood it either
+        raise MediaDecodeError(f"Upload is not a readable audio clip ({type(exc).__name__})") from exc
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def processor_sampling_rate(processor):
+    extractor = getattr(processor, "feature_extractor", None)
+    return getattr(extractor, "sampling_rate", DEFAULT_SAMPLING_RATE)
+
+def processor_audio_frame_rate(processor):
+    """Mel frames per second the audio encoder runs over (10 ms hop for Gemma 3n)"""
+    extractor = getattr(processor, "feature_extractor", None)
+    hop = getattr(extractor, "hop_length", None)
+    return processor_sampling_rate(processor) / hop if hop else 100
+
+def processor_image_size(processor):
+    """(width, height) the image processor resizes every image to, or None if it keeps aspect ratio"""
+    size = getattr(getattr(processor, "image_processor", None), "size", None) or {}
+    if size.get("height") and size.get("width"):
+        return size["width"], size["height"]
+    return None
+
+def decode_messages(messages, sampling_rate=DEFAULT_SAMPLING_RATE, audio_frontend=None, image_prestage=None):
+    """Replace raw upload bytes in chat messages with decoded PIL images / arrays
+
+    `audio_frontend` (AudioFrontEnd) trims silence and caps the length of each decoded clip;
+    `image_prestage` (ImagePreStage) replaces the plain image decode.
+    """
+    decoded = []
+    for message in messages:
+        content = []
+        for item in message["content"]:
+            if item["type"] == "image" and isinstance(item.get("image"), bytes):
+                decode = image_prestage.decode if image_prestage is not None else decode_image
+                item = {**item, "image": decode(item["image"])}
+            elif item["type"] == "audio" and isinstance(item.get("audio"), bytes):
+                audio = decode_audio(item["audio"], sampling_rate)
+                if audio_frontend is not None:
+                    audio = audio_frontend.process(audio)
+                item = {**item, "audio": audio}
+            content.append(item)
+        decoded.append({**message, "content": content})
+    return decoded
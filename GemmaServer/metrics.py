@@ -0,0 +1,137 @@
+"""
+Prometheus metrics for the Gemma server
+
+Everything here is an in-process counter/histogram update or a timestamp -
+no extra GPU syncs - so it can stay on in production. Scrape `GET /metrics`.
+
+Per-batch timings come from a logits processor: its first call marks the
+end of prefill (first token), later calls are decode steps.
+"""
+
+import time
+from contextvars import ContextVar
+
+import torch
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, Info, generate_latest
+from transformers import LogitsProcessor
+
+# Endpoint of the HTTP request being served, set by the metrics middleware
+current_endpoint = ContextVar("current_endpoint", default="other")
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class StepTimer(LogitsProcessor):
+    """Records when generate() produced its first token and counts decode steps"""
+
+    def __init__(self):
+        self.first_token_at = None
+        self.steps = 0
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.steps += 1
+        return scores
+
+class GenerationMetrics:
+    def __init__(self, endpoints):
+        self.endpoints = set(endpoints)  # paths that get their own label
+        self.registry = CollectorRegistry()
+        r = self.registry
+
+        self.queue_wait = Histogram("gemma_queue_wait_seconds", "Time from enqueue to batch start",
+                                    buckets=LATENCY_BUCKETS, registry=r)
+        self.prefill = Histogram("gemma_prefill_seconds", "generate() start to first token, per batch",
+                                 buckets=LATENCY_BUCKETS, registry=r)
+        self.decode = Histogram("gemma_decode_seconds", "First token to end of generate(), per batch",
+                                buckets=LATENCY_BUCKETS, registry=r)
+        self.ttft = Histogram("gemma_time_to_first_token_seconds", "Enqueue to first token, per request",
+                              ["endpoint"], buckets=LATENCY_BUCKETS, registry=r)
+        self.latency = Histogram("gemma_request_latency_seconds", "HTTP request latency",
+                                 ["endpoint"], buckets=LATENCY_BUCKETS, registry=r)
+        self.prompt_tokens = Counter("gemma_prompt_tokens", "Prompt tokens processed",
+                                     ["endpoint"], registry=r)
+        self.generated_tokens = Counter("gemma_generated_tokens", "Tokens generated",
+                                        ["endpoint"], registry=r)
+        self.generation_seconds = Counter("gemma_generation_seconds",
+                                          "Wall time of the batches each endpoint's requests ran in",
+                                          ["endpoint"], registry=r)
+        self.inflight = Gauge("gemma_inflight_requests", "Requests being handled",
+                              ["endpoint"], registry=r)
+        self.cancelled = Counter("gemma_cancelled_requests",
+                                 "Requests stopped by a deadline, client disconnect or abandoned caller",
+                                 ["endpoint", "reason", "stage"], registry=r)
+        self.tokens_saved = Counter("gemma_cancelled_tokens_saved",
+                                    "Token budget not decoded because the request was cancelled (upper bound)",
+                                    ["endpoint"], registry=r)
+
+        self.audio_seconds_in = Counter("gemma_audio_seconds_in", "Decoded audio before the audio front-end",
+                                        registry=r)
+        self.audio_seconds_removed = Counter("gemma_audio_seconds_removed",
+                                             "Audio the front-end kept from the encoder",
+                                             ["reason"], registry=r)
+
+        self.image_decode = Histogram("gemma_image_decode_seconds", "Image pre-stage decode time per image",
+                                      buckets=LATENCY_BUCKETS, registry=r)
+        self.image_bytes_saved = Counter("gemma_image_decoded_bytes_saved",
+                                         "RGB pixel bytes the image pre-stage never handed to the processor",
+                                         registry=r)
+
+        memory = Gauge("gemma_device_memory_allocated_bytes", "torch.cuda.memory_allocated()", registry=r)
+        memory.set_function(lambda: torch.cuda.memory_allocated() if torch.cuda.is_available() else 0)
+
+    def set_backend(self, info):
+        """Constant series so CPU and GPU replicas can be compared on one dashboard"""
+        backend = Info("gemma_backend", "Device and weight precision of this replica", registry=self.registry)
+        backend.info({k: str(v) for k, v in info.items()})
+
+    def watch_scheduler(self, scheduler):
+        depth = Gauge("gemma_queue_depth", "Requests waiting for the GPU", registry=self.registry)
+        depth.set_function(lambda: scheduler.queue_depth)
+        background = Gauge("gemma_background_queue_depth", "Batch-job requests waiting for idle GPU time",
+                           registry=self.registry)
+        background.set_function(lambda: scheduler.background_depth)
+
+    def label(self, path):
+        return path if path in self.endpoints else None
+
+    @staticmethod
+    def endpoint():
+        return current_endpoint.get()
+
+    # ---------------- scheduler side ----------------
+
+    @staticmethod
+    def step_timer():
+        return StepTimer()
+
+    def observe_batch(self, batch, started, timer, finished, prompt_tokens, generated_tokens):
+        """Called by the worker once per generate(); per-row token counts"""
+        first = timer.first_token_at or finished
+        self.prefill.observe(first - started)
+        self.decode.observe(finished - first)
+        for request, prompt, generated in zip(batch, prompt_tokens, generated_tokens):
+            endpoint = request.endpoint
+            self.queue_wait.observe(started - request.enqueued_at)
+            self.ttft.labels(endpoint).observe(first - request.enqueued_at)
+            self.prompt_tokens.labels(endpoint).inc(prompt)
+            self.generated_tokens.labels(endpoint).inc(generated)
+            self.generation_seconds.labels(endpoint).inc(finished - started)
+
+    def observe_audio(self, seconds_in, removed):
+        """One clip through the audio front-end; `removed` maps silence/pause/length to seconds"""
+        self.audio_seconds_in.inc(seconds_in)
+        for reason, seconds in removed.items():
+            self.audio_seconds_removed.labels(reason).inc(seconds)
+
+    def observe_image(self, seconds, saved):
+        self.image_decode.observe(seconds)
+        self.image_bytes_saved.inc(saved)
+
+    def observe_cancel(self, endpoint, reason, stage, saved):
+        """`stage` is "queued" (dropped before prefill) or "decoding" (stopped mid-generate)"""
+        self.cancelled.labels(endpoint, reason, stage).inc()
+        self.tokens_saved.labels(endpoint).inc(saved)
+
+    def export(self):
+        return generate_latest(self.registry)
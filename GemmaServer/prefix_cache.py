@@ -0,0 +1,213 @@
+"""
+Shared-prefix KV cache for repeated prompt prefixes
+
+Text prompts that open with the same long instruction (e.g. the emergency
+classifier's) are re-prefilled on every call. This module keeps the KV cache
+of registered or frequently seen token prefixes in an LRU pool bounded by
+bytes, and hands each matching request a private copy so only the new suffix
+has to be prefilled.
+
+Prefixes always stop before the first image/audio placeholder token, since
+those ids are identical for every upload and say nothing about the content.
+Media requests put the upload ahead of the prompt (see media_messages in
+gemma_server.py), so in practice only text-only requests get hits.
+"""
+
+import copy
+import threading
+from collections import Counter, OrderedDict, deque
+
+import torch
+from transformers import DynamicCache
+
+def cache_nbytes(cache):
+    """Device memory held by a KV cache"""
+    if hasattr(cache, "layers"):  # transformers >= 4.56
+        tensors = [t for layer in cache.layers for t in (getattr(layer, "keys", None), getattr(layer, "values", None))]
+    else:
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+def common_prefix_len(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+def media_token_ids(tokenizer):
+    """Placeholder ids the processor expands images/audio into"""
+    ids = set()
+    for name in ("image_token_id", "audio_token_id"):
+        value = getattr(tokenizer, name, None)
+        if isinstance(value, int):
+            ids.add(value)
+    for name in ("boi_token", "boa_token"):
+        token = getattr(tokenizer, name, None)
+        if isinstance(token, str):
+            ids.add(tokenizer.convert_tokens_to_ids(token))
+    return ids
+
+class PrefixEntry:
+    def __init__(self, key, source):
+        self.key = key          # tuple of token ids
+        self.source = source    # "registered" or "detected"
+        self.cache = None       # filled lazily on the worker thread
+        self.nbytes = 0
+        self.uses = 0
+        self.evicted = False
+
+class PrefixCache:
+    """LRU pool of prefix KV caches with hit/miss accounting"""
+
+    def __init__(self, model, tokenizer, max_bytes, min_tokens=32, min_seen=3,
+                 block_size=16, device="cuda"):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.min_seen = min_seen
+        self.block_size = block_size
+        self.device = device
+        self.media_ids = media_token_ids(tokenizer)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Frequent-prefix detection
+        self._recent = deque(maxlen=64)
+        self._seen = Counter()
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+        self.prefill_tokens_saved = 0
+
+    # ---------------- matching ----------------
+
+    def _shareable(self, ids):
+        """Leading ids that may be cached: stop at media, keep one token to prefill"""
+        limit = len(ids) - 1
+        for i, token in enumerate(ids[:limit]):
+            if token in self.media_ids:
+                return ids[:i]
+        return ids[:limit]
+
+    def lookup(self, input_ids):
+        """Longest cached prefix of a single-request input_ids tensor, or None"""
+        ids = self._shareable(tuple(input_ids[0].tolist()))
+
+        with self._lock:
+            best = None
+            for key, entry in self._entries.items():
+                if len(key) <= len(ids) and ids[:len(key)] == key:
+                    if best is None or len(key) > len(best.key):
+                        best = entry
+            if best is not None:
+                self._entries.move_to_end(best.key)
+                return best
+
+            self.misses += 1
+            self._observe(ids)
+            return None
+
+    def _observe(self, ids):
+        """Admit a block-aligned prefix once it has been shared `min_seen` times"""
+        for previous in self._recent:
+            n = common_prefix_len(previous, ids)
+            n -= n % self.block_size
+            if n >= self.min_tokens:
+                key = ids[:n]
+                self._seen[key] += 1
+                if self._seen[key] >= self.min_seen:
+                    self._admit(key, "detected")
+                    del self._seen[key]
+                break
+        self._recent.append(ids)
+
+        if len(self._seen) > 1024:  # forget one-off candidates
+            self._seen.clear()
+
+    def _admit(self, key, source):
+        if key not in self._entries:
+            self._entries[key] = PrefixEntry(key, source)
+            print(f"🧠 Prefix cache: admitted {source} prefix ({len(key)} tokens)")
+        return self._entries[key]
+
+    # ---------------- registration ----------------
+
+    def register_prompt(self, prompt):
+        """Register the token prefix a user prompt starting with `prompt` will have"""
+        def encode(text):
+            messages = [{"role": "user", "content": [{"type": "text", "text": text}]}]
+            ids = self.tokenizer.apply_chat_template(
+                messages, add_generation_prompt=True, tokenize=True,
+                return_dict=True, return_tensors="pt",
+            )["input_ids"]
+            return tuple(ids[0].tolist())
+
+        with_prompt, empty = encode(prompt), encode("")
+        tail = len(empty) - common_prefix_len(with_prompt, empty)
+        # Drop the turn-closing tail, plus the last prompt token which may
+        # merge differently once more text follows it
+        key = with_prompt[:len(with_prompt) - tail - 1]
+        if len(key) < 1:
+            raise ValueError("Prompt is too short to cache")
+
+        with self._lock:
+            self._admit(key, "registered")
+        return len(key)
+
+    # ---------------- worker side ----------------
+
+    def fetch(self, entry):
+        """Private copy of an entry's KV cache, prefilled on first use (worker thread)"""
+        if entry.cache is None:
+            ids = torch.tensor([entry.key], device=self.device)
+            with torch.inference_mode():
+                cache = self.model(input_ids=ids, past_key_values=DynamicCache(), use_cache=True).past_key_values
+            with self._lock:
+                self.fills += 1
+                if entry.evicted:
+                    return cache
+                entry.cache = cache
+                entry.nbytes = cache_nbytes(cache)
+                self._evict()
+        else:
+            with self._lock:
+                self.hits += 1
+                self.prefill_tokens_saved += len(entry.key)
+
+        entry.uses += 1
+        return copy.deepcopy(entry.cache)
+
+    def _evict(self):
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+            entry.evicted = True
+            entry.cache = None
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(entries),
+                "bytes": sum(e.nbytes for e in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "fills": self.fills,
+                "evictions": self.evictions,
+                "prefill_tokens_saved": self.prefill_tokens_saved,
+                "prefixes": [
+                    {"tokens": len(e.key), "source": e.source, "uses": e.uses, "bytes": e.nbytes}
+                    for e in entries
+                ],
+            }
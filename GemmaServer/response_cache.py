@@ -0,0 +1,69 @@
+"""
+Response cache for deterministic (greedy) generations
+
+Greedy /generate calls always produce the same text for the same prompt,
+token budget and model, so repeated prompts are answered from a TTL/LRU
+cache. Keys include the adapter's path and load time, so a checkpoint
+reloaded under the same name never serves the old one's replies. Identical requests that arrive while the first one is still being
+generated wait for that result instead of decoding it again. If the first
+caller is cancelled (deadline or disconnect), the next waiter decodes it.
+"""
+
+import asyncio
+import hashlib
+import json
+
+from cancellation import caused_by_cancel
+
+class ResponseCache:
+    def __init__(self, store, model_version, adapters=None):
+        self.store = store  # TTLCache
+        self.model_version = model_version
+        self.adapters = adapters  # AdapterRegistry, for the version of the adapter a reply came from
+        self._inflight = {}
+        self.coalesced = 0
+
+    def key(self, prompt, max_tokens, adapter=None, choices=None):
+        version = self.adapters.version(adapter) if self.adapters is not None else None
+        raw = json.dumps([self.model_version, adapter, version, max_tokens, choices, prompt])
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    async def get_or_generate(self, key, produce):
+        """Return (text, "HIT" | "MISS") - `produce` is an async callable"""
+        cached = self.store.get("response", key)
+        if cached is not None:
+            return cached, "HIT"
+
+        while key in self._inflight:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(self._inflight[key]), "HIT"
+            except Exception as exc:
+                if not caused_by_cancel(exc):
+                    raise
+                # The first caller gave up and its entry is gone - another waiter or this one takes over
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # no unretrieved warnings
+        self._inflight[key] = future
+        try:
+            text = await produce()
+            self.store.put("response", key, text)
+            future.set_result(text)
+            return text, "MISS"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            "model_version": self.model_version,
+            "inflight": len(self._inflight),
+            "coalesced": self.coalesced,
+            **self.store.stats(),
+        }
@@ -0,0 +1,68 @@
+"""
+Label scoring without generation
+
+The prompt (with its image/audio) is prefilled once; the KV cache is then
+repeated across the N candidate completions, which are scored together in
+one batched forward pass. Each candidate's log-probability is the sum over
+its tokens, and a softmax over those gives the normalized distribution.
+"""
+
+import math
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+def candidate_token_ids(tokenizer, candidates):
+    text_tokenizer = getattr(tokenizer, "tokenizer", tokenizer)  # processor -> tokenizer
+    ids = [text_tokenizer.encode(c, add_special_tokens=False) for c in candidates]
+    if any(not tokens for tokens in ids):
+        raise ValueError("Every candidate must contain at least one token")
+    return ids
+
+def _repeat_cache(cache, count):
+    """KV cache of one prompt -> the same prefix for `count` rows"""
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache.batch_repeat_interleave(count)
+        return cache
+    return tuple(tuple(t.repeat_interleave(count, dim=0) for t in layer) for layer in cache)
+
+def softmax(values):
+    top = max(values)
+    exps = [math.exp(v - top) for v in values]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+@torch.inference_mode()
+def score_candidates(model, inputs, candidate_ids, pad_token_id, adapter=None):
+    """log p(candidate | prompt) for each candidate - `inputs` is one encoded prompt on device
+
+    `adapter` is a PEFT adapter name (or "__base__") when the model carries LoRA adapters.
+    """
+    count = len(candidate_ids)
+    routing = lambda rows: {"adapter_names": [adapter] * rows} if adapter is not None else {}
+
+    prefill = model(**inputs, use_cache=True, **routing(1))
+    first = torch.log_softmax(prefill.logits[0, -1].float(), dim=-1)  # predicts candidate token 1
+
+    device = inputs["input_ids"].device
+    tokens = pad_sequence([torch.tensor(ids) for ids in candidate_ids], batch_first=True,
+                          padding_value=pad_token_id).to(device)
+    lengths = torch.tensor([len(ids) for ids in candidate_ids], device=device)
+    candidate_mask = (torch.arange(tokens.shape[1], device=device)[None, :] < lengths[:, None]).long()
+
+    prompt_mask = inputs["attention_mask"].repeat(count, 1)
+    logprobs = first[tokens[:, 0]]  # first token of every candidate, from the prefill
+    if tokens.shape[1] > 1:
+        # Right padding keeps real tokens at the same positions in every row
+        continuation = model(
+            input_ids=tokens,
+            attention_mask=torch.cat([prompt_mask, candidate_mask], dim=1),
+            past_key_values=_repeat_cache(prefill.past_key_values, count),
+            use_cache=True,
+            **routing(count),
+        )
+        step = torch.log_softmax(continuation.logits[:, :-1].float(), dim=-1)
+        picked = step.gather(-1, tokens[:, 1:, None]).squeeze(-1)
+        logprobs = logprobs + (picked * candidate_mask[:, 1:]).sum(dim=1)
+
+    return logprobs.tolist(), lengths.tolist()
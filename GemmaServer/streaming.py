@@ -0,0 +1,71 @@
+"""
+Token streaming helpers for the Gemma server
+
+AsyncTextStreamer is a TextIteratorStreamer-style streamer that hands decoded
+text from the generation thread to an asyncio queue. event_stream() turns those
+chunks into Server-Sent Events or NDJSON lines and finishes with a summary event
+carrying the full reply and the time-to-first-token.
+"""
+
+import asyncio
+import json
+import time
+
+from transformers import TextStreamer
+
+STREAM_MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+class AsyncTextStreamer(TextStreamer):
+    """Streamer that can be iterated with `async for` on the event loop"""
+
+    def __init__(self, tokenizer, loop):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def on_finalized_text(self, text, stream_end=False):
+        # Called from the generation thread
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+        if stream_end:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        text = await self.queue.get()
+        if text is None:
+            raise StopAsyncIteration
+        return text
+
+def format_event(fmt, event, data):
+    """Encode one event as an SSE frame or an NDJSON line"""
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+async def event_stream(chunks, fmt, started):
+    """Relay text chunks and close with a `done` event (or `error`)"""
+    first_token_at = None
+    parts = []
+    try:
+        async for chunk in chunks:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(chunk)
+            yield format_event(fmt, "token", {"text": chunk})
+
+        finished = time.perf_counter()
+        yield format_event(fmt, "done", {
+            "text": "".join(parts).strip(),
+            "ttft_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+            "total_ms": round((finished - started) * 1000, 1),
+            "chunks": len(parts),
+        })
+
+    except Exception as exc:
+        yield format_event(fmt, "error", {"error": str(exc)})
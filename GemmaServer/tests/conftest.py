@@ -0,0 +1,61 @@
+"""
+Shared fixtures - the scheduler and helpers run against the CPU stub model,
+endpoint tests against gemma_server.py started on it
+
+    cd GemmaServer && python -m pytest tests
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+# The server modules are flat files in GemmaServer/, imported by name
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from stub_model import get_stub_model_and_processor  # noqa: E402
+
+@pytest.fixture(scope="session")
+def stub():
+    """(model, tokenizer) pair shared by every test; nothing may modify the model's weights"""
+    return get_stub_model_and_processor()
+
+def ready(url):
+    try:
+        return httpx.get(f"{url}/readyz", timeout=2).status_code == 200
+    except httpx.TransportError:
+        return False
+
+@pytest.fixture(scope="session")
+def cpu_server(tmp_path_factory):
+    """Base URL of gemma_server.py on the CPU backend (stub model, fp32 weights)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = {
+        **os.environ,
+        "GEMMA_STUB_MODEL": "1",
+        "GEMMA_DEVICE": "cpu",
+        "GEMMA_CPU_DTYPE": "fp32",
+        "GEMMA_JOBS_DIR": str(tmp_path_factory.mktemp("jobs")),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "gemma_server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 120
+        while not ready(url):
+            if process.poll() is not None or time.time() > deadline:
+                raise RuntimeError("Stub server did not become ready")
+            time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(10)
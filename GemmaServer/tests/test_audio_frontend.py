@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from audio_frontend import AudioFrontEnd
+
+SR = 16000
+
+def tone(seconds, level=0.3):
+    t = np.arange(int(SR * seconds)) / SR
+    return (level * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+def silence(seconds):
+    return np.random.default_rng(0).normal(0, 1e-4, int(SR * seconds)).astype(np.float32)
+
+def test_edge_silence_is_trimmed_with_margin():
+    frontend = AudioFrontEnd(SR, pad_ms=150)
+    out = frontend.process(np.concatenate([silence(2), tone(1), silence(3)]))
+
+    assert 1.0 <= len(out) / SR <= 1.0 + 2 * 0.15 + 0.05
+    stats = frontend.stats()
+    assert stats["trimmed_clips"] == 1
+    assert stats["seconds_removed"]["silence"] == pytest.approx(6 - len(out) / SR, abs=0.01)
+
+def test_long_pause_is_shortened():
+    frontend = AudioFrontEnd(SR, pad_ms=0, max_pause_ms=500)
+    out = frontend.process(np.concatenate([tone(1), silence(4), tone(1)]))
+
+    assert len(out) / SR == pytest.approx(2.5, abs=0.05)
+    assert frontend.stats()["seconds_removed"]["pause"] == pytest.approx(3.5, abs=0.05)
+
+def test_all_silence_is_left_alone():
+    clip = silence(2)
+    assert len(AudioFrontEnd(SR).process(clip)) == len(clip)
+
+def test_cap_keeps_head_or_densest_window():
+    clip = np.concatenate([tone(4, level=0.02), tone(4)])  # quiet mumbling, then loud speech
+    head = AudioFrontEnd(SR, trim=False, max_seconds=4, long_audio="head").process(clip)
+    densest = AudioFrontEnd(SR, trim=False, max_seconds=4, long_audio="densest", top_db=20).process(clip)
+
+    assert len(head) == len(densest) == 4 * SR
+    assert np.abs(head).max() < 0.05
+    assert np.abs(densest).max() > 0.25
+    assert len(AudioFrontEnd(SR, trim=False, max_seconds=4).process(clip, cap=False)) == len(clip)
@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from batch_jobs import JobManager, in_batch_job, read_results
+
+def describe_error(exc):
+    return {"error": str(exc), "status": 500}
+
+def manager_with(directory, calls):
+    async def echo(body):
+        assert in_batch_job.get()  # requests a job makes are background work
+        calls.append(body["n"])
+        await asyncio.sleep(0)
+        if body["n"] == 3:
+            raise RuntimeError("bad line")
+        return {"n": body["n"]}
+    return JobManager({"/echo": echo}, describe_error, directory=str(directory), concurrency=4)
+
+def job_file(count):
+    return "".join(json.dumps({"request_id": f"r{n}", "endpoint": "/echo", "json": {"n": n}}) + "\n"
+                   for n in range(count)).encode()
+
+async def until_finished(manager, job_id):
+    for _ in range(500):
+        if manager.jobs[job_id].state["status"] not in ("queued", "running"):
+            return manager.jobs[job_id]
+        await asyncio.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+def test_job_results_come_back_in_input_order(tmp_path):
+    calls = []
+
+    async def run():
+        manager = manager_with(tmp_path, calls)
+        manager.start()
+        try:
+            job = await manager.submit(job_file(6), name="echo")
+            return await until_finished(manager, job.id)
+        finally:
+            await manager.stop()
+
+    job = asyncio.run(run())
+    assert job.state["status"] == "completed"
+    assert (job.state["succeeded"], job.state["failed"]) == (5, 1)
+    records = read_results(job.path("results.jsonl"))
+    assert [r["index"] for r in records] == list(range(6))
+    assert records[3]["status"] == 500 and records[2]["response"] == {"n": 2}
+
+def test_unfinished_job_resumes_from_checkpoint(tmp_path):
+    # A job cut off mid-run: three lines done, the fourth half-written when the process died
+    job_dir = tmp_path / "abc123"
+    job_dir.mkdir()
+    (job_dir / "input.jsonl").write_bytes(job_file(6))
+    done = [{"request_id": f"r{n}", "index": n, "status": 200, "response": {"n": n}} for n in (0, 2, 4)]
+    (job_dir / "results.jsonl").write_text("".join(json.dumps(r) + "\n" for r in done) + '{"request_id": "r5", "ind')
+    (job_dir / "state.json").write_text(json.dumps({
+        "id": "abc123", "name": None, "status": "running", "total": 6, "succeeded": 3, "failed": 0,
+        "created_at": 1.0, "started_at": 1.0, "finished_at": None, "error": None,
+    }))
+    calls = []
+
+    async def run():
+        manager = manager_with(tmp_path, calls)
+        manager.start()
+        try:
+            return await until_finished(manager, "abc123")
+        finally:
+            await manager.stop()
+
+    job = asyncio.run(run())
+    assert sorted(calls) == [1, 3, 5]  # only the lines missing from the checkpoint ran
+    assert job.state["status"] == "completed"
+    assert (job.state["succeeded"], job.state["failed"]) == (5, 1)
+    assert [r["index"] for r in read_results(job.path("results.jsonl"))] == list(range(6))
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+import torch
+from peft import LoraConfig, get_peft_model
+from transformers import StoppingCriteriaList
+
+from adapters import AdapterRegistry, UnknownAdapterError
+from batch_scheduler import BatchScheduler, TokenBudgetCriteria, generation_params, pad_batch
+from prefix_cache import PrefixCache
+from stub_model import get_stub_model_and_processor
+
+def chat(text):
+    return [{"role": "user", "content": [{"type": "text", "text": text}]}]
+
+def save_lora(path):
+    """Write a LoRA checkpoint for the stub architecture (its own model: PEFT edits modules in place)"""
+    model, _ = get_stub_model_and_processor(seed=1)
+    get_peft_model(model, LoraConfig(r=4, target_modules=["q_proj", "v_proj"])).save_pretrained(path)
+
+async def wait_until(condition, timeout_s=10):
+    for _ in range(int(timeout_s / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+def test_unloading_adapter_with_queued_requests_keeps_worker_alive(tmp_path):
+    save_lora(tmp_path / "lora")
+    model, tokenizer = get_stub_model_and_processor()
+    adapters = AdapterRegistry(model)
+    scheduler = BatchScheduler(model, tokenizer, device="cpu", adapters=adapters, max_wait_ms=0)
+
+    async def run():
+        scheduler.start()
+        try:
+            await scheduler.run_on_worker(lambda: adapters.load("demo", str(tmp_path / "lora")))
+
+            # Hold the worker so the adapter requests stay queued, then unload ahead of them
+            release = threading.Event()
+            blocker = asyncio.ensure_future(scheduler.run_on_worker(release.wait))
+            queued = [asyncio.ensure_future(scheduler.submit(chat(f"hi {i}"), max_tokens=4, adapter="demo"))
+                      for i in range(2)]
+            await wait_until(lambda: scheduler.queue_depth == 2)
+            unload = asyncio.ensure_future(scheduler.run_on_worker(lambda: adapters.unload("demo")))
+            await wait_until(lambda: scheduler.queue_depth == 3)
+            release.set()
+
+            await asyncio.wait_for(asyncio.gather(blocker, unload), 10)
+            for future in queued:
+                with pytest.raises(UnknownAdapterError):
+                    await asyncio.wait_for(future, 10)
+
+            # The worker survived the all-dropped batch and still serves requests
+            assert scheduler.alive
+            reply = await asyncio.wait_for(scheduler.submit(chat("still there?"), max_tokens=4), 10)
+            assert isinstance(reply, str)
+        finally:
+            scheduler.stop()
+
+    asyncio.run(run())
+
+def test_batch_stops_once_every_row_has_its_own_budget(stub):
+    model, tokenizer = stub
+    scheduler = BatchScheduler(model, tokenizer, device="cpu")
+    inputs = pad_batch([scheduler.encode(chat("short")), scheduler.encode(chat("a longer prompt"))],
+                       tokenizer.eos_token_id)
+    prompt_len = inputs["input_ids"].shape[-1]
+    budgets = TokenBudgetCriteria([3, 5], prompt_len)
+
+    params = generation_params(200, False, tokenizer.eos_token_id)
+    with torch.inference_mode():
+        outputs = model.generate(**inputs, **params, stopping_criteria=StoppingCriteriaList([budgets]))
+
+    # max_new_tokens is 200, but the batch ends when its longest budget is spent
+    assert outputs.shape[-1] - prompt_len <= 5
+
+def test_prefix_hits_still_batch_together(stub):
+    model, tokenizer = stub
+    prefix_cache = PrefixCache(model, tokenizer, max_bytes=1 << 24, device="cpu")
+    instruction = "Classify the crowd density in this report as Low, Medium or High. Report: "
+    prefix_cache.register_prompt(instruction)
+    scheduler = BatchScheduler(model, tokenizer, device="cpu", prefix_cache=prefix_cache, max_wait_ms=200)
+
+    async def run():
+        scheduler.start()
+        try:
+            # Queued together: one batch, every row prefilled in full
+            await asyncio.gather(*(scheduler.submit(chat(instruction + f"gate {i}"), max_tokens=4)
+                                   for i in range(4)))
+            await wait_until(lambda: scheduler.stats()["recent_batch_sizes"])  # recorded after replies resolve
+            assert scheduler.stats()["recent_batch_sizes"] == [4]
+            assert scheduler.stats()["prefix_skipped_for_batching"] == 4
+
+            # Alone: the cached prefix KV is used
+            await scheduler.submit(chat(instruction + "gate 9"), max_tokens=4)
+            assert prefix_cache.stats()["prefixes"][0]["uses"] == 1
+        finally:
+            scheduler.stop()
+
+    asyncio.run(run())
+
+def test_zero_token_budget_is_refused_before_it_reaches_a_batch(stub):
+    model, tokenizer = stub
+    scheduler = BatchScheduler(model, tokenizer, device="cpu")
+
+    async def run():
+        scheduler.start()
+        try:
+            with pytest.raises(ValueError):
+                await scheduler.submit(chat("hi"), max_tokens=0)
+            assert scheduler.queue_depth == 0
+        finally:
+            scheduler.stop()
+
+    asyncio.run(run())
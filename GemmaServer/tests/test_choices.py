@@ -0,0 +1,25 @@
+import torch
+
+from choices import ChoiceConstraint, ChoiceLogitsProcessor
+
+def test_prefix_overlapping_choices_can_continue(stub):
+    _, tokenizer = stub
+    eos = tokenizer.eos_token_id
+    one, zero = (tokenizer.encode(c, add_special_tokens=False)[0] for c in ("1", "0"))
+    constraint = ChoiceConstraint(tokenizer, ["1", "10", "2"])
+
+    # "1" is a complete choice and the start of "10": both EOS and "0" are allowed
+    assert sorted(constraint.allowed([one], eos)) == sorted([eos, zero])
+    assert constraint.allowed([one, zero], eos) == [eos]
+    assert constraint.max_tokens == 2
+
+def test_processor_lets_longer_choice_win(stub):
+    _, tokenizer = stub
+    eos = tokenizer.eos_token_id
+    one, zero = (tokenizer.encode(c, add_special_tokens=False)[0] for c in ("1", "0"))
+    processor = ChoiceLogitsProcessor([ChoiceConstraint(tokenizer, ["1", "10"])], prompt_len=1, eos_token_id=eos)
+
+    scores = torch.zeros(1, len(tokenizer))
+    scores[0, zero] = 5.0  # the model prefers to continue
+    masked = processor(torch.tensor([[eos, one]]), scores)
+    assert int(masked[0].argmax()) == zero
@@ -0,0 +1,68 @@
+import io
+import json
+
+import httpx
+import numpy as np
+import soundfile as sf
+from PIL import Image
+
+def jpeg():
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (200, 40, 40)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def wav(seconds=1, rate=16000):
+    buffer = io.BytesIO()
+    t = np.arange(int(seconds * rate)) / rate
+    sf.write(buffer, 0.1 * np.sin(2 * np.pi * 440 * t), rate, format="WAV")
+    return buffer.getvalue()
+
+def test_backend_is_cpu_fp32(cpu_server):
+    backend = httpx.get(f"{cpu_server}/capabilities").json()["backend"]
+    assert backend["device"] == "cpu" and backend["precision"] == "fp32"
+
+def test_generate_is_greedy_and_repeatable(cpu_server):
+    body = {"prompt": "Explain crowd safety", "max_tokens": 8}
+    first = httpx.post(f"{cpu_server}/generate", json=body, timeout=60)
+    second = httpx.post(f"{cpu_server}/generate", json=body, timeout=60)
+    assert first.status_code == 200
+    assert first.json() == second.json()  # seeded weights, greedy decode
+
+def test_generate_refuses_a_non_positive_token_budget(cpu_server):
+    for endpoint in ("/generate", "/generate/stream"):
+        for max_tokens in (0, -5):
+            reply = httpx.post(f"{cpu_server}{endpoint}", json={"prompt": "Hi", "max_tokens": max_tokens}, timeout=60)
+            assert reply.status_code == 422
+
+def test_generate_with_choices_answers_one_of_them(cpu_server):
+    body = {"prompt": "Is this an emergency?", "max_tokens": 4, "choices": ["Yes", "No"]}
+    reply = httpx.post(f"{cpu_server}/generate", json=body, timeout=60)
+    assert reply.status_code == 200
+    assert reply.json()["text"] in ("Yes", "No")
+
+def test_generate_stream_ends_with_done(cpu_server):
+    reply = httpx.post(f"{cpu_server}/generate/stream", json={"prompt": "Hi", "max_tokens": 4}, timeout=60)
+    assert reply.status_code == 200
+    events = reply.text.strip().split("\n\n")
+    assert events[-1].startswith("event: done")
+    done = json.loads(events[-1].split("data: ", 1)[1])
+    assert "ttft_ms" in done
+
+def test_ask_image_answers_every_prompt(cpu_server):
+    reply = httpx.post(f"{cpu_server}/ask_image", data={"prompts": ["Density?", "Motion?"]},
+                       files={"image": ("gate.jpg", jpeg(), "image/jpeg")}, timeout=60)
+    assert reply.status_code == 200
+    assert len(reply.json()["texts"]) == 2
+
+def test_ask_audio_raw_body(cpu_server):
+    reply = httpx.post(f"{cpu_server}/ask_audio", params={"prompt": "Transcribe"}, content=wav(),
+                       headers={"content-type": "audio/wav"}, timeout=60)
+    assert reply.status_code == 200
+    assert reply.json()["upload"]["form"] == "raw"
+
+def test_score_ranks_candidates(cpu_server):
+    reply = httpx.post(f"{cpu_server}/score", data={"prompt": "Is it?", "candidates": ["Yes", "No"]}, timeout=60)
+    assert reply.status_code == 200
+    scores = reply.json()["scores"]
+    assert reply.json()["best"] == max(scores, key=lambda s: s["logprob"])["candidate"]
+    assert abs(sum(s["probability"] for s in scores) - 1) < 1e-3
@@ -0,0 +1,31 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+
+from batch_scheduler import QueueFullError
+from health import SelfTest
+
+def test_queue_full_self_test_is_not_a_failure():
+    async def rejected():
+        raise HTTPException(429, "Inference queue full") from QueueFullError(64, 3)
+
+    scheduler = SimpleNamespace(last_success_at=None)
+    self_test = SelfTest(rejected, scheduler)
+    self_test.result = {"ok": True, "source": "self_test", "checked_at": time.time()}
+
+    asyncio.run(self_test.check())
+    assert self_test.healthy
+
+def test_traffic_after_failed_check_restores_health():
+    async def broken():
+        raise RuntimeError("CUDA error")
+
+    scheduler = SimpleNamespace(last_success_at=None)
+    self_test = SelfTest(broken, scheduler)
+    asyncio.run(self_test.check())
+    assert not self_test.healthy
+
+    scheduler.last_success_at = time.time() + 1
+    assert self_test.healthy
@@ -0,0 +1,42 @@
+import numpy as np
+
+from long_audio import plan_windows, stitch
+
+SR = 16000
+
+def speech_with_pauses(segments=22, speech_s=2.2, pause_s=0.8):
+    """Tone bursts separated by near-silent pauses (one in every 3 s search range)"""
+    rng = np.random.default_rng(0)
+    parts = []
+    for i in range(segments):
+        t = np.arange(int(SR * speech_s)) / SR
+        parts.append(0.3 * np.sin(2 * np.pi * (200 + 20 * i) * t))
+        parts.append(rng.normal(0, 1e-3, int(SR * pause_s)))
+    return np.concatenate(parts).astype(np.float32)
+
+def test_short_clip_is_one_window():
+    audio = np.zeros(SR * 20, dtype=np.float32)
+    assert plan_windows(audio, SR) == [(0, len(audio))]
+
+def test_windows_cover_clip_and_cut_in_pauses():
+    audio = speech_with_pauses()
+    windows = plan_windows(audio, SR, window_s=25, overlap_s=2, search_s=3)
+
+    assert windows[0][0] == 0 and windows[-1][1] == len(audio)
+    for (start, end), (next_start, _) in zip(windows, windows[1:]):
+        assert end - start <= 25 * SR
+        assert end - next_start == 2 * SR  # overlap
+        assert np.abs(audio[end - 400:end]).max() < 0.01  # cut where it is quiet
+    assert windows[-1][1] - windows[-1][0] <= 28 * SR  # the last one may run `search_s` longer
+
+def test_stitch_drops_words_repeated_in_overlap():
+    texts = [
+        "the quick brown fox jumps over the",
+        "fox jumps over the lazy dog and",
+        "Lazy dog, and then it ran away.",
+    ]
+    assert stitch(texts) == "the quick brown fox jumps over the lazy dog and then it ran away."
+
+def test_stitch_joins_windows_without_shared_words():
+    assert stitch(["Hello there.", "General Kenobi."]) == "Hello there. General Kenobi."
+    assert stitch(["", "only the second"]) == "only the second"
@@ -0,0 +1,57 @@
+import torch
+from torch import nn
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+from media_encoder import MediaEncoder
+from ttl_cache import TTLCache
+
+class FakeCore(nn.Module):
+    """Encoder surface of transformers 5's Gemma3nModel: features come back as a ModelOutput"""
+
+    def __init__(self):
+        super().__init__()
+        self.rows_encoded = 0
+
+    def get_image_features(self, pixel_values, **kwargs):
+        self.rows_encoded += pixel_values.shape[0]
+        return BaseModelOutputWithPooling(last_hidden_state=pixel_values, pooler_output=pixel_values * 10)
+
+class FakeModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.model = FakeCore()
+
+def pixels(*values):
+    """One 2x3 'image' per value, filled with that value"""
+    return torch.stack([torch.full((2, 3), float(v)) for v in values])
+
+def test_cached_rows_are_rebuilt_as_model_output():
+    model = FakeModel()
+    encoder = MediaEncoder(model, processor=None, cache=TTLCache(max_bytes=1 << 20, ttl_seconds=60))
+    core = model.model
+
+    with encoder.batch(["a", "b"]):
+        first = core.get_image_features(pixels(1, 2), return_dict=True)
+    with encoder.batch(["b", "c"]):
+        second = core.get_image_features(pixels(2, 3), return_dict=True)
+
+    assert isinstance(second, BaseModelOutputWithPooling)
+    assert torch.equal(first.pooler_output, pixels(10, 20))
+    assert torch.equal(second.pooler_output, pixels(20, 30))
+    assert torch.equal(second.last_hidden_state, pixels(2, 3))
+    assert core.rows_encoded == 3  # "b" came from the cache
+    assert encoder.stats()["encoder_rows_saved"] == 1
+
+def test_shared_upload_is_encoded_once_for_every_row():
+    model = FakeModel()
+    encoder = MediaEncoder(model, processor=None)
+    core = model.model
+
+    # Three prompts over one upload: the batch carries its pixels once
+    with encoder.batch(["a"], index=[0, 0, 0]):
+        output = core.get_image_features(pixels(4), return_dict=True)
+
+    assert core.rows_encoded == 1
+    assert isinstance(output, BaseModelOutputWithPooling)
+    assert torch.equal(output.pooler_output, pixels(40, 40, 40))
+    assert encoder.stats()["encoder_rows_saved"] == 2
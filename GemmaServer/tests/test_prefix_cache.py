@@ -0,0 +1,35 @@
+import asyncio
+
+from batch_scheduler import BatchScheduler
+from prefix_cache import PrefixCache
+
+INSTRUCTION = ("You are an emergency triage assistant. Classify the report below as one of "
+               "medical_help, small_fire, lost_item or crowd_panic. Report: ")
+
+def chat(text):
+    return [{"role": "user", "content": [{"type": "text", "text": text}]}]
+
+def test_prefix_hit_output_equals_cold_run(stub):
+    model, tokenizer = stub
+    prefix_cache = PrefixCache(model, tokenizer, max_bytes=1 << 24, device="cpu")
+    prefix_cache.register_prompt(INSTRUCTION)
+    cached = BatchScheduler(model, tokenizer, device="cpu", prefix_cache=prefix_cache)
+    cold = BatchScheduler(model, tokenizer, device="cpu")
+
+    async def run():
+        cached.start()
+        cold.start()
+        try:
+            for report in ("smoke near gate 4", "my phone is missing", "hello"):
+                messages = chat(INSTRUCTION + report)
+                with_prefix = await cached.submit(messages, max_tokens=16, use_sampling=False)
+                without = await cold.submit(messages, max_tokens=16, use_sampling=False)
+                assert with_prefix == without
+        finally:
+            cached.stop()
+            cold.stop()
+
+    asyncio.run(run())
+    stats = prefix_cache.stats()
+    assert stats["fills"] == 1 and stats["hits"] == 2  # first use prefills the prefix, then it is reused
+    assert stats["prefill_tokens_saved"] > 0
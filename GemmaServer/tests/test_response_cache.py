@@ -0,0 +1,16 @@
+from adapters import AdapterRegistry
+from response_cache import ResponseCache
+from ttl_cache import TTLCache
+
+def test_reloaded_adapter_gets_new_cache_keys():
+    adapters = AdapterRegistry(model=None)
+    cache = ResponseCache(TTLCache(max_bytes=1 << 20, ttl_seconds=60), "stub", adapters=adapters)
+
+    adapters.adapters["triage"] = {"path": "/ckpt/v1", "loaded_at": 1000.0, "load_seconds": 1.0}
+    before = cache.key("Is this urgent?", 16, adapter="triage")
+    assert cache.key("Is this urgent?", 16, adapter="triage") == before
+
+    # Unloaded, then a different checkpoint loaded under the same name
+    adapters.adapters["triage"] = {"path": "/ckpt/v2", "loaded_at": 2000.0, "load_seconds": 1.0}
+    assert cache.key("Is this urgent?", 16, adapter="triage") != before
+    assert cache.key("Is this urgent?", 16) == cache.key("Is this urgent?", 16, adapter=None)
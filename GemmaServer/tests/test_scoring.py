@@ -0,0 +1,28 @@
+import math
+
+import torch
+
+from batch_scheduler import BatchScheduler
+from scoring import candidate_token_ids, score_candidates
+
+def chat(text):
+    return [{"role": "user", "content": [{"type": "text", "text": text}]}]
+
+def manual_logprob(model, prompt_ids, candidate):
+    """Sum of log p(token | everything before it) over a full forward pass"""
+    ids = torch.tensor([prompt_ids + candidate])
+    with torch.inference_mode():
+        logprobs = torch.log_softmax(model(input_ids=ids).logits[0].float(), dim=-1)
+    return sum(logprobs[len(prompt_ids) + i - 1, token].item() for i, token in enumerate(candidate))
+
+def test_scores_match_manual_logprobs(stub):
+    model, tokenizer = stub
+    inputs = BatchScheduler(model, tokenizer, device="cpu").encode(chat("Crowd density?"))
+    candidates = candidate_token_ids(tokenizer, ["Low", "Medium", "High", "L"])
+
+    scores, lengths = score_candidates(model, inputs, candidates, tokenizer.pad_token_id)
+
+    prompt_ids = inputs["input_ids"][0].tolist()
+    for score, length, candidate in zip(scores, lengths, candidates):
+        assert length == len(candidate)
+        assert math.isclose(score, manual_logprob(model, prompt_ids, candidate), abs_tol=1e-4)
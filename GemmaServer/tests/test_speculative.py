@@ -0,0 +1,29 @@
+import asyncio
+
+from batch_scheduler import BatchScheduler
+from speculative import SpeculativeDecoder
+from stub_model import get_stub_model_and_processor
+
+def chat(text):
+    return [{"role": "user", "content": [{"type": "text", "text": text}]}]
+
+def test_speculative_output_equals_greedy():
+    model, tokenizer = get_stub_model_and_processor()
+    draft, _ = get_stub_model_and_processor(seed=1)  # a different model: some proposals get rejected
+    scheduler = BatchScheduler(model, tokenizer, device="cpu",
+                               speculative=SpeculativeDecoder(model, draft, num_tokens=4))
+
+    async def run():
+        scheduler.start()
+        try:
+            for prompt in ("hello", "Classify this report", "Hi there"):
+                greedy = await scheduler.submit(chat(prompt), max_tokens=24, use_sampling=False)
+                stats = {}
+                assisted = await scheduler.submit(chat(prompt), max_tokens=24, speculative=stats)
+                assert stats["enabled"]
+                assert assisted == greedy
+            assert scheduler.speculative.stats()["draft_tokens_proposed"] > 0
+        finally:
+            scheduler.stop()
+
+    asyncio.run(run())
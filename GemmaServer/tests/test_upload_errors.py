@@ -0,0 +1,31 @@
+import httpx
+
+from test_cpu_endpoints import jpeg
+
+NOT_AN_IMAGE = b"this is not a jpeg"
+NOT_AUDIO = b"RIFF\x00\x00\x00\x00WAVEjunk"
+
+def test_unreadable_image_is_422(cpu_server):
+    reply = httpx.post(f"{cpu_server}/ask_image", data={"prompt": "Density?"},
+                       files={"image": ("gate.jpg", NOT_AN_IMAGE, "image/jpeg")}, timeout=60)
+    assert reply.status_code == 422
+    assert "not a readable image" in reply.json()["detail"]
+
+def test_unreadable_audio_is_422(cpu_server):
+    reply = httpx.post(f"{cpu_server}/ask_audio", params={"prompt": "Transcribe"}, content=NOT_AUDIO,
+                       headers={"content-type": "audio/wav"}, timeout=60)
+    assert reply.status_code == 422
+    assert "not a readable audio clip" in reply.json()["detail"]
+
+def test_unreadable_audio_in_long_audio_mode_is_422(cpu_server):
+    reply = httpx.post(f"{cpu_server}/ask_audio", params={"prompt": "Transcribe", "long_audio": "true"},
+                       content=NOT_AUDIO, headers={"content-type": "audio/wav"}, timeout=60)
+    assert reply.status_code == 422
+
+def test_unreadable_image_only_fails_its_own_batch_item(cpu_server):
+    files = [("images", ("good.jpg", jpeg(), "image/jpeg")), ("images", ("bad.jpg", NOT_AN_IMAGE, "image/jpeg"))]
+    reply = httpx.post(f"{cpu_server}/ask_image_batch", data={"prompt": "Density?"}, files=files, timeout=60)
+    assert reply.status_code == 200
+    good, bad = reply.json()["results"]
+    assert "text" in good
+    assert bad["status"] == 422
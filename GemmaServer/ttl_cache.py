@@ -0,0 +1,88 @@
+"""
+Byte-bounded LRU cache with a TTL
+
+Shared by the media cache (processed inputs, encoder outputs) and the greedy
+response cache. Entries are namespaced by `kind` so hits and misses can be
+reported per kind.
+"""
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+
+import torch
+
+def nbytes(value):
+    """Approximate memory held by a cached value"""
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, Mapping):
+        return sum(nbytes(v) for v in value.values())
+    return 0
+
+class TTLCache:
+    """LRU with a byte budget and a TTL"""
+
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (kind, key) -> (value, nbytes, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.evictions = 0
+
+    def get(self, kind, key):
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None and time.monotonic() - entry[2] > self.ttl_seconds:
+                self._drop((kind, key))
+                entry = None
+            if entry is None:
+                self.misses[kind] += 1
+                return None
+            self._entries.move_to_end((kind, key))
+            self.hits[kind] += 1
+            return entry[0]
+
+    def put(self, kind, key, value):
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (kind, key) in self._entries:
+                self._drop((kind, key))
+            self._entries[(kind, key)] = (value, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, full_key):
+        _, size, _ = self._entries.pop(full_key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            kinds = sorted(set(self.hits) | set(self.misses))
+            ratio = {
+                kind: round(self.hits[kind] / (self.hits[kind] + self.misses[kind]), 3)
+                if self.hits[kind] + self.misses[kind] else 0.0
+                for kind in kinds
+            }
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": {kind: self.hits[kind] for kind in kinds},
+                "misses": {kind: self.misses[kind] for kind in kinds},
+                "hit_ratio": ratio,
+                "evictions": self.evictions,
+            }
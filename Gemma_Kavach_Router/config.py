@@ -0,0 +1,49 @@
+# config.py - Runtime settings for the Gemma router (override with env vars)
+import os
+
+# --------------------------------------------------------------------
+# Replicas
+# --------------------------------------------------------------------
+
+# Comma-separated GemmaServer base URLs, e.g. http://gpu-a:8000,http://gpu-b:8000
+REPLICAS = [url.strip().rstrip("/") for url in os.getenv("GEMMA_REPLICAS", "").split(",") if url.strip()]
+
+# How often every replica's /readyz is polled for readiness and queue depth
+POLL_INTERVAL_S = float(os.getenv("ROUTER_POLL_INTERVAL_S", "1"))
+POLL_TIMEOUT_S = float(os.getenv("ROUTER_POLL_TIMEOUT_S", "2"))
+
+# --------------------------------------------------------------------
+# Ejection
+# --------------------------------------------------------------------
+
+# Consecutive failed polls/requests before a replica is taken out of rotation
+EJECT_AFTER_FAILURES = int(os.getenv("ROUTER_EJECT_AFTER_FAILURES", "3"))
+
+# How long an ejected replica sits out before a passing poll can bring it back
+EJECT_COOLDOWN_S = float(os.getenv("ROUTER_EJECT_COOLDOWN_S", "30"))
+
+# --------------------------------------------------------------------
+# Prefix affinity
+# --------------------------------------------------------------------
+
+# Prompt characters that identify a shared prefix (the fixed instruction part)
+AFFINITY_PREFIX_CHARS = int(os.getenv("ROUTER_AFFINITY_PREFIX_CHARS", "256"))
+
+# A warm replica is kept while it has at most this many more queued requests than the idlest one
+AFFINITY_MAX_EXTRA_LOAD = int(os.getenv("ROUTER_AFFINITY_MAX_EXTRA_LOAD", "2"))
+
+# Prefixes remembered (LRU)
+AFFINITY_MAX_KEYS = int(os.getenv("ROUTER_AFFINITY_MAX_KEYS", "4096"))
+
+# --------------------------------------------------------------------
+# Proxying
+# --------------------------------------------------------------------
+
+# Replicas tried per request - a refused/failed/429 attempt moves on to the next best one
+MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "2"))
+
+# Upstream timeout (long audio transcriptions run well past a minute)
+REQUEST_TIMEOUT_S = float(os.getenv("ROUTER_REQUEST_TIMEOUT_S", "300"))
+
+# How often a waiting request checks whether its client has hung up (the upstream call is then cancelled)
+DISCONNECT_POLL_S = float(os.getenv("ROUTER_DISCONNECT_POLL_S", "0.25"))
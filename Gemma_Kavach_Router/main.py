@@ -0,0 +1,243 @@
+# main.py - Gemma Kavach Router
+#
+# Fronts N GemmaServer replicas behind one URL:
+#     GEMMA_REPLICAS=http://gpu-a:8000,http://gpu-b:8000 uvicorn main:app --port 8000
+# Every path that isn't the router's own (/livez, /readyz, /replicas, /metrics)
+# is proxied unchanged to the best replica - see replicas.py for how it's picked.
+import asyncio
+import json
+import time
+
+import aiohttp
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+import config
+from replicas import ReplicaPool, affinity_key
+from router_metrics import RouterMetrics
+
+app = FastAPI(
+    title="Gemma Kavach Router",
+    description="Load- and prefix-aware router in front of GemmaServer replicas",
+    version="1.0.0"
+)
+
+metrics = RouterMetrics()
+pool = ReplicaPool(
+    config.REPLICAS,
+    poll_interval_s=config.POLL_INTERVAL_S,
+    poll_timeout_s=config.POLL_TIMEOUT_S,
+    eject_after=config.EJECT_AFTER_FAILURES,
+    eject_cooldown_s=config.EJECT_COOLDOWN_S,
+    affinity_max_extra_load=config.AFFINITY_MAX_EXTRA_LOAD,
+    affinity_max_keys=config.AFFINITY_MAX_KEYS,
+    metrics=metrics,
+)
+metrics.watch_pool(pool)
+session = None
+
+# Headers that describe one hop, not the request/response itself
+HOP_HEADERS = {
+    "host", "connection", "keep-alive", "proxy-authorization", "proxy-connection",
+    "te", "trailer", "transfer-encoding", "upgrade", "content-length", "content-encoding",
+}
+
+# Upstream answers that another replica may not give: queue full / not ready
+RETRY_STATUSES = {429, 503}
+
+def replica_failed(status):
+    """5xx counts towards ejection - except 504, the replica's answer when the caller's own deadline passed"""
+    return status >= 500 and status != 504
+
+class ClientGone(Exception):
+    """The router's caller hung up while a replica was still working for it"""
+
+async def unless_disconnected(request, awaitable):
+    """Await an upstream call, cancelling it if the client disconnects first
+
+    A replica only sees its own socket, so the cancelled call's connection is
+    what tells it to stop generating for a caller that's gone.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=config.DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientGone()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+@app.on_event("startup")
+async def start_pool():
+    global session
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.REQUEST_TIMEOUT_S))
+    await pool.start(session)
+    print(f"🔀 Routing across {len(pool.replicas)} replicas: {', '.join(r.url for r in pool.replicas)}")
+
+@app.on_event("shutdown")
+async def stop_pool():
+    await pool.stop()
+    await session.close()
+
+# --------------------------------------------------------------------
+# Router endpoints
+# --------------------------------------------------------------------
+
+@app.get("/livez")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Ready while at least one replica is routable"""
+    stats = pool.stats()
+    ready = stats["routable"] > 0
+    body = {"status": "ready" if ready else "not_ready", **stats}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/replicas")
+async def replica_stats():
+    """Readiness, queue depth, in-flight requests and ejections per replica"""
+    return pool.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape target for the router and the fleet it sees"""
+    return PlainTextResponse(metrics.export(), media_type="text/plain; version=0.0.4")
+
+# --------------------------------------------------------------------
+# Proxy
+# --------------------------------------------------------------------
+
+async def request_prompt(request, body):
+    """The prompt a GemmaServer request will be prefilled with (query, JSON or form field)"""
+    params = request.query_params
+    prompt = params.get("prompt") or params.get("prompts")
+    if prompt:
+        return prompt
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if isinstance(data, dict):
+            prompt = data.get("prompt") or (data.get("prompts") or [None])[0]
+    elif content_type.startswith("multipart/form-data"):
+        form = await request.form()  # parsed from the already-read body
+        prompt = form.get("prompt") or form.get("prompts")
+        await form.close()
+    return prompt if isinstance(prompt, str) else None
+
+def response_headers(upstream, replica):
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS}
+    headers["X-Replica"] = replica.url
+    return headers
+
+def finish(upstream, replica, completed):
+    """Release a fully read response; close an abandoned one so the replica sees the disconnect"""
+    if completed:
+        upstream.release()
+    else:
+        upstream.close()
+    replica.inflight -= 1
+
+def client_gone(replica):
+    metrics.requests.labels(replica.url, "disconnected").inc()
+    return Response(status_code=499)  # nobody is left to read it
+
+async def relay(upstream, replica, streamed, request):
+    """Hand the replica's response to the client; the replica stays in flight until it's done
+
+    If the client leaves first the upstream connection is closed rather than
+    released, so the replica cancels the generation too.
+    """
+    if not streamed:
+        finished = False
+        try:
+            content = await unless_disconnected(request, upstream.read())
+            finished = True
+        except ClientGone:
+            return client_gone(replica)
+        finally:
+            finish(upstream, replica, finished)
+        return Response(content, status_code=upstream.status, headers=response_headers(upstream, replica))
+
+    async def chunks():
+        finished = False
+        try:
+            async for chunk in upstream.content.iter_any():
+                yield chunk
+            finished = True
+        finally:
+            finish(upstream, replica, finished)
+
+    return StreamingResponse(chunks(), status_code=upstream.status, headers=response_headers(upstream, replica))
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def proxy(path: str, request: Request):
+    body = await request.body()
+    key = affinity_key(request.url.path, await request_prompt(request, body), config.AFFINITY_PREFIX_CHARS)
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    streamed = request.url.path.endswith("/stream")
+
+    tried = []
+    for attempt in range(config.MAX_ATTEMPTS):
+        candidates = pool.candidates(key, exclude=tried)
+        if not candidates:
+            break
+        replica = candidates[0]
+        can_retry = attempt + 1 < config.MAX_ATTEMPTS and len(candidates) > 1
+        tried.append(replica.url)
+
+        replica.inflight += 1
+        replica.requests += 1
+        started = time.perf_counter()
+        try:
+            upstream = await unless_disconnected(request, session.request(
+                request.method, f"{replica.url}{request.url.path}",
+                params=list(request.query_params.multi_items()), data=body, headers=headers,
+            ))
+        except ClientGone:
+            replica.inflight -= 1
+            return client_gone(replica)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            replica.inflight -= 1
+            replica.errors += 1
+            pool.record_failure(replica, f"request: {exc!r}", request=True)
+            metrics.requests.labels(replica.url, "error").inc()
+            if can_retry:
+                metrics.retries.labels("error").inc()
+                continue
+            return JSONResponse({"detail": f"Replica {replica.url} failed: {exc!r}"}, status_code=502)
+
+        metrics.latency.labels(replica.url).observe(time.perf_counter() - started)
+        metrics.requests.labels(replica.url, str(upstream.status)).inc()
+        if replica_failed(upstream.status):
+            replica.errors += 1
+            pool.record_failure(replica, f"request: HTTP {upstream.status}", request=True)
+        elif upstream.status < 500:
+            pool.record_success(replica)
+
+        if upstream.status in RETRY_STATUSES and can_retry:
+            upstream.release()
+            replica.inflight -= 1
+            replica.ready = False  # until the next poll says otherwise
+            metrics.retries.labels(str(upstream.status)).inc()
+            continue
+
+        if upstream.status < 400:
+            pool.remember(key, replica)
+        return await relay(upstream, replica, streamed, request)
+
+    metrics.unroutable.inc()
+    return JSONResponse({"detail": "No Gemma replica is ready"}, status_code=503, headers={"Retry-After": "1"})
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,207 @@
+"""
+Replica pool for the Gemma router
+
+Every replica's /readyz is polled in the background for readiness and queue
+depth. A request goes to the routable replica with the least load (polled
+queue depth + requests this router has in flight there), except that a
+prompt whose prefix was recently served by a replica goes back to it - that
+replica holds the prefix's KV cache warm - as long as it isn't more than
+AFFINITY_MAX_EXTRA_LOAD requests busier than the idlest one.
+
+Replicas that fail EJECT_AFTER_FAILURES polls or requests in a row are
+ejected for EJECT_COOLDOWN_S; the first passing poll after that readmits them.
+Polls and requests are counted apart: a replica whose /readyz stays green
+while its requests fail 500 must not have that streak reset by every poll.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.ready = False
+        self.queue_depth = 0
+        self.inflight = 0
+        self.failures = 0             # consecutive failed polls
+        self.request_failures = 0     # consecutive failed requests
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.requests = 0
+        self.errors = 0
+        self.last_poll_at = None
+        self.last_error = None
+
+    @property
+    def ejected(self):
+        return time.time() < self.ejected_until
+
+    @property
+    def routable(self):
+        return self.ready and not self.ejected
+
+    @property
+    def load(self):
+        return self.queue_depth + self.inflight
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "routable": self.routable,
+            "ready": self.ready,
+            "ejected": self.ejected,
+            "queue_depth": self.queue_depth,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "consecutive_failures": self.failures,
+            "consecutive_request_failures": self.request_failures,
+            "last_poll_at": self.last_poll_at,
+            "last_error": self.last_error,
+        }
+
+def affinity_key(path, prompt, prefix_chars):
+    """Replicas cache KV per token prefix, so the prompt's leading text identifies it"""
+    if not prompt:
+        return None
+    return hashlib.sha1(f"{path}\n{prompt[:prefix_chars]}".encode()).hexdigest()
+
+class ReplicaPool:
+    def __init__(self, urls, poll_interval_s=1.0, poll_timeout_s=2.0, eject_after=3,
+                 eject_cooldown_s=30.0, affinity_max_extra_load=2, affinity_max_keys=4096, metrics=None):
+        if not urls:
+            raise ValueError("No replicas configured (set GEMMA_REPLICAS)")
+        self.replicas = [Replica(url) for url in urls]
+        self.poll_interval_s = poll_interval_s
+        self.poll_timeout_s = poll_timeout_s
+        self.eject_after = eject_after
+        self.eject_cooldown_s = eject_cooldown_s
+        self.affinity_max_extra_load = affinity_max_extra_load
+        self.affinity_max_keys = affinity_max_keys
+        self.metrics = metrics
+        self._affinity = OrderedDict()  # prefix key -> replica url (LRU)
+        self._task = None
+        self._session = None
+
+    # ---------------- polling ----------------
+
+    async def start(self, session):
+        self._session = session
+        await self.poll_all()  # route from real readiness right away
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval_s)
+            await self.poll_all()
+
+    async def poll_all(self):
+        await asyncio.gather(*(self.poll(replica) for replica in self.replicas))
+
+    async def poll(self, replica):
+        """/readyz answers 503 while not ready, so the body is read either way"""
+        timeout = aiohttp.ClientTimeout(total=self.poll_timeout_s)
+        try:
+            async with self._session.get(f"{replica.url}/readyz", timeout=timeout) as response:
+                body = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+            self.record_failure(replica, f"poll: {exc!r}")
+            return
+        finally:
+            replica.last_poll_at = time.time()
+
+        replica.queue_depth = int(body.get("queue_depth") or 0)
+        if not body.get("worker_alive", True):
+            # A dead worker never recovers on its own - treat it like an unreachable replica
+            replica.ready = False
+            self.record_failure(replica, "poll: worker not alive")
+            return
+
+        # Full queue or a failing self-test: skip it, but it is still up
+        replica.ready = body.get("status") == "ready"
+        if not replica.ejected:
+            replica.failures = 0
+
+    # ---------------- failures ----------------
+
+    def record_failure(self, replica, reason, request=False):
+        if request:
+            replica.request_failures += 1
+        else:
+            replica.failures += 1
+        replica.last_error = reason
+        streak = max(replica.failures, replica.request_failures)
+        if streak >= self.eject_after and not replica.ejected:
+            replica.ejected_until = time.time() + self.eject_cooldown_s
+            replica.ejections += 1
+            replica.request_failures = 0  # readmitted by a poll, with a clean slate
+            replica.ready = False
+            self._forget(replica)
+            if self.metrics is not None:
+                self.metrics.ejections.labels(replica.url).inc()
+            print(f"🚫 Ejected {replica.url} for {self.eject_cooldown_s:.0f}s ({reason})")
+
+    def record_success(self, replica):
+        replica.failures = 0
+        replica.request_failures = 0
+
+    def _forget(self, replica):
+        """An ejected replica's warm prefixes are no reason to wait for it"""
+        for key in [k for k, url in self._affinity.items() if url == replica.url]:
+            del self._affinity[key]
+
+    # ---------------- routing ----------------
+
+    def candidates(self, key=None, exclude=()):
+        """Routable replicas, best first"""
+        available = [r for r in self.replicas if r.routable and r.url not in exclude]
+        if not available:
+            return []
+        available.sort(key=lambda r: r.load)
+
+        warm_url = self._affinity.get(key) if key else None
+        warm = next((r for r in available if r.url == warm_url), None)
+        if warm is None:
+            result = "miss" if key else "none"
+        elif warm.load <= available[0].load + self.affinity_max_extra_load:
+            result = "hit"
+            available.remove(warm)
+            available.insert(0, warm)
+        else:
+            result = "overloaded"  # warm replica too busy - a cold prefill elsewhere is cheaper
+
+        if self.metrics is not None and not exclude:
+            self.metrics.affinity.labels(result).inc()
+        return available
+
+    def remember(self, key, replica):
+        if key is None:
+            return
+        self._affinity[key] = replica.url
+        self._affinity.move_to_end(key)
+        while len(self._affinity) > self.affinity_max_keys:
+            self._affinity.popitem(last=False)
+
+    def stats(self):
+        routable = [r for r in self.replicas if r.routable]
+        return {
+            "replicas": len(self.replicas),
+            "routable": len(routable),
+            "total_queue_depth": sum(r.queue_depth for r in self.replicas),
+            "total_inflight": sum(r.inflight for r in self.replicas),
+            "affinity_keys": len(self._affinity),
+            "by_replica": [r.stats() for r in self.replicas],
+        }
@@ -0,0 +1,45 @@
+"""
+Prometheus metrics for the Gemma router
+
+Per-replica series (queue depth, in-flight, routable) come straight from the
+latest /readyz poll, so one scrape of the router shows the whole fleet.
+"""
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class RouterMetrics:
+    def __init__(self):
+        self.registry = CollectorRegistry()
+        r = self.registry
+
+        self.requests = Counter("gemma_router_requests", "Proxied requests by replica and upstream status",
+                                ["replica", "status"], registry=r)
+        self.latency = Histogram("gemma_router_upstream_latency_seconds", "Time to the replica's response headers",
+                                 ["replica"], buckets=LATENCY_BUCKETS, registry=r)
+        self.retries = Counter("gemma_router_retries", "Attempts moved to another replica", ["reason"], registry=r)
+        self.unroutable = Counter("gemma_router_unroutable", "Requests answered 503 with no replica available",
+                                  registry=r)
+        self.ejections = Counter("gemma_router_ejections", "Times a replica was taken out of rotation",
+                                 ["replica"], registry=r)
+        self.affinity = Counter("gemma_router_affinity", "Prefix affinity lookups (hit, miss, overloaded, none)",
+                                ["result"], registry=r)
+
+    def watch_pool(self, pool):
+        queue_depth = Gauge("gemma_router_replica_queue_depth", "Queue depth from the last /readyz poll",
+                            ["replica"], registry=self.registry)
+        inflight = Gauge("gemma_router_replica_inflight", "Requests this router has in flight on the replica",
+                         ["replica"], registry=self.registry)
+        routable = Gauge("gemma_router_replica_routable", "1 while the replica is ready and not ejected",
+                         ["replica"], registry=self.registry)
+        for replica in pool.replicas:
+            queue_depth.labels(replica.url).set_function(lambda r=replica: r.queue_depth)
+            inflight.labels(replica.url).set_function(lambda r=replica: r.inflight)
+            routable.labels(replica.url).set_function(lambda r=replica: int(r.routable))
+
+        total = Gauge("gemma_router_total_queue_depth", "Queue depth summed over all replicas", registry=self.registry)
+        total.set_function(lambda: sum(r.queue_depth for r in pool.replicas))
+
+    def export(self):
+        return generate_latest(self.registry)
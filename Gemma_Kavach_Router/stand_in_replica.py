@@ -0,0 +1,144 @@
+# stand_in_replica.py - A GemmaServer look-alike for exercising the router locally
+#
+# No model: one request at a time behind a lock (like the batch worker), with a
+# prefill delay that is skipped for prompt prefixes this replica has seen before
+# (like the prefix KV cache). Start a few on different ports:
+#     STAND_IN_NAME=a uvicorn stand_in_replica:app --port 9001
+#     STAND_IN_NAME=b uvicorn stand_in_replica:app --port 9002
+# POST /stand_in/kill makes /readyz report a dead worker; /stand_in/revive undoes it.
+# POST /stand_in/break makes every request answer 500 (or ?status=) while /readyz stays ready.
+# A request whose caller hangs up is abandoned and counted as "cancelled".
+import asyncio
+import json
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+NAME = os.getenv("STAND_IN_NAME", "stand-in")
+PREFILL_MS = float(os.getenv("STAND_IN_PREFILL_MS", "100"))  # cold prefix only
+DECODE_MS = float(os.getenv("STAND_IN_DECODE_MS", "50"))
+MAX_QUEUE = int(os.getenv("STAND_IN_MAX_QUEUE", "64"))
+PREFIX_CHARS = 256
+
+app = FastAPI(title=f"Gemma stand-in replica ({NAME})")
+
+worker = asyncio.Lock()
+state = {"queue_depth": 0, "alive": True, "broken": None, "served": 0, "prefix_hits": 0, "cancelled": 0}
+warm_prefixes = set()
+
+async def prompt_of(request):
+    prompt = request.query_params.get("prompt")
+    if prompt:
+        return prompt
+    if request.headers.get("content-type", "").startswith("application/json"):
+        data = await request.json()
+        return data.get("prompt") or (data.get("prompts") or [""])[0]
+    form = await request.form()
+    return form.get("prompt") or form.get("prompts") or ""
+
+async def busy(request, seconds):
+    """Sleep like a generation would, giving up (False) once the caller disconnects"""
+    finish_at = time.perf_counter() + seconds
+    while (left := finish_at - time.perf_counter()) > 0:
+        if await request.is_disconnected():
+            state["cancelled"] += 1
+            return False
+        await asyncio.sleep(min(left, 0.02))
+    return True
+
+async def run(prompt, request):
+    """Wait for the worker, then 'prefill' (unless warm) and 'decode'; None if the caller left"""
+    state["queue_depth"] += 1
+    try:
+        await worker.acquire()
+    finally:
+        state["queue_depth"] -= 1
+    try:
+        prefix = prompt[:PREFIX_CHARS]
+        warm = prefix in warm_prefixes
+        if not await busy(request, ((0 if warm else PREFILL_MS) + DECODE_MS) / 1000):
+            return None
+        warm_prefixes.add(prefix)
+    finally:
+        worker.release()
+    state["served"] += 1
+    state["prefix_hits"] += warm
+    return warm
+
+@app.get("/livez")
+async def liveness():
+    return {"status": "alive" if state["alive"] else "dead", "worker_alive": state["alive"]}
+
+@app.get("/readyz")
+async def readiness():
+    ready = state["alive"] and state["queue_depth"] < MAX_QUEUE
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "worker_alive": state["alive"],
+        "queue_depth": state["queue_depth"],
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/stand_in")
+async def stand_in_stats():
+    return {"name": NAME, **state, "warm_prefixes": len(warm_prefixes)}
+
+@app.post("/stand_in/kill")
+async def kill():
+    state["alive"] = False
+    return {"name": NAME, "alive": False}
+
+@app.post("/stand_in/revive")
+async def revive():
+    state["alive"] = True
+    state["broken"] = None
+    return {"name": NAME, "alive": True}
+
+@app.post("/stand_in/break")
+async def break_requests(status: int = 500):
+    state["broken"] = status
+    return {"name": NAME, "broken": status}
+
+@app.api_route("/{path:path}/stream", methods=["POST"])
+async def stream(path: str, request: Request):
+    prompt = await prompt_of(request)
+    warm = await run(prompt, request)
+    if warm is None:
+        return Response(status_code=499)
+
+    async def events():
+        # One token per DECODE_MS; a client leaving mid-stream cancels the rest
+        words = f"{NAME} answered {'warm' if warm else 'cold'}".split()
+        sent = 0
+        try:
+            for word in words:
+                await asyncio.sleep(DECODE_MS / 1000)
+                yield f"data: {json.dumps({'token': word + ' '})}\n\n"
+                sent += 1
+            yield "data: [DONE]\n\n"
+        finally:
+            if sent < len(words):
+                state["cancelled"] += 1
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.api_route("/{path:path}", methods=["POST"])
+async def answer(path: str, request: Request):
+    if not state["alive"]:
+        return JSONResponse({"detail": "Batch worker is not running"}, status_code=503)
+    if state["broken"]:
+        return JSONResponse({"detail": f"Stand-in broken: HTTP {state['broken']}"}, status_code=state["broken"])
+    if state["queue_depth"] >= MAX_QUEUE:
+        return JSONResponse({"detail": "Queue full"}, status_code=429, headers={"Retry-After": "1"})
+    prompt = await prompt_of(request)
+    warm = await run(prompt, request)
+    if warm is None:
+        return Response(status_code=499)
+    return {
+        "response": f"{NAME} answered",
+        "replica": NAME,
+        "prefix_cache": "hit" if warm else "miss",
+        "prompt_used": prompt,
+    }
@@ -0,0 +1,88 @@
+"""
+Fixtures - stand-in replicas and the router itself, each a uvicorn process on a free port
+
+    cd Gemma_Kavach_Router && python -m pytest tests
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from contextlib import contextmanager
+
+import httpx
+import pytest
+
+ROUTER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(module, port, env):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROUTER_DIR, env={**os.environ, **env},
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            httpx.get(f"{url}/livez", timeout=1)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{module} did not start on port {port}")
+
+class Fleet:
+    def __init__(self, replicas, router, processes):
+        self.replicas = replicas  # name -> url
+        self.router = router
+        self.processes = processes  # name -> process, "router" included
+
+    def stop(self, name):
+        self.processes[name].terminate()
+        self.processes[name].wait(10)
+
+    def stand_in(self, name):
+        return httpx.get(f"{self.replicas[name]}/stand_in").json()
+
+    def replica(self, name):
+        """The router's view of one replica"""
+        by_url = {r["url"]: r for r in httpx.get(f"{self.router}/replicas").json()["by_replica"]}
+        return by_url[self.replicas[name]]
+
+@contextmanager
+def running_fleet(decode_ms):
+    """Stand-ins a and b (a is picked first while both are idle) behind a fresh router"""
+    processes, replicas = {}, {}
+    try:
+        for name in ("a", "b"):
+            processes[name], replicas[name] = serve("stand_in_replica", free_port(), {
+                "STAND_IN_NAME": name, "STAND_IN_PREFILL_MS": "0", "STAND_IN_DECODE_MS": str(decode_ms),
+            })
+        processes["router"], router = serve("main", free_port(), {
+            "GEMMA_REPLICAS": ",".join(replicas.values()),
+            "ROUTER_POLL_INTERVAL_S": "0.2",
+            "ROUTER_EJECT_COOLDOWN_S": "60",
+            "ROUTER_DISCONNECT_POLL_S": "0.05",
+        })
+        yield Fleet(replicas, router, processes)
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.wait(10)
+
+@pytest.fixture
+def fleet():
+    with running_fleet(decode_ms=20) as fleet:
+        yield fleet
+
+@pytest.fixture
+def slow_fleet():
+    """Half a second per request (and per streamed token): long enough to hang up on"""
+    with running_fleet(decode_ms=500) as fleet:
+        yield fleet
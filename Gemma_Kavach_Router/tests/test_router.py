@@ -0,0 +1,73 @@
+import time
+
+import httpx
+import pytest
+
+def generate(fleet, prompt, timeout=10):
+    return httpx.post(f"{fleet.router}/generate", json={"prompt": prompt}, timeout=timeout)
+
+def wait_until(condition, timeout_s=5):
+    for _ in range(int(timeout_s / 0.02)):
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError("timed out")
+
+def test_replica_failing_with_500_is_ejected(fleet):
+    httpx.post(f"{fleet.replicas['a']}/stand_in/break")
+
+    statuses = []
+    for i in range(3):
+        statuses.append(generate(fleet, f"x{i}").status_code)
+        time.sleep(0.3)  # passing /readyz polls in between don't reset the streak
+    assert statuses == [500, 500, 500]  # not retried: the request itself may be what fails
+
+    a = fleet.replica("a")
+    assert a["ejected"] and a["ejections"] == 1 and a["errors"] == 3
+    for i in range(3):
+        reply = generate(fleet, f"y{i}")
+        assert reply.status_code == 200
+        assert reply.headers["X-Replica"] == fleet.replicas["b"]
+
+def test_gateway_timeout_is_not_held_against_the_replica(fleet):
+    httpx.post(f"{fleet.replicas['a']}/stand_in/break", params={"status": 504})
+
+    for i in range(4):
+        assert generate(fleet, f"x{i}").status_code == 504
+
+    a = fleet.replica("a")
+    assert not a["ejected"] and a["errors"] == 0 and a["consecutive_request_failures"] == 0
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_busy_replica_is_retried_on_the_next(fleet, status):
+    httpx.post(f"{fleet.replicas['a']}/stand_in/break", params={"status": status})
+
+    reply = generate(fleet, "x")
+    assert reply.status_code == 200
+    assert reply.json()["replica"] == "b"
+    assert not fleet.replica("a")["ejected"]
+
+def test_unreachable_replica_is_retried_on_the_next(fleet):
+    fleet.stop("a")  # still routable until its polls fail
+
+    reply = generate(fleet, "x")
+    assert reply.status_code == 200
+    assert reply.json()["replica"] == "b"
+    assert fleet.replica("a")["errors"] >= 1
+
+def test_client_disconnect_cancels_the_replica_request(slow_fleet):
+    with pytest.raises(httpx.ReadTimeout):
+        generate(slow_fleet, "x", timeout=0.1)
+
+    wait_until(lambda: slow_fleet.stand_in("a")["cancelled"] == 1)
+    assert slow_fleet.stand_in("a")["served"] == 0
+    wait_until(lambda: slow_fleet.replica("a")["inflight"] == 0)
+
+def test_client_disconnect_mid_stream_cancels_the_replica_stream(slow_fleet):
+    with httpx.stream("POST", f"{slow_fleet.router}/generate/stream", json={"prompt": "x"}, timeout=10) as reply:
+        assert reply.status_code == 200
+        first = next(reply.iter_lines())
+        assert first.startswith("data: ")
+
+    wait_until(lambda: slow_fleet.stand_in("a")["cancelled"] == 1)
+    wait_until(lambda: slow_fleet.replica("a")["inflight"] == 0)
@@ -4,6 +4,7 @@ from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import aiohttp
 import asyncio
+import os
 from utils import (
     save_session_to_gcs, 
     load_session_from_gcs,
@@ -22,8 +23,11 @@ from utils import (
 # Create router
 router = APIRouter()
 
-# Gemma server configuration
-GEMMA_API_URL = "https://l63p034w6181jc-8000.proxy.runpod.net/ask_image"
+# Gemma server configuration (point GEMMA_SERVER_URL at the router to spread load over replicas)
+GEMMA_SERVER_URL = os.getenv("GEMMA_SERVER_URL", "https://l63p034w6181jc-8000.proxy.runpod.net/")
+GEMMA_API_URL = GEMMA_SERVER_URL.rstrip("/") + "/ask_image"
+# A frame older than this is no use for live monitoring; the server stops decoding at the same deadline
+GEMMA_TIMEOUT_S = 60
 # Improved analysis prompts
 CROWD_DENSITY_PROMPT = (
     "Analyze this image and determine the crowd density level. "
@@ -85,43 +89,41 @@ class SessionStatusResponse(BaseModel):
 
 async def analyze_frame_dual(image_content: bytes, filename: str) -> Dict[str, str]:
     """
-    Perform dual analysis on a single frame using async calls
+    Perform dual analysis on a single frame with one upload
+    Both prompts go to Gemma together so the frame is sent and encoded once
     Returns: {"density": "Low/Medium/High", "motion": "Calm/Chaotic"}
     """
-    async def call_gemma_api(prompt: str, session: aiohttp.ClientSession) -> str:
-        """Make a single API call to Gemma"""
-        try:
-            data = aiohttp.FormData()
-            data.add_field('image', image_content, filename=filename, content_type='image/jpeg')
-            data.add_field('prompt', prompt)
-            
-            async with session.post(GEMMA_API_URL, data=data) as response:
+    try:
+        data = aiohttp.FormData()
+        data.add_field('image', image_content, filename=filename, content_type='image/jpeg')
+        data.add_field('prompts', CROWD_DENSITY_PROMPT)
+        data.add_field('prompts', CROWD_MOTION_PROMPT)
+        # Constrain each answer to its label set (one `choices` field per prompt)
+        data.add_field('choices', 'Low|Medium|High')
+        data.add_field('choices', 'Calm|Chaotic')
+
+        timeout = aiohttp.ClientTimeout(total=GEMMA_TIMEOUT_S)
+        headers = {"X-Deadline-Ms": str(GEMMA_TIMEOUT_S * 1000)}
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(GEMMA_API_URL, data=data, headers=headers) as response:
                 if response.status != 200:
                     raise Exception(f"Gemma API error: {response.status}")
-                
+
                 result = await response.json()
-                return result.get("text", "").strip()
-                
-        except Exception as e:
-            print(f"❌ Gemma API call failed: {e}")
-            return "Unknown"
-    
-    # Make both API calls concurrently
-    async with aiohttp.ClientSession() as session:
-        density_task = call_gemma_api(CROWD_DENSITY_PROMPT, session)
-        motion_task = call_gemma_api(CROWD_MOTION_PROMPT, session)
-        
-        # Wait for both results
-        density_result, motion_result = await asyncio.gather(density_task, motion_task)
-        
-        # Clean and validate results
-        density = density_result.title() if density_result.lower() in ['low', 'medium', 'high'] else 'Unknown'
-        motion = motion_result.title() if motion_result.lower() in ['calm', 'chaotic'] else 'Unknown'
-        
-        return {
-            "density": density,
-            "motion": motion
-        }
+                density_result, motion_result = [t.strip() for t in result.get("texts", ["", ""])]
+
+    except Exception as e:
+        print(f"❌ Gemma API call failed: {e}")
+        density_result, motion_result = "Unknown", "Unknown"
+
+    # Clean and validate results
+    density = density_result.title() if density_result.lower() in ['low', 'medium', 'high'] else 'Unknown'
+    motion = motion_result.title() if motion_result.lower() in ['calm', 'chaotic'] else 'Unknown'
+
+    return {
+        "density": density,
+        "motion": motion
+    }
 
 def determine_risk_level(density: str, motion: str) -> tuple[bool, str]:
     """
@@ -347,7 +349,7 @@ async def monitoring_status():
         "service": "monitoring",
         "status": "available",
         "analysis_type": "dual_crowd_analysis",
-        "features": ["crowd_density_detection", "panic_behavior_detection", "async_api_calls"],
+        "features": ["crowd_density_detection", "panic_behavior_detection", "single_upload_dual_prompt"],
         "gcs": gcs_info,
         "gemma_api": GEMMA_API_URL,
         "endpoints": ["/session/create", "/session/{id}/frame", "/session/{id}"]
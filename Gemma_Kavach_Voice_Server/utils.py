@@ -1,7 +1,6 @@
 # Enhanced utils.py with Google Text-to-Speech
 
 import requests
-import base64
 import pandas as pd
 import os
 from google.cloud import texttospeech
@@ -9,25 +8,28 @@ import tempfile
 import json
 
 # Configuration
-SERVER_URL = "https://l63p034w6181jc-8000.proxy.runpod.net/"
+SERVER_URL = os.getenv("SERVER_URL", "https://l63p034w6181jc-8000.proxy.runpod.net/")  # a single replica or the router
 TEST_MODE = False
+REQUEST_TIMEOUT_S = 90
+# Tell the server when we stop waiting, so it stops decoding too
+DEADLINE_HEADERS = {"X-Deadline-Ms": str(REQUEST_TIMEOUT_S * 1000)}
 GOOGLE_TTS_API_KEY = os.getenv("GOOGLE_TEXT_TO_SPEECH")
 
 def transcribe_audio_from_bytes(audio_bytes: bytes, prompt="Transcribe this audio"):
     """Get transcription from audio bytes with enhanced error handling and fallback"""
     try:
-        # Convert audio to base64
-        audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
-        
-        # Try the main transcription endpoint first
-        data = {"data": audio_base64, "prompt": "Transcribe this in Hindi"}
+        # Send raw audio bytes (no base64 inflation) to the binary endpoint.
+        # No `speculative` here: it would switch transcription to greedy decoding once a draft model is loaded
+        params = {"prompt": "Transcribe this in Hindi"}
+        headers = {"Content-Type": "audio/wav", **DEADLINE_HEADERS}
         
         print(f"📤 Sending audio data ({len(audio_bytes)} bytes) to RunPod server...")
         
         # Try multiple times with different configurations
         for attempt in range(3):
             try:
-                response = requests.post(f"{SERVER_URL}ask", json=data, timeout=90)
+                response = requests.post(f"{SERVER_URL}ask_audio", params=params, data=audio_bytes,
+                                         headers=headers, timeout=REQUEST_TIMEOUT_S)
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -83,9 +85,12 @@ Output: B
 Input: "{text}"
 Output:"""
 
-    data = {"prompt": prompt, "max_tokens": 10, "processing_mode": "force_off"}
+    # Server-side constrained decoding: the answer is always one zone letter/number (or None)
+    zones = [chr(c) for c in range(ord("A"), ord("Z") + 1)] + [str(n) for n in range(1, 10)]
+    data = {"prompt": prompt, "max_tokens": 10, "processing_mode": "force_off", "choices": zones + ["None"]}
     
-    response = requests.post(f"{SERVER_URL}/generate", json=data, timeout=90)
+    response = requests.post(f"{SERVER_URL}/generate", json=data, headers=DEADLINE_HEADERS,
+                             timeout=REQUEST_TIMEOUT_S)
     
     if response.status_code == 200:
         zone = response.json()["text"].strip()
@@ -211,9 +216,11 @@ Example style: "स्थिति सामान्य है। रिस्
 
 Hindi Message:"""
 
-        data = {"prompt": prompt, "max_tokens": 200}
+        # Long output - ask for speculative decoding (ignored if the server has no draft model)
+        data = {"prompt": prompt, "max_tokens": 200, "speculative": True}
         
-        response = requests.post(f"{SERVER_URL}/generate", json=data, timeout=90)
+        response = requests.post(f"{SERVER_URL}/generate", json=data, headers=DEADLINE_HEADERS,
+                                 timeout=REQUEST_TIMEOUT_S)
         
         if response.status_code == 200:
             hindi_message = response.json()["text"].strip()
@@ -0,0 +1,386 @@
+"""
+Replayable load test for GemmaServer
+
+Replays a workload file (one JSON request per line) against a server and
+reports p50/p95/p99 latency, throughput and error rates, overall and per
+endpoint, plus generated tokens/s and the backend that produced them.
+
+    python benchmark.py workloads/mixed.jsonl --url http://localhost:8000 --concurrency 8
+    python benchmark.py workloads/mixed.jsonl --url ... --rate 5 --requests 200   # open loop
+    python benchmark.py recorded.jsonl --url ... --replay                        # recorded timing
+    python benchmark.py workloads/mixed.jsonl --stub --save baseline.json         # laptop CPU
+    python benchmark.py workloads/mixed.jsonl --stub --baseline baseline.json     # regression check
+
+Workload lines:
+
+    {"endpoint": "/generate", "json": {"prompt": "...", "max_tokens": 32}}
+    {"endpoint": "/ask_image", "form": {"prompts": ["...", "..."]}, "files": {"image": "synthetic:jpeg"}}
+    {"endpoint": "/ask_audio", "params": {"prompt": "..."}, "body": "synthetic:wav"}
+
+`files`/`body` take a path (relative to the workload file) or synthetic:jpeg /
+synthetic:wav. Optional keys: `weight` (repeats per cycle), `offset_s` (arrival
+time for --replay), `headers`, `method` (default POST). Streaming endpoints are
+timed to their last byte.
+
+--stub starts gemma_server.py with GEMMA_STUB_MODEL=1 on CPU. The stand-in's
+weights are seeded and the request order is fixed, so the work done is the same
+on every run and results are comparable from commit to commit.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+import numpy as np
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "GemmaServer"
+
+# --------------------------------------------------------------------
+# Workload
+# --------------------------------------------------------------------
+
+def synthetic_jpeg(width=640, height=480):
+    from PIL import Image
+    pixels = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+def synthetic_wav(seconds=3, rate=16000):
+    import soundfile as sf
+    t = np.arange(int(seconds * rate)) / rate
+    buffer = io.BytesIO()
+    sf.write(buffer, 0.1 * np.sin(2 * np.pi * 440 * t), rate, format="WAV")
+    return buffer.getvalue()
+
+SYNTHETIC = {"synthetic:jpeg": synthetic_jpeg, "synthetic:wav": synthetic_wav}
+
+def load_workload(path):
+    """Parsed lines with media resolved to bytes (loaded once, shared by every replay)"""
+    base = Path(path).resolve().parent
+    media = {}
+
+    def resolve(ref):
+        if ref not in media:
+            media[ref] = SYNTHETIC[ref]() if ref in SYNTHETIC else (base / ref).read_bytes()
+        return media[ref]
+
+    items = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line)
+            if "endpoint" not in item:
+                raise ValueError(f"{path}:{number}: missing 'endpoint'")
+            item["files"] = {field: (ref, resolve(ref)) for field, ref in item.get("files", {}).items()}
+            if "body" in item:
+                item["body"] = resolve(item["body"])
+            items.append(item)
+    if not items:
+        raise ValueError(f"{path} has no requests")
+    return items
+
+def schedule(items, count):
+    """Deterministic request order: the file cycled, each line `weight` times per cycle"""
+    cycle = [item for item in items for _ in range(int(item.get("weight", 1)))]
+    count = count or len(cycle)
+    return [cycle[i % len(cycle)] for i in range(count)]
+
+# --------------------------------------------------------------------
+# Client
+# --------------------------------------------------------------------
+
+def request_kwargs(item):
+    kwargs = {"params": item.get("params"), "headers": dict(item.get("headers", {}))}
+    if "json" in item:
+        kwargs["json"] = item["json"]
+    elif "form" in item or item["files"]:
+        form = aiohttp.FormData()
+        for name, value in item.get("form", {}).items():
+            for v in value if isinstance(value, list) else [value]:
+                form.add_field(name, str(v))
+        for field, (ref, data) in item["files"].items():
+            form.add_field(field, data, filename=os.path.basename(ref.replace("synthetic:", "upload.")))
+        kwargs["data"] = form
+    elif "body" in item:
+        kwargs["data"] = item["body"]
+        kwargs["headers"].setdefault("Content-Type", "audio/wav")
+    return kwargs
+
+async def send(session, url, item):
+    started = time.perf_counter()
+    result = {"endpoint": item["endpoint"], "started": started}
+    try:
+        async with session.request(item.get("method", "POST"), url + item["endpoint"],
+                                   **request_kwargs(item)) as response:
+            await response.read()
+            result["status"] = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        result["status"] = None
+        result["error"] = type(exc).__name__
+    result["latency_s"] = time.perf_counter() - started
+    return result
+
+async def run_closed_loop(session, url, requests, concurrency):
+    """`concurrency` clients, each sending its next request as soon as the last one returns"""
+    queue = list(reversed(requests))
+    results = []
+
+    async def client():
+        while queue:
+            results.append(await send(session, url, queue.pop()))
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results
+
+async def run_open_loop(session, url, requests, offsets):
+    """Send each request at its arrival offset, whether or not earlier ones have returned"""
+    start = time.perf_counter()
+
+    async def at(offset, item):
+        await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+        return await send(session, url, item)
+
+    return list(await asyncio.gather(*(at(o, item) for o, item in zip(offsets, requests))))
+
+def poisson_offsets(count, rate, seed):
+    rng = random.Random(seed)
+    offsets, t = [], 0.0
+    for _ in range(count):
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+# --------------------------------------------------------------------
+# Report
+# --------------------------------------------------------------------
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def succeeded(result):
+    return result["status"] is not None and result["status"] < 400
+
+def summarize(results, wall_s):
+    ok = [r for r in results if succeeded(r)]
+    latencies = sorted(r["latency_s"] * 1000 for r in ok)
+    errors = defaultdict(int)
+    for r in results:
+        if not succeeded(r):
+            errors[str(r["status"] or r.get("error"))] += 1
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": dict(errors),
+        "throughput_rps": round(len(ok) / wall_s, 2) if wall_s else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if latencies else None,
+        "max_ms": round(latencies[-1], 1) if latencies else None,
+    }
+
+def report(results, wall_s):
+    by_endpoint = defaultdict(list)
+    for r in results:
+        by_endpoint[r["endpoint"]].append(r)
+    return {
+        "wall_s": round(wall_s, 2),
+        "overall": summarize(results, wall_s),
+        "endpoints": {name: summarize(rs, wall_s) for name, rs in sorted(by_endpoint.items())},
+    }
+
+def generated_tokens_per_s(before, after, wall_s):
+    if before is None or after is None or not wall_s:
+        return None
+    return round((after - before) / wall_s, 1)
+
+def print_report(summary, server_stats=None):
+    header = f"{'endpoint':<22}{'reqs':>6}{'err%':>7}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(f"\n📊 {summary['overall']['requests']} requests in {summary['wall_s']}s")
+    print(header)
+    print("-" * len(header))
+    rows = list(summary["endpoints"].items()) + [("overall", summary["overall"])]
+    for name, s in rows:
+        fmt = lambda v: "-" if v is None else f"{v:.1f}"
+        print(f"{name:<22}{s['requests']:>6}{s['error_rate'] * 100:>6.1f}%{s['throughput_rps']:>8.2f}"
+              f"{fmt(s['p50_ms']):>9}{fmt(s['p95_ms']):>9}{fmt(s['p99_ms']):>9}")
+    for name, s in rows:
+        if s["errors"]:
+            print(f"❌ {name}: {s['errors']}")
+    if summary.get("tokens_per_s") is not None:
+        backend = summary.get("backend") or {}
+        parts = [str(backend[k]) for k in ("device", "precision") if k in backend]
+        if "threads" in backend:
+            parts.append(f"{backend['threads']} threads")
+        where = ", ".join(parts)
+        print(f"⚡ {summary['tokens_per_s']} generated tokens/s ({where or 'backend unknown'})")
+    if server_stats:
+        print(f"📦 server: avg batch {server_stats.get('avg_batch_size')}, "
+              f"rejected {server_stats.get('rejected')}, p95 queue wait {server_stats.get('p95_queue_wait_ms')} ms")
+
+def compare(summary, baseline, max_regression):
+    """Regressions against a saved run: p95 latency, error rate and throughput"""
+    failures = []
+    for name, base in baseline["endpoints"].items():
+        now = summary["endpoints"].get(name)
+        if now is None:
+            failures.append(f"{name}: missing from this run")
+            continue
+        if base["p95_ms"] and now["p95_ms"] and now["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            failures.append(f"{name}: p95 {now['p95_ms']} ms vs {base['p95_ms']} ms")
+        if now["error_rate"] > base["error_rate"] + 0.01:
+            failures.append(f"{name}: error rate {now['error_rate']:.2%} vs {base['error_rate']:.2%}")
+    base, now = baseline["overall"]["throughput_rps"], summary["overall"]["throughput_rps"]
+    if base and now < base * (1 - max_regression):
+        failures.append(f"throughput {now} rps vs {base} rps")
+    base, now = baseline.get("tokens_per_s"), summary.get("tokens_per_s")
+    if base and now is not None and now < base * (1 - max_regression):
+        failures.append(f"decode throughput {now} tokens/s vs {base} tokens/s")
+    return failures
+
+# --------------------------------------------------------------------
+# Stub server
+# --------------------------------------------------------------------
+
+def start_stub_server(port, extra_env):
+    """gemma_server.py with the seeded stub model on CPU; returns once /readyz passes"""
+    env = {**os.environ, "GEMMA_STUB_MODEL": "1", "GEMMA_DEVICE": "cpu", **extra_env}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "gemma_server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Stub server exited during startup")
+        try:
+            import urllib.request
+            with urllib.request.urlopen(f"{url}/readyz", timeout=2) as response:
+                if response.status == 200:
+                    print(f"🧪 Stub server ready on {url}")
+                    return process, url
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Stub server did not become ready within 120s")
+
+async def fetch_json(session, url):
+    try:
+        async with session.get(url) as response:
+            return await response.json() if response.status == 200 else None
+    except aiohttp.ClientError:
+        return None
+
+async def fetch_generated_tokens(session, url):
+    """gemma_generated_tokens summed over endpoints, from the Prometheus scrape"""
+    try:
+        async with session.get(f"{url}/metrics") as response:
+            if response.status != 200:
+                return None
+            text = await response.text()
+    except aiohttp.ClientError:
+        return None
+    samples = [line for line in text.splitlines() if line.startswith("gemma_generated_tokens_total")]
+    return sum(float(line.rsplit(" ", 1)[1]) for line in samples) if samples else None
+
+async def benchmark(args, url):
+    items = load_workload(args.workload)
+    if args.replay:
+        requests = sorted(items, key=lambda item: item.get("offset_s", 0))
+        offsets = [item.get("offset_s", 0) / args.speed for item in requests]
+    else:
+        requests = schedule(items, args.requests)
+        offsets = poisson_offsets(len(requests), args.rate, args.seed) if args.rate else None
+
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        for item in requests[:args.warmup]:
+            await send(session, url, item)
+
+        mode = (f"replaying recorded timing x{args.speed}" if args.replay
+                else f"open loop at {args.rate} req/s" if args.rate
+                else f"closed loop, concurrency {args.concurrency}")
+        print(f"🚀 {len(requests)} requests against {url} ({mode})")
+        tokens_before = await fetch_generated_tokens(session, url)
+        started = time.perf_counter()
+        if offsets is not None:
+            results = await run_open_loop(session, url, requests, offsets)
+        else:
+            results = await run_closed_loop(session, url, requests, args.concurrency)
+        wall_s = time.perf_counter() - started
+        tokens_after = await fetch_generated_tokens(session, url)
+        server_stats = await fetch_json(session, f"{url}/scheduler")
+        capabilities = await fetch_json(session, f"{url}/capabilities") or {}
+
+    summary = report(results, wall_s)
+    summary["tokens_per_s"] = generated_tokens_per_s(tokens_before, tokens_after, wall_s)
+    summary["backend"] = capabilities.get("backend")
+    return summary, server_stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workload", help="JSONL workload file")
+    parser.add_argument("--url", default=os.getenv("GEMMA_SERVER_URL", "http://localhost:8000"))
+    parser.add_argument("--stub", action="store_true", help="start a local stub-model server and target it")
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--stub-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra env for the stub server, e.g. GEMMA_MAX_BATCH_SIZE=4")
+    parser.add_argument("--concurrency", type=int, default=4, help="closed-loop clients (default mode)")
+    parser.add_argument("--rate", type=float, help="open loop: Poisson arrivals per second")
+    parser.add_argument("--replay", action="store_true", help="open loop at each line's offset_s")
+    parser.add_argument("--speed", type=float, default=1.0, help="--replay time compression factor")
+    parser.add_argument("--requests", type=int, default=0, help="total requests (default: one cycle)")
+    parser.add_argument("--warmup", type=int, default=2, help="requests sent before timing starts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--save", help="write the summary JSON here")
+    parser.add_argument("--baseline", help="summary JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed relative p95/throughput regression vs --baseline")
+    args = parser.parse_args()
+
+    process, url = None, args.url.rstrip("/")
+    if args.stub:
+        process, url = start_stub_server(args.stub_port, dict(kv.split("=", 1) for kv in args.stub_env))
+    try:
+        summary, server_stats = asyncio.run(benchmark(args, url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    summary["config"] = {k: getattr(args, k) for k in ("workload", "concurrency", "rate", "replay", "requests", "stub")}
+    print_report(summary, server_stats)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Summary written to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(summary, json.load(f), args.max_regression)
+        if failures:
+            print("❌ Regressions vs baseline:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("✅ No regressions vs baseline")
+
+if __name__ == "__main__":
+    main()